@@ -0,0 +1,193 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from PySide6.QtCore import QObject, Signal
+from PySide6.QtGui import QImageReader
+
+from ImageCache import ImageCache
+
+
+class DatasetNavigator(QObject):
+    """
+    フォルダ内の画像を前後に移動しながら表示するためのクラス.
+
+    表示中の画像と、その前後の画像をワーカースレッドでデコードしてImageCacheに入れておく（先読み）.
+    先読みが済んでいれば、次の画像への切り替えはキャッシュから取り出すだけで済み、GUIスレッドでデコードしない.
+    デコードが終わるとGUIスレッドでimageLoadedが発行される.
+    """
+
+    # デコードが終わった画像のパス. GUIスレッドで発行される.
+    imageLoaded = Signal(str)
+
+    # ワーカースレッドからGUIスレッドに結果を渡すためのシグナル. (世代, パス, 画像またはNone)
+    _decoded = Signal(int, str, object)
+
+    # 先読みする枚数. 次の方向を多めに読む.
+    PREFETCH_AHEAD = 3
+    PREFETCH_BEHIND = 1
+
+    # デコードに使うワーカースレッドの数.
+    WORKERS = max(1, min(4, os.cpu_count() or 1))
+
+    def __init__(self,
+                 decode,
+                 cache: ImageCache = None,
+                 ahead: int = PREFETCH_AHEAD,
+                 behind: int = PREFETCH_BEHIND,
+                 workers: int = WORKERS,
+                 parent: QObject = None,
+                 ):
+        """
+        :param decode: 画像のパスを受け取り, デコードした画像を返す関数. ワーカースレッドで呼ばれる.
+                       読み込めない場合はOSErrorかValueErrorを送出する.
+        :param cache: デコードした画像を保持するキャッシュ. 省略時は既定の上限のImageCache.
+        :param ahead: 表示中の画像より後ろを何枚先読みするか.
+        :param behind: 表示中の画像より前を何枚先読みするか.
+        :param workers: ワーカースレッドの数.
+        :param parent: 親のQObject.
+        """
+        super().__init__(parent)
+        self.decode = decode
+        self.cache = ImageCache() if cache is None else cache
+        self.ahead = ahead
+        self.behind = behind
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="DatasetDecode")
+
+        self.directory = None
+        self.paths = []  # フォルダ内の画像のパス（ファイル名順）
+        self.index = -1  # 表示中の画像のindex
+        self.generation = 0  # フォルダを開き直すたびに増える. 古いフォルダのデコード結果を捨てるために使う.
+        self._pending = {}  # key: デコード中・待ちの画像のパス, value: Future
+        self._failed = set()  # 読み込めなかった画像のパス
+
+        self._decoded.connect(self._onDecoded)
+
+    @staticmethod
+    def image_paths(directory: str) -> list:
+        """
+        フォルダ内の、Qtで読み込める拡張子の画像のパスをファイル名順に返す.
+        """
+        extensions = {"." + bytes(f).decode().lower() for f in QImageReader.supportedImageFormats()}
+        names = [name for name in os.listdir(directory)
+                 if os.path.splitext(name)[1].lower() in extensions
+                 and os.path.isfile(os.path.join(directory, name))]
+        return [os.path.join(directory, name) for name in sorted(names, key=str.lower)]
+
+    @property
+    def count(self) -> int:
+        return len(self.paths)
+
+    @property
+    def current_path(self) -> str:
+        return self.paths[self.index] if 0 <= self.index < len(self.paths) else None
+
+    def open(self, directory: str) -> int:
+        """
+        フォルダを開く. 前のフォルダの先読みは取り消す.
+        :param directory: 画像のあるフォルダ.
+        :return: 画像の枚数.
+        """
+        return self.open_paths(self.image_paths(directory), directory)
+
+    def open_paths(self, paths: list, directory: str = None) -> int:
+        """
+        画像のパスのリストを開く. ProjectStoreに登録された画像など, フォルダにまとまっていない場合に使う.
+        :param paths: 画像のパスのリスト. この順に移動する.
+        :param directory: 画像のあるフォルダ. 分からなければNone.
+        :return: 画像の枚数.
+        """
+        self._cancel(set())
+        self.generation += 1
+        self.cache.pin(None)
+        self.cache.clear()
+        self._failed.clear()
+        self.directory = directory
+        self.paths = list(paths)
+        self.index = -1
+        return len(self.paths)
+
+    def go(self, index: int) -> str:
+        """
+        表示する画像を変え, その前後を先読みする.
+        :param index: 画像のindex. 範囲外なら端に丸める.
+        :return: 画像のパス. 画像が無ければNone.
+        """
+        if not self.paths:
+            return None
+        self.index = min(max(index, 0), len(self.paths) - 1)
+        path = self.paths[self.index]
+        self.cache.pin(path)
+        self.prefetch()
+        return path
+
+    def step(self, delta: int) -> str:
+        """
+        表示中の画像からdelta枚進む（負なら戻る）.
+        :return: 画像のパス. 端を越える場合はNone.
+        """
+        index = self.index + delta
+        if not 0 <= index < len(self.paths):
+            return None
+        return self.go(index)
+
+    def image(self, path: str):
+        """
+        デコード済みの画像を返す.
+        :return: 画像. まだデコードしていない（デコード中）か, 読み込めなかった場合はNone.
+        """
+        return self.cache.get(path)
+
+    def is_failed(self, path: str) -> bool:
+        return path in self._failed
+
+    def prefetch(self) -> None:
+        """
+        表示中の画像, 後ろahead枚, 前behind枚の順にデコードを依頼する.
+        範囲外になった画像のうち, まだ始まっていないデコードは取り消す.
+        """
+        indices = [self.index]
+        indices += [self.index + i for i in range(1, self.ahead + 1)]
+        indices += [self.index - i for i in range(1, self.behind + 1)]
+        paths = [self.paths[i] for i in indices if 0 <= i < len(self.paths)]
+
+        self._cancel(set(paths))
+        for path in paths:
+            if path in self.cache or path in self._pending or path in self._failed:
+                continue
+            self._pending[path] = self.executor.submit(self._decodeTask, self.generation, path)
+
+    def _cancel(self, keep: set) -> None:
+        for path, future in list(self._pending.items()):
+            if path not in keep and future.cancel():
+                del self._pending[path]
+
+    def _decodeTask(self, generation: int, path: str) -> None:
+        """
+        ワーカースレッドで画像をデコードし, 結果をGUIスレッドに渡す.
+        """
+        try:
+            image = self.decode(path)
+        except (OSError, ValueError):
+            image = None
+        self._decoded.emit(generation, path, image)
+
+    def _onDecoded(self, generation: int, path: str, image) -> None:
+        if generation != self.generation:
+            return
+        self._pending.pop(path, None)
+        if image is None:
+            self._failed.add(path)
+        else:
+            self.cache.put(path, image)
+        self.imageLoaded.emit(path)
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    def shutdown(self) -> None:
+        """
+        先読みを取り消し, デコード中のものが終わるまで待つ. アプリケーションの終了時に呼ぶ.
+        """
+        self._cancel(set())
+        self.executor.shutdown(wait=True)
@@ -1,50 +1,120 @@
-from PySide6.QtCore import QSize, QPointF
+import numpy as np
+from PySide6.QtCore import Qt, QSize, QPointF, QPoint, QRect
 from PySide6.QtGui import QColor
-from PySide6.QtGui import QImage
+from PySide6.QtGui import QImage, QPainter, QPen, QFontMetrics
 
+from core.Annotation import Annotation
+from core.Transforms import to_absolute
 
-class DrawingObject:
 
-    # 描画可能なオブジェクトの定義をクラス変数に格納する.
-    TYPES = ('Line', 'Rectangle', 'PolyLine')
+class DrawingObject(Annotation):
+    """
+    画面に表示・編集するオブジェクト. データはAnnotation（Qtに依存しない）が持ち,
+    このクラスはQtの色・座標型との変換, 編集中の状態, レイヤーへの描画を受け持つ.
+    """
+
+    # オブジェクトのタイプごとの色. 色は置き換えるだけで書き換えないので、全オブジェクトで共有する.
+    DEFAULT_COLORS = {object_type: QColor(*rgba) for object_type, rgba in Annotation.DEFAULT_RGBA.items()}
+    FALLBACK_COLOR = QColor(*Annotation.FALLBACK_RGBA)
+
+    __slots__ = ('is_being_modified', 'is_currently_drawing', 'color',
+                 'layerImage', 'layerOffset', 'layerSize', 'layerBaked', 'layerTipRect',
+                 'modifying_coordinate_index',
+                 )
 
     def __init__(self,
                  id: int,
                  object_type: str,
-                 coordinates: list = None,
-                 color: tuple = None,
+                 coordinates=None,
+                 color=None,
                  line_thickness: int = 2,
                  ):
-
-        if object_type not in self.TYPES:
-            raise ValueError(f"Invalid object type. Allowed types are: {self.TYPES}")
-
-        self.id = id
-        self.object_name = f"{object_type}_{id}"
-        self.object_type = object_type
-        self.coordinates = [] if coordinates is None else coordinates  # List of coordinates.
+        """
+        :param id: 種類ごとの番号.
+        :param object_type: TYPESのどれか.
+        :param coordinates: 相対座標. QPointFか(x, y)のリスト, もしくは(n, 2)の配列.
+        :param color: オブジェクト固有の色. QColorか(r, g, b, a)のタプル. Noneなら種類ごとの既定の色.
+        :param line_thickness: 線の太さ（ピクセル値）.
+        """
+        if isinstance(color, QColor):
+            color = color.getRgb()
+        super().__init__(id, object_type, coordinates, color, line_thickness)
         self.is_being_modified = False  # 修正中かどうか
         self.is_currently_drawing = False  # 編集中かどうか
-        self.line_thickness = line_thickness  # 線の太さ（ピクセル値）
-        self.color = None  # オブジェクトの色情報（QColor）
-        self.custom_color = None  # オブジェクトの色情報（QColor）
+        self.color = None  # 表示に使う色（QColor）. 選択中などは一時的に変わる.
 
         # 図形が描画されたQtImageを格納する変数.
+        # レイヤーはオブジェクトの描画領域の大きさで作成し、ウィンドウ上の左上座標をlayerOffsetに持つ.
         self.layerImage = None
+        self.layerOffset = QPoint(0, 0)
+
+        # 描画中のPolyLineのレイヤーを描き足すための情報（update_layer参照）.
+        # レイヤーを作成した時のキャンバスのサイズ, レイヤーに描画済みの頂点の数, 最後の線分の描画領域.
+        self.layerSize = None
+        self.layerBaked = 0
+        self.layerTipRect = QRect()
 
         # 修正時、どの座標がマウスで調整可能かを示すindex情報
         self.modifying_coordinate_index = None
 
-        # 色の設定
-        # QColorオブジェクトが指定されている場合
-        if color is not None and isinstance(color, QColor):
+        # 色を設定する.
+        self.set_color()
 
-            # カスタムカラーとして保存しておく.
-            self.custom_color = color
+    @property
+    def custom_color(self) -> QColor:
+        """
+        オブジェクト固有の色（QColor）. 無ければNone.
+        """
+        return None if self.custom_rgba is None else QColor(*self.custom_rgba)
 
-        # 色を設定する.
+    @custom_color.setter
+    def custom_color(self, color: QColor) -> None:
+        self.custom_rgba = None if color is None else color.getRgb()
         self.set_color()
 
+    @property
+    def coordinates(self) -> list:
+        """
+        相対座標(QPointF)のリスト. 呼び出すたびに配列から作成するので、大量の座標を扱う処理ではpointsを使うこと.
+        代入すると座標を全て置き換える（QPointFのリスト, もしくは(n, 2)の配列）.
+        """
+        return list(self.iter_coordinates())
+
+    @coordinates.setter
+    def coordinates(self, coordinates):
+        self._set_coordinates(coordinates)
+
+    def point(self, index: int) -> QPointF:
+        """
+        指定したindexの座標をQPointFで返す. 負のindexも使える.
+        """
+        x, y = self.points[index]
+        return QPointF(x, y)
+
+    def iter_coordinates(self):
+        """
+        座標をQPointFで順番に返すジェネレータ.
+        """
+        for x, y in self.points.tolist():
+            yield QPointF(x, y)
+
+    def append_coordinate(self, coordinate: QPointF) -> None:
+        """
+        座標を末尾に追加する.
+        :param coordinate: 相対座標のQPointF.
+        :return:
+        """
+        self.append_point(coordinate.x(), coordinate.y())
+
+    def replace_coordinate(self, index: int, coordinate: QPointF) -> None:
+        """
+        指定したindexの座標を置き換える.
+        :param index: 置き換える座標のindex.
+        :param coordinate: 相対座標のQPointF.
+        :return:
+        """
+        self.replace_point(index, coordinate.x(), coordinate.y())
+
     def start_modifying(self):
         self.is_being_modified = True
         self.color = QColor(255, 0, 0, 127)
@@ -65,21 +135,16 @@ class DrawingObject:
         if _color is not None and isinstance(_color, QColor):
             self.color = _color
 
-        if self.custom_color is not None:
-            self.color = self.custom_color
+        if self.custom_rgba is not None:
+            self.color = QColor(*self.custom_rgba)
         else:
             # オブジェクトのタイプによって色を変える
-            if self.object_type == "Line":
-                self.color = QColor(227, 23, 138, 127)
-            elif self.object_type == "Rectangle":
-                self.color = QColor(227, 149, 23, 127)
-            elif self.object_type == "PolyLine":
-                self.color = QColor(181, 107, 201, 127)
-            else:
-                self.color = QColor(0, 0, 0, 127)
+            self.color = self.DEFAULT_COLORS.get(self.object_type, self.FALLBACK_COLOR)
 
-    def set_layer(self, layer: QImage):
+    def set_layer(self, layer: QImage, offset: QPoint = None):
         self.layerImage = layer
+        self.layerOffset = QPoint(0, 0) if offset is None else offset
+        self.layerSize = None  # 描き足しはできなくなる.
 
     def set_relative_coordinates(self, window_size: QSize, coordinate: QPointF):
         """
@@ -93,5 +158,174 @@ class DrawingObject:
         relative_coordinates_height = coordinate.y() / window_size.height()
         return QPointF(relative_coordinates_width, relative_coordinates_height)
 
+    def actual_array(self, window_size: QSize) -> np.ndarray:
+        """
+        相対座標をウィンドウサイズに対する絶対座標(整数)に変換した(n, 2)配列を返す関数.
+        :param window_size: 絶対座標に戻すために必要なwindow_size.
+        :return: int64の(n, 2)配列.
+        """
+        return to_absolute(self.points, window_size.toTuple())
+
+    def get_actual_points(self, window_size: QSize) -> list:
+        """
+        相対座標で保持している座標点を、ウィンドウサイズに対する絶対座標(QPoint)に変換して返す関数.
+        :param window_size: 絶対座標に戻すために必要なwindow_size.
+        :return: QPoint型の絶対座標のリスト.
+        """
+        return [QPoint(x, y) for x, y in self.actual_array(window_size).tolist()]
+
+    def bounding_rect(self, window_size: QSize, font_metrics: QFontMetrics) -> QRect:
+        """
+        描画した時に影響を受ける領域（線の太さ, オブジェクト名の文字列を含む）を絶対座標で返す関数.
+        :param window_size: 絶対座標に戻すために必要なwindow_size.
+        :param font_metrics: オブジェクト名の描画に使われるフォントの情報.
+        :return: 描画領域を示すQRect. 座標が無い場合は空のQRect.
+        """
+        if self._count == 0:
+            return QRect()
+
+        points = self.actual_array(window_size)
+        min_x, min_y = points.min(axis=0).tolist()
+        max_x, max_y = points.max(axis=0).tolist()
+        rect = QRect(QPoint(min_x, min_y), QPoint(max_x, max_y))
+
+        # 線の太さ分（アンチエイリアス分も含めて）広げる.
+        pen_margin = self.line_thickness // 2 + 2
+        rect = rect.adjusted(-pen_margin, -pen_margin, pen_margin, pen_margin)
+
+        # オブジェクト名の文字列はcoordinates[0]をベースラインとして描画される.
+        text_rect = font_metrics.boundingRect(self.object_name).translated(*points[0].tolist())
+        return rect.united(text_rect.adjusted(-1, -1, 1, 1))
+
+    def paint(self, painter: QPainter, window_size: QSize, points: np.ndarray = None, color: QColor = None) -> None:
+        """
+        渡されたQPainterにオブジェクトを描画する関数.
+        レイヤーの作成は呼び出し側で行う.
+        :param painter: 描画先のQPainter.
+        :param window_size: 絶対座標に戻すために必要なwindow_size.
+        :param points: 描画に使う相対座標の(n, 2)配列（簡略化した頂点など）. 省略時は全ての座標.
+        :param color: 指定した場合はself.colorの代わりにこの色で描画する（選択中の強調表示など）.
+        :return:
+        """
+        if points is None:
+            points = self.get_actual_points(window_size)
+        else:
+            points = [QPoint(x, y) for x, y in to_absolute(points, window_size.toTuple()).tolist()]
+        if not points:
+            return
+
+        painter.setPen(QPen(self.color if color is None else color, self.line_thickness))
+        if self.object_type == "Line" and len(points) >= 2:
+            painter.drawLine(points[0], points[1])
+        elif self.object_type == "Rectangle" and len(points) >= 2:
+            painter.drawRect(QRect(points[0], points[1]))
+        elif self.object_type == "PolyLine" and len(points) >= 2:
+            # 線分ごとにdrawLineするより速く, 半透明の色でも頂点が重ねて塗られない.
+            painter.drawPolyline(points)
+
+        # 各オブジェクトの名前を表示.
+        painter.drawText(points[0], self.object_name)
+
+    def render_layer(self, window_size: QSize, font_metrics: QFontMetrics, clip: QRect = None) -> (QImage, QPoint):
+        """
+        オブジェクトの描画領域と同じ大きさの背景透明なレイヤーを作成し、オブジェクトを描画する関数.
+        :param window_size: 絶対座標に戻すために必要なwindow_size.
+        :param font_metrics: オブジェクト名の描画に使われるフォントの情報.
+        :param clip: 指定した場合は、描画領域のうちこの領域（表示されている範囲など）だけのレイヤーを作成する.
+        :return: (レイヤー, レイヤー左上のウィンドウ上の絶対座標)
+        """
+        rect = self.bounding_rect(window_size, font_metrics)
+        if clip is not None:
+            rect = rect.intersected(clip)
+        if rect.isEmpty():
+            return None, QPoint(0, 0)
+
+        layer = QImage(rect.size(), QImage.Format.Format_ARGB32_Premultiplied)
+        layer.fill(Qt.transparent)
+
+        painter = QPainter(layer)
+        painter.translate(-rect.left(), -rect.top())
+        self.paint(painter, window_size)
+        painter.end()
+        return layer, rect.topLeft()
+
+    def _points_rect(self, points: np.ndarray) -> QRect:
+        """
+        絶対座標の頂点を結ぶ線の描画領域（線の太さを含む）.
+        """
+        min_x, min_y = points.min(axis=0).tolist()
+        max_x, max_y = points.max(axis=0).tolist()
+        pen_margin = self.line_thickness // 2 + 2
+        return QRect(QPoint(min_x, min_y), QPoint(max_x, max_y)).adjusted(-pen_margin, -pen_margin,
+                                                                          pen_margin, pen_margin)
+
+    def update_layer(self, window_size: QSize, font_metrics: QFontMetrics, clip: QRect) -> QRect:
+        """
+        描画中のPolyLineのレイヤーを更新する関数.
+        レイヤーは表示されている範囲(clip)の大きさで作成し, 最後の線分を除いた線とオブジェクト名を描画する.
+        最後の線分は末尾の頂点が動くことがある（なぞり描き）ので, paint_tipで描画時に描く.
+
+        前回から末尾に頂点が追加されただけの場合は, 既存のレイヤーに新しく確定した線分だけを描き足すので,
+        頂点が何個あっても1回あたりの処理は変わらない. 初回とキャンバスのサイズ・表示範囲が変わった場合は作り直す.
+        末尾以外の頂点を変更した場合はset_layer(None)で作り直させること.
+        線分ごとに描くので, 半透明の色では描画中だけ継ぎ目が少し濃くなる. 確定後はオーバーレイでまとめて描画される.
+
+        :param window_size: 絶対座標に戻すために必要なwindow_size.
+        :param font_metrics: オブジェクト名の描画に使われるフォントの情報.
+        :param clip: 表示されている範囲（キャンバス上の絶対座標）.
+        :return: 再描画が必要な領域（キャンバス上の絶対座標）.
+        """
+        count = self._count
+        size = window_size.toTuple()
+        dirty = self.layerTipRect
+        if (self.layerImage is None or self.layerSize != window_size or count < self.layerBaked or
+                QRect(self.layerOffset, self.layerImage.size()) != clip):
+            dirty = QRect() if self.layerImage is None else QRect(self.layerOffset, self.layerImage.size())
+            if clip.isEmpty():
+                self.set_layer(None)
+                self.layerTipRect = QRect()
+                return dirty
+            layer = QImage(clip.size(), QImage.Format.Format_ARGB32_Premultiplied)
+            layer.fill(Qt.transparent)
+            self.set_layer(layer, clip.topLeft())
+            self.layerSize = window_size
+            self.layerBaked = 0
+            dirty = dirty.united(clip)
+
+        # 前回の最後の線分から, 今回の最後の線分の始点までを描き足す. 初回はオブジェクト名も描く.
+        baked = max(count - 1, min(count, 1))
+        if baked > self.layerBaked:
+            start = max(self.layerBaked - 1, 0)
+            painter = QPainter(self.layerImage)
+            painter.translate(-self.layerOffset)
+            if self.layerBaked == 0:
+                self.paint(painter, window_size, self.points[:baked])
+            else:
+                points = to_absolute(self.points[start:baked], size)
+                painter.setPen(QPen(self.color, self.line_thickness))
+                painter.drawPolyline([QPoint(x, y) for x, y in points.tolist()])
+                dirty = dirty.united(self._points_rect(points))
+            painter.end()
+            self.layerBaked = baked
+
+        # 最後の線分（paint_tipで描画する）.
+        self.layerTipRect = QRect()
+        if count >= 2:
+            self.layerTipRect = self._points_rect(to_absolute(self.points[-2:], size))
+        return dirty.united(self.layerTipRect)
+
+    def paint_tip(self, painter: QPainter, window_size: QSize) -> None:
+        """
+        update_layerでレイヤーに描画していない, 描画中のPolyLineの最後の線分を描画する関数.
+        :param painter: 描画先のQPainter.
+        :param window_size: 絶対座標に戻すために必要なwindow_size.
+        :return:
+        """
+        if self.layerSize is None or self._count < 2:
+            return
+        (x1, y1), (x2, y2) = to_absolute(self.points[-2:], window_size.toTuple()).tolist()
+        painter.setPen(QPen(self.color, self.line_thickness))
+        painter.drawLine(QPoint(x1, y1), QPoint(x2, y2))
+
     def __repr__(self):
         return f"DrawingObject(type={self.object_type}, coordinates={self.coordinates}, color={self.color}, thickness={self.line_thickness})"
@@ -0,0 +1,220 @@
+from collections import deque, namedtuple
+from contextlib import contextmanager
+
+import numpy as np
+
+from core.Annotation import Annotation
+
+
+# 削除したオブジェクトを作り直すために必要な情報. レイヤーの画素は持たない.
+ObjectData = namedtuple("ObjectData", ["object_type", "id", "points", "custom_rgba", "line_thickness"])
+
+# 1回の操作. kindは"create", "delete", "modify".
+# create/delete: dataに作成・削除したオブジェクトの情報.
+# modify       : keyのオブジェクトの座標をold_pointsからnew_pointsに変えた.
+Operation = namedtuple("Operation", ["kind", "key", "data", "old_points", "new_points"])
+
+
+def object_data(_obj: Annotation) -> ObjectData:
+    """
+    オブジェクトを作り直すための情報を取り出す. 座標はコピーする.
+    """
+    return ObjectData(_obj.object_type, _obj.id, _obj.points.copy(), _obj.custom_rgba, _obj.line_thickness)
+
+
+class EditHistory:
+    """
+    元に戻す・やり直すための編集履歴.
+
+    objectDict全体を保存するのではなく、操作ごとに変わったオブジェクトの座標だけを記録する.
+    1回のundo/redoは複数の操作（まとめて削除したオブジェクトなど）から成る.
+    記録に使っているメモリがbudget_bytesを超えたら古い履歴から捨てる.
+    """
+
+    # 履歴に使うメモリの上限(バイト)と、保持する回数の上限.
+    BUDGET_BYTES = 64 * 1024 * 1024
+    MAX_STEPS = 1000
+
+    # 1回の操作あたりの座標以外のメモリ使用量の目安(バイト).
+    OPERATION_OVERHEAD = 200
+
+    def __init__(self, create, delete, set_points,
+                 budget_bytes: int = BUDGET_BYTES, max_steps: int = MAX_STEPS):
+        """
+        :param create: ObjectDataからオブジェクトを作成して登録する関数.
+        :param delete: keyのオブジェクトを削除する関数.
+        :param set_points: keyのオブジェクトの座標を(n, 2)の配列で置き換える関数.
+        :param budget_bytes: 履歴に使うメモリの上限.
+        :param max_steps: 保持するundoの回数の上限.
+        """
+        self.create = create
+        self.delete = delete
+        self.set_points = set_points
+        self.budget_bytes = budget_bytes
+        self.max_steps = max_steps
+
+        self._undo = deque()  # (操作のリスト, バイト数)
+        self._redo = []
+        self._group = None  # group()の中で記録した操作
+        self._modifying = {}  # key: 修正中のオブジェクトのkey, value: 修正前の座標
+        self.is_paused = False
+        self.memory_bytes = 0  # undoとredoの履歴の合計
+
+    @staticmethod
+    def _size(operations: list) -> int:
+        size = 0
+        for op in operations:
+            size += EditHistory.OPERATION_OVERHEAD
+            for points in (None if op.data is None else op.data.points, op.old_points, op.new_points):
+                if points is not None:
+                    size += points.nbytes
+        return size
+
+    def _push(self, operation: Operation) -> None:
+        if self.is_paused:
+            return
+        if self._group is not None:
+            self._group.append(operation)
+            return
+        self._commit([operation])
+
+    def _commit(self, operations: list) -> None:
+        if not operations:
+            return
+        # 新しく編集したらやり直しの履歴は無効になる.
+        for _, size in self._redo:
+            self.memory_bytes -= size
+        self._redo.clear()
+
+        size = self._size(operations)
+        self._undo.append((operations, size))
+        self.memory_bytes += size
+        self._trim()
+
+    def _trim(self) -> None:
+        """
+        メモリの上限か回数の上限を超えている間, 古い履歴から捨てる.
+        """
+        while self._undo and (self.memory_bytes > self.budget_bytes or len(self._undo) > self.max_steps):
+            _, dropped = self._undo.popleft()
+            self.memory_bytes -= dropped
+
+    @contextmanager
+    def group(self):
+        """
+        withブロックの中で記録した操作を1回のundoにまとめる.
+        """
+        if self._group is not None:
+            yield self
+            return
+        self._group = []
+        try:
+            yield self
+        finally:
+            operations, self._group = self._group, None
+            self._commit(operations)
+
+    @contextmanager
+    def paused(self):
+        """
+        withブロックの中の操作を記録しない. ファイルの読み込みやundo/redo自体の処理に使う.
+        """
+        was_paused, self.is_paused = self.is_paused, True
+        try:
+            yield self
+        finally:
+            self.is_paused = was_paused
+
+    def created(self, _obj: Annotation) -> None:
+        self._push(Operation("create", _obj.key, object_data(_obj), None, None))
+
+    def deleted(self, _obj: Annotation) -> None:
+        self._modifying.pop(_obj.key, None)
+        self._push(Operation("delete", _obj.key, object_data(_obj), None, None))
+
+    def begin_modify(self, _obj: Annotation) -> None:
+        """
+        オブジェクトの修正を始める時に呼ぶ. 修正前の座標を覚えておく.
+        """
+        if not self.is_paused:
+            self._modifying[_obj.key] = _obj.points.copy()
+
+    @staticmethod
+    def _same_shape(object_type: str, old_points: np.ndarray, new_points: np.ndarray) -> bool:
+        """
+        修正前後の座標が同じ図形を表すかどうか.
+        矩形は修正を始める時に頂点の順番を並べ替えるので, 動かさなくても座標が変わる. 正規化した範囲で比べる.
+        """
+        if np.array_equal(old_points, new_points):
+            return True
+        if object_type != "Rectangle" or len(old_points) == 0 or len(new_points) == 0:
+            return False
+        return (np.array_equal(old_points.min(axis=0), new_points.min(axis=0)) and
+                np.array_equal(old_points.max(axis=0), new_points.max(axis=0)))
+
+    def end_modify(self, _obj: Annotation) -> None:
+        """
+        オブジェクトの修正を終えた時に呼ぶ. 図形が変わっていれば1回の操作として記録する.
+        """
+        old_points = self._modifying.pop(_obj.key, None)
+        if old_points is None or self._same_shape(_obj.object_type, old_points, _obj.points):
+            return
+        self._push(Operation("modify", _obj.key, None, old_points, _obj.points.copy()))
+
+    def clear(self) -> None:
+        self._undo.clear()
+        self._redo.clear()
+        self._modifying.clear()
+        self.memory_bytes = 0
+
+    @property
+    def can_undo(self) -> bool:
+        return len(self._undo) > 0
+
+    @property
+    def can_redo(self) -> bool:
+        return len(self._redo) > 0
+
+    def _apply(self, operation: Operation, forward: bool) -> None:
+        kind = operation.kind
+        if kind == "modify":
+            self.set_points(operation.key, operation.new_points if forward else operation.old_points)
+        elif (kind == "create") == forward:
+            self.create(operation.data)
+        else:
+            self.delete(operation.key)
+
+    def undo(self) -> bool:
+        """
+        直前の編集を元に戻す.
+        :return: 元に戻したかどうか.
+        """
+        if not self._undo:
+            return False
+        entry = self._undo.pop()
+        with self.paused():
+            for operation in reversed(entry[0]):
+                self._apply(operation, forward=False)
+        self._redo.append(entry)
+        return True
+
+    def redo(self) -> bool:
+        """
+        元に戻した編集をやり直す.
+        :return: やり直したかどうか.
+        """
+        if not self._redo:
+            return False
+        entry = self._redo.pop()
+        with self.paused():
+            for operation in entry[0]:
+                self._apply(operation, forward=True)
+        self._undo.append(entry)
+        self._trim()
+        return True
+
+    def stats(self) -> dict:
+        return {"undo": len(self._undo),
+                "redo": len(self._redo),
+                "memory_bytes": self.memory_bytes,
+                }
@@ -0,0 +1,329 @@
+import glob
+import json
+import os
+import queue
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from core import AnnotationFile
+from core.Annotation import Annotation
+
+
+# 書き込みスレッドに渡す制御用のメッセージ.
+_ROTATE = "rotate"
+_STOP = "stop"
+
+
+class EditJournal:
+    """
+    オブジェクトの追加・修正・削除を1件ずつ追記していく編集ジャーナル.
+
+    画像ファイルの隣に以下のファイルを作成する.
+        <画像>.journal            : 1行1件のJSON. 先頭行はスナップショットの世代番号.
+        <画像>.snapshot.<世代>.drwb: ある時点の全オブジェクト（AnnotationFileのバイナリ形式）.
+
+    記録はGUIスレッドで1行のJSONにして書き込みスレッドに渡すだけなので、
+    1回の編集のコストは変更したオブジェクトの大きさにしか依存しない.
+    書き込みスレッドはflush_interval秒ごとにまとめてfsyncする.
+
+    ジャーナルがスナップショットより大きくなったら新しい世代のスナップショットを作成し(compact)、
+    ジャーナルを空にする. スナップショットも座標をコピーして書き込みスレッドで書く.
+    復元時は世代の一致するジャーナルだけを再生するので、
+    スナップショットの置き換えとジャーナルの切り詰めの間で落ちても二重に適用されることはない.
+
+    フォルダが消えた・書き込めないなどでファイルに書けなくなったら、記録を止めてerrorに原因を入れ、
+    on_errorで知らせる（書き込みスレッドから呼ばれる）. 以降の編集は記録しない.
+    """
+
+    # fsyncする間隔(秒). 落ちた時に失われるのは最大でこの時間分の編集.
+    FLUSH_INTERVAL = 0.2
+
+    # ジャーナルがこの大きさ(バイト)を超え、かつスナップショットより大きくなったら作り直す.
+    MIN_COMPACT_BYTES = 1024 * 1024
+
+    def __init__(self, flush_interval: float = FLUSH_INTERVAL, min_compact_bytes: int = MIN_COMPACT_BYTES,
+                 factory=Annotation, on_error=None):
+        """
+        :param flush_interval: fsyncする間隔(秒).
+        :param min_compact_bytes: スナップショットを作り直すジャーナルの大きさの下限(バイト).
+        :param factory: 復元したオブジェクトを作る関数. AnnotationFile.object_from_recordを参照.
+        :param on_error: ファイルに書けなくなって記録を止めた時に, OSErrorを受け取る関数. 書き込みスレッドで呼ばれる.
+        """
+        self.flush_interval = flush_interval
+        self.min_compact_bytes = min_compact_bytes
+        self.factory = factory
+        self.on_error = on_error
+
+        self.image_path = None  # ジャーナルを記録している画像のパス. Noneなら記録しない.
+        self.generation = 0  # 現在のスナップショットの世代番号.
+        self.is_paused = False
+        self.error = None  # 記録を止めた原因のOSError. 書けている間はNone.
+
+        self._recorded = {}  # key: オブジェクトのkey, value: (記録したオブジェクト, version)
+        self._queue = queue.Queue()
+        self._thread = None
+
+        # 効果測定用のカウンタ.
+        self.journal_bytes = 0  # 現在のジャーナルの大きさ（書き込み待ちを含む）
+        self.snapshot_bytes = 0  # 現在のスナップショットの大きさ
+        self.records = 0  # 追記した件数
+        self.compactions = 0  # スナップショットを作成した回数
+
+    @property
+    def journal_path(self) -> str:
+        return f"{self.image_path}.journal"
+
+    def snapshot_path(self, generation: int) -> str:
+        return f"{self.image_path}.snapshot.{generation}.drwb"
+
+    def _snapshot_generations(self) -> list:
+        """
+        画像の隣にあるスナップショットの世代番号のリスト.
+        """
+        generations = []
+        for path in glob.glob(glob.escape(self.image_path) + ".snapshot.*.drwb"):
+            match = re.search(r"\.snapshot\.(\d+)\.drwb$", path)
+            if match is not None:
+                generations.append(int(match.group(1)))
+        return generations
+
+    @property
+    def is_active(self) -> bool:
+        return self.image_path is not None and self.error is None
+
+    def open(self, image_path: str) -> list:
+        """
+        画像に対応するジャーナルを開き、記録を開始する.
+        前回の編集結果があれば復元し、それを新しい世代のスナップショットにしてからジャーナルを追記していく.
+        ジャーナルが無い場合は、最初に編集を記録するまでファイルを作成しない（画像を見ただけでは何も残さない）.
+        その場合、開いた時点のオブジェクトは無いものとして記録するので、呼び出し側で消しておくこと.
+
+        :param image_path: 画像ファイルのパス.
+        :return: 前回の編集結果を復元したオブジェクト(factoryで作成)のリスト. ジャーナルが無ければNone.
+        """
+        self.close()
+        self.image_path = image_path
+        self._recorded.clear()
+        objects = self.recover()
+        if objects is not None:
+            self.compact(objects)
+        return objects
+
+    def recover(self) -> list:
+        """
+        最新のスナップショットに、同じ世代のジャーナルを再生して編集結果を復元する.
+        :return: オブジェクトのリスト. スナップショットもジャーナルも無ければNone.
+        """
+        generations = self._snapshot_generations()
+        objects = {}
+        found = False
+        self.generation = max(generations, default=0)
+        if generations:
+            snapshot, _ = AnnotationFile.load_binary(self.snapshot_path(self.generation), self.factory)
+            objects = {_obj.key: _obj for _obj in snapshot}
+            self.snapshot_bytes = os.path.getsize(self.snapshot_path(self.generation))
+            found = True
+
+        self.journal_bytes = 0
+        if os.path.exists(self.journal_path):
+            found = True
+            with open(self.journal_path, encoding='utf-8') as file:
+                lines = file.read().split("\n")
+            self.journal_bytes = sum(len(line) + 1 for line in lines)
+            for line in lines:
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # 書き込み途中で落ちた最後の行は捨てる.
+                    break
+                op = record.get("op")
+                if op == "begin":
+                    # スナップショットに取り込み済みの古いジャーナルは再生しない.
+                    if record.get("generation") != self.generation:
+                        self.journal_bytes = 0
+                        break
+                elif op == "put":
+                    _obj = AnnotationFile.object_from_record(record, self.factory)
+                    objects[_obj.key] = _obj
+                elif op == "delete":
+                    objects.pop((record["type"], record["id"]), None)
+
+        if not found:
+            return None
+        return sorted(objects.values(), key=lambda o: (Annotation.TYPES.index(o.object_type), o.id))
+
+    def close(self) -> None:
+        """
+        書き込み待ちの記録を全て書き出してからジャーナルを閉じる.
+        :return:
+        """
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+            # 書き込みスレッドが止まった後に残った記録は捨てる.
+            self._queue = queue.Queue()
+        self.image_path = None
+        self.error = None
+
+    def flush(self) -> None:
+        """
+        書き込み待ちの記録が全て書き出されるまで待つ. 書き込みスレッドがエラーで止まっていれば待たない.
+        :return:
+        """
+        if self._thread is None:
+            return
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks and self._thread.is_alive():
+                self._queue.all_tasks_done.wait(self.flush_interval)
+
+    @contextmanager
+    def paused(self):
+        """
+        withブロックの中の変更を記録しない. ファイルの読み込みなど、後でまとめてcompactする場合に使う.
+        """
+        self.is_paused = True
+        try:
+            yield self
+        finally:
+            self.is_paused = False
+
+    def _start(self) -> None:
+        """
+        書き込みスレッドを開始する. ジャーナルのファイルは書き込みスレッドが作成する.
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, args=(self.generation,), name="EditJournal", daemon=True)
+            self._thread.start()
+
+    def _append(self, record: dict) -> None:
+        self._start()
+        line = json.dumps(record) + "\n"
+        self.journal_bytes += len(line)
+        self.records += 1
+        self._queue.put(line)
+
+    def record(self, _obj: Annotation) -> None:
+        """
+        オブジェクトの追加・座標の変更を記録する. 前回記録した時から座標が変わっていなければ何もしない.
+        :param _obj: 確定済みのAnnotation.
+        :return:
+        """
+        entry = self._recorded.get(_obj.key)
+        if entry is not None and entry[0] is _obj and entry[1] == _obj.version:
+            return
+        self._recorded[_obj.key] = (_obj, _obj.version)
+        if self.is_active and not self.is_paused:
+            self._append({"op": "put", **AnnotationFile.object_to_record(_obj)})
+
+    def remove(self, key: tuple) -> None:
+        """
+        オブジェクトの削除を記録する.
+        :param key: 削除したオブジェクトのkey.
+        :return:
+        """
+        self._recorded.pop(key, None)
+        if self.is_active and not self.is_paused:
+            object_type, object_id = key
+            self._append({"op": "delete", "type": object_type, "id": object_id})
+
+    def compact(self, objects) -> None:
+        """
+        全オブジェクトを新しい世代のスナップショットに書き出し、ジャーナルを空にする.
+        :param objects: 確定済みの全Annotationのiterable.
+        :return:
+        """
+        objects = list(objects)
+        self._recorded = {_obj.key: (_obj, _obj.version) for _obj in objects}
+        if not self.is_active:
+            return
+
+        self._start()
+        generation = self.generation + 1
+
+        # スナップショットの書き込みと置き換え、ジャーナルの切り詰めは、書き込み待ちの記録を書いた後に書き込みスレッドで行う.
+        # 座標は修正時にその場で書き換えられるので、コピーを渡す.
+        copies = [Annotation(_obj.id, _obj.object_type, _obj.points.copy(), _obj.custom_rgba, _obj.line_thickness)
+                  for _obj in objects]
+        self._queue.put((_ROTATE, generation, copies))
+        self.generation = generation
+        self.journal_bytes = 0
+        self.compactions += 1
+
+    def maybe_compact(self, objects) -> bool:
+        """
+        ジャーナルがスナップショットより大きくなっていればcompactする.
+        1回の編集あたりのスナップショット作成のコストは、編集の大きさに比例する程度に抑えられる.
+        :param objects: 確定済みの全Annotationを返す関数（必要な時だけ呼ぶ）.
+        :return: compactしたかどうか.
+        """
+        if not self.is_active or self.journal_bytes < max(self.min_compact_bytes, self.snapshot_bytes):
+            return False
+        self.compact(objects())
+        return True
+
+    def _run(self, generation: int) -> None:
+        """
+        書き込みスレッド. ファイルに書けなくなったら記録を止めて知らせる.
+        :param generation: 開始した時点のスナップショットの世代番号.
+        """
+        try:
+            with open(self.journal_path, 'a', encoding='utf-8') as file:
+                if file.tell() == 0:
+                    file.write(json.dumps({"op": "begin", "generation": generation}) + "\n")
+                self._write_loop(file)
+        except OSError as error:
+            self.error = error
+            if self.on_error is not None:
+                self.on_error(error)
+
+    def _write_snapshot(self, generation: int, objects: list) -> None:
+        temporary = self.snapshot_path(generation) + ".tmp"
+        with AnnotationFile.BinaryAnnotationWriter(temporary) as writer:
+            for _obj in objects:
+                writer.write(_obj)
+        self.snapshot_bytes = os.path.getsize(temporary)
+        os.replace(temporary, self.snapshot_path(generation))
+
+    def _write_loop(self, file) -> None:
+        """
+        届いた記録を順に書き、flush_intervalごとにfsyncする.
+        """
+        running = True
+        while running:
+            items = [self._queue.get()]
+            while True:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            for item in items:
+                if item == _STOP:
+                    running = False
+                elif isinstance(item, tuple) and item[0] == _ROTATE:
+                    _, generation, objects = item
+                    file.flush()
+                    os.fsync(file.fileno())
+                    self._write_snapshot(generation, objects)
+                    file.truncate(0)
+                    file.seek(0)
+                    file.write(json.dumps({"op": "begin", "generation": generation}) + "\n")
+                    # 古い世代のスナップショットは不要になる.
+                    for old in self._snapshot_generations():
+                        if old < generation:
+                            os.remove(self.snapshot_path(old))
+                else:
+                    file.write(item)
+
+            file.flush()
+            os.fsync(file.fileno())
+            for _ in items:
+                self._queue.task_done()
+            if running:
+                # 続けて届く記録をまとめて書くために少し待つ.
+                time.sleep(self.flush_interval)
@@ -0,0 +1,100 @@
+from collections import OrderedDict
+
+from PySide6.QtGui import QImage
+
+
+class ImageCache:
+    """
+    デコード済みの画像を、使用しているバイト数の上限まで保持するLRUキャッシュ.
+
+    上限を超えたら最も長く使われていない画像から破棄する. 表示中の画像はpinしておけば破棄されない.
+    値はQImageの他に、ImagePyramidのようにピクセルデータをメモリに持たないものも入れられる（0バイトとして扱う）.
+    GUIスレッドからだけ使う.
+    """
+
+    # 保持する画像のピクセルデータの上限(バイト).
+    BUDGET_BYTES = 512 * 1024 * 1024
+
+    def __init__(self, budget_bytes: int = BUDGET_BYTES):
+        self.budget_bytes = budget_bytes
+        self._entries = OrderedDict()  # key: 画像のパス, value: (画像, バイト数)
+        self.pinned = None  # 破棄しない画像のパス
+        self.memory_bytes = 0
+
+        # 効果測定用のカウンタ.
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _size(value) -> int:
+        return value.sizeInBytes() if isinstance(value, QImage) else 0
+
+    def __contains__(self, path: str) -> bool:
+        return path in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, path: str):
+        """
+        画像を返し、最近使ったものとして並べ替える.
+        :param path: 画像のパス.
+        :return: 画像. 無ければNone.
+        """
+        entry = self._entries.get(path)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(path)
+        return entry[0]
+
+    def put(self, path: str, value) -> None:
+        """
+        画像を追加する. 上限を超えたら古いものから破棄する.
+        :param path: 画像のパス.
+        :param value: デコードした画像.
+        :return:
+        """
+        self.discard(path)
+        size = self._size(value)
+        self._entries[path] = (value, size)
+        self.memory_bytes += size
+        self._evict()
+
+    def pin(self, path: str) -> None:
+        """
+        表示中の画像を指定する. この画像は上限を超えても破棄しない.
+        :param path: 画像のパス. Noneなら解除する.
+        :return:
+        """
+        self.pinned = path
+        if path in self._entries:
+            self._entries.move_to_end(path)
+        self._evict()
+
+    def discard(self, path: str) -> None:
+        entry = self._entries.pop(path, None)
+        if entry is not None:
+            self.memory_bytes -= entry[1]
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.memory_bytes = 0
+
+    def _evict(self) -> None:
+        for path in list(self._entries):
+            if self.memory_bytes <= self.budget_bytes:
+                break
+            if path != self.pinned:
+                self.discard(path)
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        return {"images": len(self._entries),
+                "memory_bytes": self.memory_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                }
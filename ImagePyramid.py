@@ -0,0 +1,390 @@
+import hashlib
+import json
+import math
+import os
+import shutil
+import threading
+
+import numpy as np
+from PySide6.QtCore import QRect, QRectF, QSize, QStandardPaths
+from PySide6.QtGui import QImage, QImageReader, QImageIOHandler, QPainter
+
+try:
+    # libvipsは画像を上から順に少しずつデコードできる. 無ければQtでデコードする（大きさに上限がある）.
+    import pyvips
+except (ImportError, OSError):
+    pyvips = None
+
+# QImageReaderのメモリ上限はプロセス全体で共有されるので, 一時的に変更する間は他のスレッドと排他する.
+_allocation_lock = threading.Lock()
+
+
+class ImagePyramid:
+    """
+    巨大な画像を、タイル分割した複数解像度の画像（ピラミッド）としてディスクにキャッシュし、
+    必要なタイルだけをメモリマップで参照して描画するクラス.
+
+    pyvipsがあれば, 元の画像は先頭から1回だけ順に読み, タイル1行分ずつデコードする（形式を問わない）.
+    無い場合はQtでデコードするので, ClipRectに対応していない形式(PNGなど)はMAX_DECODE_BYTESまでの大きさに限られる.
+
+    レベル0が元の解像度で、レベルが1つ上がるごとに縦横が1/2になる.
+    各レベルは(タイル行, タイル列, tile_size, tile_size)のuint32(ARGB32 Premultiplied)の配列として
+    1つのファイルに保存するので、1枚のタイルはファイル上で連続している.
+    描画時は表示倍率に合ったレベルの、描画領域に掛かるタイルだけを読む.
+    """
+
+    # タイル1枚の一辺のピクセル数.
+    TILE_SIZE = 256
+
+    # Qtでデコードする場合に, ClipRectに対応している形式で1回にデコードする帯（タイル数行分）の大きさの上限(バイト).
+    # 1回のデコードは画像の先頭から帯の位置まで読み進めるので, 帯を大きくするほどデコードの回数と全体の時間が減る.
+    # Qtの既定のメモリ上限(256MB)に収まる大きさにする.
+    BAND_BYTES = 128 * 1024 * 1024
+
+    # Qtでデコードする場合に, ClipRectに対応していない形式(PNGなど)は全体を一度にデコードするしかないので, その大きさの上限(バイト).
+    # 超える画像はValueErrorにする（メモリ上限を外して際限なく確保することはしない）. pyvipsがあれば上限は無い.
+    MAX_DECODE_BYTES = 2 * 1024 * 1024 * 1024
+
+    # キャッシュの形式が変わったら上げる.
+    CACHE_VERSION = 1
+    META_FILE = "pyramid.json"
+
+    def __init__(self, cache_dir: str, meta: dict):
+        self.cache_dir = cache_dir
+        self.width = meta["width"]
+        self.height = meta["height"]
+        self.tile_size = meta["tile_size"]
+        self.level_sizes = [tuple(size) for size in meta["levels"]]
+        self._levels = [self._open_level(level, 'r') for level in range(len(self.level_sizes))]
+
+        # 効果測定用のカウンタ.
+        self.tiles_drawn = 0
+
+    @property
+    def size(self) -> QSize:
+        return QSize(self.width, self.height)
+
+    @property
+    def level_count(self) -> int:
+        return len(self.level_sizes)
+
+    # ------------------------------------------------------------------
+    # 作成・キャッシュ
+
+    @staticmethod
+    def default_cache_dir(source_path: str) -> str:
+        """
+        画像ごとのキャッシュの保存先. 画像の絶対パスから決める.
+        """
+        root = QStandardPaths.writableLocation(QStandardPaths.CacheLocation)
+        if not root:
+            root = os.path.join(os.path.expanduser("~"), ".cache", "drawing-app")
+        key = hashlib.sha1(os.path.abspath(source_path).encode("utf-8")).hexdigest()[:16]
+        return os.path.join(root, "pyramids", key)
+
+    @classmethod
+    def open(cls, source_path: str, cache_dir: str = None, tile_size: int = TILE_SIZE, progress=None):
+        """
+        画像のピラミッドを開く. キャッシュが無いか、画像が更新されていれば作り直す.
+        :param source_path: 元の画像のパス.
+        :param cache_dir: キャッシュの保存先. 省略した場合はdefault_cache_dir.
+        :param tile_size: タイル1枚の一辺のピクセル数.
+        :param progress: 作成の進み具合(0〜1)を受け取る関数.
+        :return: ImagePyramid.
+        """
+        cache_dir = cls.default_cache_dir(source_path) if cache_dir is None else cache_dir
+        meta = cls._cached_meta(source_path, cache_dir, tile_size)
+        if meta is not None:
+            return cls(cache_dir, meta)
+
+        stat = os.stat(source_path)
+        meta = cls.build(source_path, cache_dir, tile_size, progress)
+        meta["source"] = {"path": os.path.abspath(source_path), "bytes": stat.st_size, "mtime": stat.st_mtime}
+        # メタ情報は最後に書くので, 途中で中断したキャッシュは次回作り直される.
+        with open(os.path.join(cache_dir, cls.META_FILE), 'w') as file:
+            json.dump(meta, file)
+        return cls(cache_dir, meta)
+
+    @classmethod
+    def is_cached(cls, source_path: str, cache_dir: str = None, tile_size: int = TILE_SIZE) -> bool:
+        """
+        作り直さずに開けるキャッシュがあるかどうか. openが時間の掛かる作成をするかどうかの判定に使う.
+        """
+        cache_dir = cls.default_cache_dir(source_path) if cache_dir is None else cache_dir
+        return cls._cached_meta(source_path, cache_dir, tile_size) is not None
+
+    @classmethod
+    def _cached_meta(cls, source_path: str, cache_dir: str, tile_size: int) -> dict:
+        """
+        キャッシュのメタ情報. キャッシュが無いか, 画像が更新されていればNone.
+        """
+        meta_path = os.path.join(cache_dir, cls.META_FILE)
+        if not os.path.exists(meta_path):
+            return None
+        stat = os.stat(source_path)
+        source = {"path": os.path.abspath(source_path), "bytes": stat.st_size, "mtime": stat.st_mtime}
+        with open(meta_path) as file:
+            meta = json.load(file)
+        if (meta.get("version") == cls.CACHE_VERSION and meta.get("source") == source
+                and meta.get("tile_size") == tile_size):
+            return meta
+        return None
+
+    @classmethod
+    def build(cls, source_path: str, cache_dir: str, tile_size: int, progress=None) -> dict:
+        """
+        画像を読み込んでピラミッドを作成する. 全てのレベルをメモリ上に持つことはない.
+
+        元の画像のデコードは_vips_bandsか_qt_bandsで行う. 時間が掛かるので, GUIスレッドからはワーカースレッドで呼ぶこと.
+        :return: メタ情報.
+        """
+        if pyvips is not None:
+            try:
+                source = pyvips.Image.new_from_file(source_path, access="sequential")
+            except pyvips.Error as error:
+                raise ValueError(f"Cannot read image: {source_path} ({error})") from error
+            width, height = source.width, source.height
+            bands = cls._vips_bands(source_path, source, tile_size)
+        else:
+            reader = QImageReader(source_path)
+            size = reader.size()
+            if not size.isValid():
+                raise ValueError(f"Cannot read image size: {source_path} ({reader.errorString()})")
+            width, height = size.width(), size.height()
+            if (not reader.supportsOption(QImageIOHandler.ImageOption.ClipRect)
+                    and width * height * 4 > cls.MAX_DECODE_BYTES):
+                raise ValueError(f"{source_path} ({width}x{height}) is too large to decode without pyvips: "
+                                 f"the limit for this format is {cls.MAX_DECODE_BYTES // (1024 * 1024)} MB. "
+                                 f"Install pyvips to open it.")
+            bands = cls._qt_bands(source_path, reader, width, height, tile_size)
+
+        if os.path.isdir(cache_dir):
+            shutil.rmtree(cache_dir)
+        os.makedirs(cache_dir)
+
+        level_sizes = [(width, height)]
+        while max(level_sizes[-1]) > tile_size:
+            w, h = level_sizes[-1]
+            level_sizes.append(((w + 1) // 2, (h + 1) // 2))
+        meta = {"version": cls.CACHE_VERSION, "width": width, "height": height,
+                "tile_size": tile_size, "levels": level_sizes}
+
+        # 作成の仕事量は各レベルのタイル数で見積もる.
+        total = sum(math.ceil(w / tile_size) * math.ceil(h / tile_size) for w, h in level_sizes)
+        done = 0
+
+        def report(n):
+            nonlocal done
+            done += n
+            if progress is not None:
+                progress(done / total)
+
+        # レベル0: 元の画像を上から順に, 帯（タイル1行以上）ごとに書き込む.
+        level0 = cls._create_level(cache_dir, 0, level_sizes[0], tile_size)
+        columns = level0.shape[1]
+        ty = 0
+        for pixels in bands:
+            for top in range(0, pixels.shape[0], tile_size):
+                strip = pixels[top:top + tile_size]
+                for tx in range(columns):
+                    tile = strip[:, tx * tile_size:(tx + 1) * tile_size]
+                    level0[ty, tx, :tile.shape[0], :tile.shape[1]] = tile
+                ty += 1
+                report(columns)
+        level0.flush()
+
+        # レベル1以降: 1つ下のレベルの4枚のタイルから1枚ずつ作る.
+        previous = level0
+        for level in range(1, len(level_sizes)):
+            current = cls._create_level(cache_dir, level, level_sizes[level], tile_size)
+            for ty in range(current.shape[0]):
+                for tx in range(current.shape[1]):
+                    current[ty, tx] = cls._downsample(previous, level_sizes[level - 1], tx, ty, tile_size)
+                report(current.shape[1])
+            current.flush()
+            previous = current
+        return meta
+
+    @staticmethod
+    def _vips_bands(source_path: str, source, tile_size: int):
+        """
+        pyvipsで画像を先頭から順にタイル1行分ずつデコードする. 全体を通して1回しかデコードしない.
+        :param source: access="sequential"で開いたpyvips.Image.
+        :return: 帯ごとの(高さ, 幅)のuint32(ARGB32 Premultiplied)配列を上から順に返すジェネレータ.
+        """
+        try:
+            # 8bitのsRGB+アルファの4チャンネルにそろえる（グレースケール, 16bit, CMYKなど）.
+            if source.interpretation != "srgb" or source.format != "uchar":
+                source = source.colourspace("srgb")
+            if source.format != "uchar":
+                source = source.cast("uchar")
+            if not source.hasalpha():
+                source = source.bandjoin(255)
+            if source.bands > 4:
+                source = source.extract_band(0, n=4)
+
+            width, height = source.width, source.height
+            for top in range(0, height, tile_size):
+                rows = min(tile_size, height - top)
+                data = source.crop(0, top, width, rows).write_to_memory()
+                rgba = np.frombuffer(data, dtype=np.uint8).reshape(rows, width, 4)
+
+                # QImageのARGB32 Premultipliedと同じ並び（リトルエンディアンではB, G, R, A）にする.
+                argb = np.empty_like(rgba)
+                alpha = rgba[:, :, 3]
+                if alpha.min() == 255:
+                    argb[:, :, :3] = rgba[:, :, 2::-1]
+                else:
+                    premultiplied = (rgba[:, :, :3] * alpha[:, :, None].astype(np.uint16) + 127) // 255
+                    argb[:, :, :3] = premultiplied[:, :, ::-1]
+                argb[:, :, 3] = alpha
+                yield argb.view(np.uint32)[:, :, 0]
+        except pyvips.Error as error:
+            raise ValueError(f"Cannot read image: {source_path} ({error})") from error
+
+    @classmethod
+    def _qt_bands(cls, source_path: str, reader: QImageReader, width: int, height: int, tile_size: int):
+        """
+        Qtで画像を帯ごとにデコードする. pyvipsが無い場合に使う.
+
+        ClipRectに対応している形式(JPEGなど)はBAND_BYTESに収まるタイル数行分ずつデコードする.
+        1回のデコードは画像の先頭から帯の位置まで読み進めるので, 全体の時間は帯の数の2乗に比例する.
+        対応していない形式は一度だけ全体をデコードする（MAX_DECODE_BYTESを超えないことはbuildで確かめる）.
+        :return: 帯ごとの(高さ, 幅)のuint32(ARGB32 Premultiplied)配列を上から順に返すジェネレータ.
+        """
+        clip_supported = reader.supportsOption(QImageIOHandler.ImageOption.ClipRect)
+        band_height = tile_size * max(1, cls.BAND_BYTES // (width * 4 * tile_size))
+        whole = None if clip_supported else cls._read(source_path, None)
+        for top in range(0, height, band_height):
+            band = QRect(0, top, width, min(band_height, height - top))
+            image = cls._read(source_path, band) if clip_supported else whole.copy(band)
+            image = image.convertToFormat(QImage.Format_ARGB32_Premultiplied)
+            yield cls._pixels(image)
+
+    @classmethod
+    def _read(cls, source_path: str, clip: QRect) -> QImage:
+        """
+        画像のclipの範囲をデコードする. clipがNoneなら全体.
+        全体をデコードする場合はQtの既定のメモリ上限(256MB)を超えることがあるので, MAX_DECODE_BYTESまで上げる.
+        """
+        reader = QImageReader(source_path)
+        if clip is not None:
+            reader.setClipRect(clip)
+            image = reader.read()
+        else:
+            with _allocation_lock:
+                limit = QImageReader.allocationLimit()  # MB単位. 0は上限なし.
+                if limit != 0:
+                    QImageReader.setAllocationLimit(max(limit, cls.MAX_DECODE_BYTES // (1024 * 1024)))
+                try:
+                    image = reader.read()
+                finally:
+                    QImageReader.setAllocationLimit(limit)
+        if image.isNull():
+            raise ValueError(f"Cannot read image: {source_path} ({reader.errorString()})")
+        return image
+
+    @staticmethod
+    def _pixels(image: QImage) -> np.ndarray:
+        """
+        QImage(ARGB32 Premultiplied)の画素を(height, width)のuint32配列として参照する.
+        """
+        bits = np.frombuffer(image.constBits(), dtype=np.uint32)
+        return bits.reshape(image.height(), image.bytesPerLine() // 4)[:, :image.width()]
+
+    @staticmethod
+    def _level_path(cache_dir: str, level: int) -> str:
+        return os.path.join(cache_dir, f"level_{level}.u32")
+
+    @classmethod
+    def _create_level(cls, cache_dir: str, level: int, size: tuple, tile_size: int) -> np.memmap:
+        shape = (math.ceil(size[1] / tile_size), math.ceil(size[0] / tile_size), tile_size, tile_size)
+        return np.memmap(cls._level_path(cache_dir, level), dtype=np.uint32, mode='w+', shape=shape)
+
+    def _open_level(self, level: int, mode: str) -> np.memmap:
+        w, h = self.level_sizes[level]
+        shape = (math.ceil(h / self.tile_size), math.ceil(w / self.tile_size), self.tile_size, self.tile_size)
+        return np.memmap(self._level_path(self.cache_dir, level), dtype=np.uint32, mode=mode, shape=shape)
+
+    @staticmethod
+    def _downsample(source: np.ndarray, source_size: tuple, tx: int, ty: int, tile_size: int) -> np.ndarray:
+        """
+        1つ下のレベルの2x2枚のタイルを縦横1/2に縮小して、1枚のタイルを作る.
+        """
+        mosaic = np.zeros((2 * tile_size, 2 * tile_size), dtype=np.uint32)
+        rows, columns = source.shape[:2]
+        for dy in range(2):
+            for dx in range(2):
+                sy, sx = 2 * ty + dy, 2 * tx + dx
+                if sy < rows and sx < columns:
+                    mosaic[dy * tile_size:(dy + 1) * tile_size, dx * tile_size:(dx + 1) * tile_size] = source[sy, sx]
+
+        # 画像の端が奇数の場合, 範囲外の画素の代わりに端の画素を使う.
+        valid_w = min(2 * tile_size, source_size[0] - 2 * tx * tile_size)
+        valid_h = min(2 * tile_size, source_size[1] - 2 * ty * tile_size)
+        if valid_w < 2 * tile_size:
+            mosaic[:, valid_w:] = mosaic[:, valid_w - 1:valid_w]
+        if valid_h < 2 * tile_size:
+            mosaic[valid_h:, :] = mosaic[valid_h - 1:valid_h, :]
+
+        channels = mosaic.view(np.uint8).reshape(tile_size, 2, tile_size, 2, 4).astype(np.uint16)
+        averaged = ((channels.sum(axis=(1, 3)) + 2) >> 2).astype(np.uint8)
+        return averaged.view(np.uint32).reshape(tile_size, tile_size)
+
+    # ------------------------------------------------------------------
+    # 描画
+
+    def level_for_scale(self, scale: float) -> int:
+        """
+        表示倍率（表示サイズ/元の画像サイズ）に合うレベルを返す.
+        表示する解像度以上で最も小さいレベルを選ぶ.
+        """
+        if scale <= 0:
+            return self.level_count - 1
+        level = int(math.floor(math.log2(1.0 / scale))) if scale < 1 else 0
+        return max(0, min(self.level_count - 1, level))
+
+    def tile_image(self, level: int, tx: int, ty: int) -> QImage:
+        """
+        タイルをQImageとして返す. メモリマップした配列をそのまま参照するので、描画が終わったら破棄すること.
+        """
+        tile = self._levels[level][ty, tx]
+        return QImage(tile.data, self.tile_size, self.tile_size, self.tile_size * 4,
+                      QImage.Format_ARGB32_Premultiplied)
+
+    def draw(self, painter: QPainter, target: QRect, clip: QRect) -> None:
+        """
+        画像全体をtargetに引き伸ばして描画する. clipに掛かるタイルだけを読み込む.
+        :param painter: 描画先のQPainter.
+        :param target: 画像全体を描画する領域.
+        :param clip: 実際に描画する領域（paintEventのevent.rect()を想定）.
+        :return:
+        """
+        if target.isEmpty():
+            return
+        level = self.level_for_scale(min(target.width() / self.width, target.height() / self.height))
+        level_w, level_h = self.level_sizes[level]
+
+        # 描画先の1ピクセルがレベル上の何ピクセルに当たるか.
+        scale_x = level_w / target.width()
+        scale_y = level_h / target.height()
+
+        area = clip.intersected(target)
+        if area.isEmpty():
+            return
+        x0 = max(0, int((area.left() - target.left()) * scale_x))
+        y0 = max(0, int((area.top() - target.top()) * scale_y))
+        x1 = min(level_w, int(math.ceil((area.right() + 1 - target.left()) * scale_x)))
+        y1 = min(level_h, int(math.ceil((area.bottom() + 1 - target.top()) * scale_y)))
+
+        size = self.tile_size
+        for ty in range(y0 // size, (y1 - 1) // size + 1):
+            for tx in range(x0 // size, (x1 - 1) // size + 1):
+                tile_w = min(size, level_w - tx * size)
+                tile_h = min(size, level_h - ty * size)
+                destination = QRectF(target.left() + tx * size / scale_x,
+                                     target.top() + ty * size / scale_y,
+                                     tile_w / scale_x,
+                                     tile_h / scale_y)
+                painter.drawImage(destination, self.tile_image(level, tx, ty), QRectF(0, 0, tile_w, tile_h))
+                self.tiles_drawn += 1
@@ -0,0 +1,149 @@
+import math
+
+import numpy as np
+from PySide6.QtCore import QSize
+
+from DrawingObject import DrawingObject
+
+
+def simplify(points: np.ndarray, epsilon: float) -> np.ndarray:
+    """
+    Douglas–Peucker法で折れ線を簡略化する.
+    端点は必ず残し、間の頂点は両端を結ぶ線分からの距離がepsilonを超えるものだけを残す.
+
+    再帰の代わりに、その時点で残している頂点で区切った全ての区間をまとめてNumPyで処理する.
+    1回の繰り返しで各区間から最も離れた頂点を1つずつ残すので、繰り返しの回数は再帰の深さで済む.
+
+    :param points: (n, 2)の座標の配列.
+    :param epsilon: 許容する誤差. pointsと同じ単位.
+    :return: 残した頂点のindexの配列（昇順）.
+    """
+    n = len(points)
+    if n < 3:
+        return np.arange(n)
+
+    keep = np.zeros(n, dtype=bool)
+    keep[[0, -1]] = True
+    undecided = np.ones(n, dtype=bool)  # まだ残すかどうか決まっていない頂点
+    undecided[[0, -1]] = False
+    while True:
+        candidates = np.flatnonzero(undecided)
+        if len(candidates) == 0:
+            break
+
+        # 各頂点が属する区間の両端.
+        kept = np.flatnonzero(keep)
+        segment = np.searchsorted(kept, candidates) - 1
+        a = points[kept[segment]]
+        d = points[kept[segment + 1]] - a
+        p = points[candidates] - a
+
+        # 線分上で最も近い点までの距離の2乗.
+        length2 = np.einsum('ij,ij->i', d, d)
+        t = np.einsum('ij,ij->i', p, d) / np.where(length2 > 0, length2, 1.0)
+        p -= np.clip(t, 0.0, 1.0)[:, None] * d
+        distances = np.einsum('ij,ij->i', p, p)
+
+        # 区間ごとの最大値. candidatesは昇順なので同じ区間の頂点は連続している.
+        starts = np.flatnonzero(np.r_[True, segment[1:] != segment[:-1]])
+        group = np.repeat(np.arange(len(starts)), np.diff(np.r_[starts, len(candidates)]))
+        maximum = np.maximum.reduceat(distances, starts)[group]
+
+        # 誤差を超える区間は最も離れた頂点（同じ距離なら先頭）を残して分割し, それ以外の区間は確定する.
+        split = np.flatnonzero((distances == maximum) & (maximum > epsilon * epsilon))
+        split = split[np.r_[True, group[split][1:] != group[split][:-1]]] if len(split) else split
+        keep[candidates[split]] = True
+        undecided[candidates[split]] = False
+        undecided[candidates[maximum <= epsilon * epsilon]] = False
+    return np.flatnonzero(keep)
+
+
+class LevelOfDetail:
+    """
+    表示倍率に応じてオブジェクトの描画を省略・簡略化するクラス.
+
+    - 外接矩形がMIN_SIZEピクセルより小さいオブジェクトは描画しない.
+    - MIN_POINTS以上の頂点を持つポリラインは、TOLERANCEピクセル以内の誤差で簡略化した頂点で描画する.
+
+    簡略化の結果は、キャンバスの長辺を2のべき乗に切り上げた大きさ（レベル）ごとにキャッシュする.
+    レベル内で倍率が変わっても誤差はTOLERANCEピクセル以下なので、同じ結果を使い回せる.
+    座標が変わった（versionが変わった）オブジェクトのキャッシュは作り直す.
+    """
+
+    MIN_SIZE = 1.0
+    TOLERANCE = 0.5
+    MIN_POINTS = 32
+
+    def __init__(self, min_size: float = MIN_SIZE, tolerance: float = TOLERANCE, min_points: int = MIN_POINTS):
+        self.min_size = min_size
+        self.tolerance = tolerance
+        self.min_points = min_points
+        self._cache = {}  # key: オブジェクトのkey, value: (オブジェクト, version, {レベル: 残した頂点のindex})
+
+        # 効果測定用のカウンタ.
+        self.hits = 0
+        self.misses = 0
+
+    def is_visible(self, bounds: tuple, canvas_size: QSize) -> bool:
+        """
+        相対座標の外接矩形が、キャンバス上で描画する大きさかどうか.
+        :param bounds: (min_x, min_y, max_x, max_y).
+        :param canvas_size: キャンバスのサイズ.
+        :return:
+        """
+        return ((bounds[2] - bounds[0]) * canvas_size.width() >= self.min_size or
+                (bounds[3] - bounds[1]) * canvas_size.height() >= self.min_size)
+
+    @staticmethod
+    def level(canvas_size: QSize) -> tuple:
+        """
+        簡略化に使う座標のスケール. 長辺を2のべき乗に切り上げ、縦横比はキャンバスに合わせる.
+        縦横比は丸めておき、倍率の違いによる端数でレベルが分かれないようにする.
+        :return: (xのスケール, yのスケール). キャッシュのkeyを兼ねる.
+        """
+        width, height = canvas_size.width(), canvas_size.height()
+        longest = max(width, height, 1)
+        size = 2 ** math.ceil(math.log2(longest))
+        return size * round(width / longest, 3), size * round(height / longest, 3)
+
+    def points(self, _obj: DrawingObject, canvas_size: QSize) -> np.ndarray:
+        """
+        描画に使う相対座標を返す. 簡略化しないオブジェクトは全ての座標.
+        :param _obj: DrawingObjectクラスの変数.
+        :param canvas_size: キャンバスのサイズ.
+        :return: 相対座標の(n, 2)配列.
+        """
+        points = _obj.points
+        if _obj.object_type != "PolyLine" or len(points) < self.min_points:
+            return points
+
+        level = self.level(canvas_size)
+        entry = self._cache.get(_obj.key)
+        if entry is None or entry[0] is not _obj or entry[1] != _obj.version:
+            entry = (_obj, _obj.version, {})
+            self._cache[_obj.key] = entry
+        indices = entry[2].get(level)
+        if indices is None:
+            self.misses += 1
+            indices = simplify(points * level, self.tolerance)
+            entry[2][level] = indices
+        else:
+            self.hits += 1
+        return points[indices]
+
+    def simplified(self, points: np.ndarray, canvas_size: QSize) -> np.ndarray:
+        """
+        ポリラインの座標を簡略化して返す. キャッシュもカウンタも変更しないので, ワーカースレッドから呼べる.
+        :param points: ポリラインの相対座標の(n, 2)配列. 呼び出し側でコピーしたもの.
+        :param canvas_size: キャンバスのサイズ.
+        :return: 相対座標の(n, 2)配列.
+        """
+        if len(points) < self.min_points:
+            return points
+        return points[simplify(points * self.level(canvas_size), self.tolerance)]
+
+    def discard(self, key: tuple) -> None:
+        self._cache.pop(key, None)
+
+    def clear(self) -> None:
+        self._cache.clear()
@@ -0,0 +1,88 @@
+from PySide6.QtCore import QObject, QTimer, Qt, QPoint
+
+
+class MouseMoveCoalescer(QObject):
+    """
+    マウス移動イベントを間引き、画面の更新間隔ごとに最新の位置だけを処理させるクラス.
+
+    高いポーリングレートのマウスでは、画面に表示できる回数より多くmouseMoveEventが届くので、
+    最新の位置だけを保持し、フレームタイマーのタイミングでcallbackを1回だけ呼び出す.
+    """
+
+    # フレームレートが取得できない場合の既定値.
+    DEFAULT_FRAME_RATE = 60.0
+
+    def __init__(self, callback, frame_rate: float = DEFAULT_FRAME_RATE, parent: QObject = None):
+        """
+        :param callback: 最新のマウス位置(QPoint)を受け取る関数.
+        :param frame_rate: 1秒あたりに処理する最大回数. 0以下なら間引かずに毎回処理する.
+        :param parent: 親のQObject.
+        """
+        super().__init__(parent)
+        self.callback = callback
+        self.pending = None  # まだ処理していない最新のマウス位置.
+
+        self.timer = QTimer(self)
+        self.timer.setTimerType(Qt.PreciseTimer)
+        self.timer.timeout.connect(self._onFrame)
+        self.frame_rate = 0.0
+        self.setFrameRate(frame_rate)
+
+        # 効果測定用のカウンタ.
+        self.events_received = 0  # 受け取ったmouseMoveEventの数
+        self.moves_processed = 0  # callbackを呼び出した回数（flushで即座に処理したものを含む）
+
+    def setFrameRate(self, frame_rate: float) -> None:
+        """
+        1秒あたりに処理する最大回数を設定する.
+        :param frame_rate: 0以下なら間引かない.
+        :return:
+        """
+        self.frame_rate = frame_rate
+        if frame_rate > 0:
+            self.timer.setInterval(max(1, int(round(1000.0 / frame_rate))))
+        else:
+            self.flush()
+            self.timer.stop()
+
+    def push(self, position: QPoint) -> None:
+        """
+        マウス位置を受け取る. 次のフレームまでに届いた位置は最新のものだけが残る.
+        :param position: マウスの位置.
+        :return:
+        """
+        self.events_received += 1
+        if self.frame_rate <= 0:
+            self.moves_processed += 1
+            self.callback(position)
+            return
+
+        self.pending = position
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def flush(self) -> None:
+        """
+        未処理の位置があれば、次のフレームを待たずにすぐ処理する.
+        クリックなど、最新のマウス位置が反映されている必要がある処理の前に呼ぶ.
+        :return:
+        """
+        if self.pending is not None:
+            position = self.pending
+            self.pending = None
+            self.moves_processed += 1
+            self.callback(position)
+
+    def discard(self) -> None:
+        """
+        未処理の位置を捨てる.
+        :return:
+        """
+        self.pending = None
+
+    def _onFrame(self) -> None:
+        if self.pending is None:
+            # マウスが止まっている間はタイマーを止めておく.
+            self.timer.stop()
+            return
+        self.flush()
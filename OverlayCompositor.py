@@ -0,0 +1,660 @@
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import numpy as np
+from PySide6.QtCore import Qt, QObject, QRect, QSize, QPoint, Signal
+from PySide6.QtGui import QColor, QImage, QPainter, QFontMetrics, QRegion
+
+from DrawingObject import DrawingObject
+from LevelOfDetail import LevelOfDetail
+from core.SpatialIndex import SpatialIndex
+
+
+class OverlayCompositor(QObject):
+    """
+    確定済みのDrawingObjectを、タイル分割したオーバーレイ画像にまとめて描画・保持するクラス.
+
+    タイルは描画（draw）で必要になった時に、そのタイルに掛かるオブジェクトだけを
+    空間インデックスから探して作成する. 拡大してキャンバスが大きくなっても、
+    作成するのは表示されている範囲のタイルだけで、画面外のオブジェクトには触れない.
+    作成したタイルはbudget_bytesまで保持し、超えたら最も長く使われていないものから捨てる.
+
+    オブジェクトが変更された時は、変更前後の描画領域に掛かる作成済みのタイルだけを破棄する.
+    paintEventでのdrawImageの回数はタイル数で決まり、オブジェクト数には依存しない.
+
+    ウィンドウのリサイズ中は, resize(preview=True)で変更前のタイルをプレビューとして残し,
+    作成していないタイルの代わりに拡大・縮小して描画する（ラスタライズしない）.
+    リサイズが落ち着いたらrasterizeAsyncでタイルをワーカースレッドで作成し, できたものからtilesReadyで知らせる.
+    その前にまたサイズが変わった場合は, 始まっていない作成は取り消し, 作成中のものの結果は捨てる.
+
+    ファイルの読み込みなど多数のオブジェクトをまとめて変更する場合は, batch()の中で変更する.
+    変更が多ければ, 影響のあるタイルは変更前の画像を表示したまま, 複数のワーカースレッドで並列に作り直す.
+    進み具合はprogressで知らせる.
+    """
+
+    # 非同期に作成したタイルの領域（キャンバス上の絶対座標）. GUIスレッドで発行される.
+    tilesReady = Signal(QRect)
+
+    # 非同期に作成しているタイルの進み具合. (作成済みの枚数, 全体の枚数). GUIスレッドで発行される.
+    # 全て揃うと作成済みの枚数と全体の枚数が等しくなり, 次の作成は0から数え直す.
+    progress = Signal(int, int)
+
+    # ワーカースレッドからGUIスレッドに結果を渡すためのシグナル.
+    # (世代, ジョブの番号, {タイル: QImageかNone}, 描画しなかったオブジェクトの数)
+    _rasterized = Signal(int, int, object, int)
+
+    # タイル1枚の一辺のピクセル数.
+    TILE_SIZE = 256
+
+    # 保持するタイルのピクセルデータの上限(バイト)と、タイル数（空のタイルを含む）の上限.
+    BUDGET_BYTES = 128 * 1024 * 1024
+    MAX_TILES = 4096
+
+    # ワーカースレッドに1回で描画させるタイル数. できたタイルはこの単位で表示される.
+    CHUNK_TILES = 16
+
+    # タイルを描画するワーカースレッドの数.
+    WORKERS = max(1, min(4, os.cpu_count() or 1))
+
+    # batch()の中でこの数以上のオブジェクトを変更した場合に, タイルをワーカースレッドで作り直す.
+    # 少なければ今まで通り描画時に作成する方が早く表示される.
+    ASYNC_MIN_OBJECTS = 256
+
+    def __init__(self,
+                 window_size: QSize,
+                 font_metrics: QFontMetrics,
+                 index: SpatialIndex,
+                 tile_size: int = TILE_SIZE,
+                 budget_bytes: int = BUDGET_BYTES,
+                 workers: int = WORKERS,
+                 color: QColor = None,
+                 parent: QObject = None,
+                 ):
+        """
+        :param window_size: キャンバスのサイズ. 相対座標をこのサイズの絶対座標に変換して描画する.
+        :param font_metrics: オブジェクト名の描画に使われるフォントの情報.
+        :param index: 確定済みのオブジェクトの外接矩形（相対座標）を登録した空間インデックス. 更新は呼び出し側で行う.
+        :param tile_size: タイル1枚の一辺のピクセル数.
+        :param budget_bytes: 保持するタイルのピクセルデータの上限. Noneならタイルを破棄しない.
+        :param workers: タイルを描画するワーカースレッドの数.
+        :param color: 指定した場合は, オブジェクトの色の代わりに全てこの色で描画する（選択中の強調表示用）.
+        :param parent: 親のQObject.
+        """
+        super().__init__(parent)
+        self.window_size = window_size
+        self.font_metrics = font_metrics
+        self.index = index
+        self.tile_size = tile_size
+        self.budget_bytes = budget_bytes
+        self.color = color
+        self.lod = LevelOfDetail()
+
+        self._objects = {}  # key: (object_type, id), value: DrawingObject
+        self._extents = {}  # key: (object_type, id), value: 倍率に依存しない描画領域の情報（_extent参照）
+        self._rects = {}  # key: (object_type, id), value: 現在のキャンバスでの(描画領域, 描画するかどうか)
+        self._order = {}  # key: (object_type, id), value: 描画順（小さいほど下に描画される）
+        self._next_order = 0
+
+        # オブジェクトの描画領域が相対座標の外接矩形からはみ出す最大のピクセル数（線の太さと名前の文字列）.
+        self._padding = 0
+
+        self._tiles = OrderedDict()  # key: (tx, ty), value: タイルのQImage. オブジェクトが無いタイルはNone.
+        self._bytes = 0
+
+        # リサイズ中に表示するプレビュー. (作成した時のキャンバスのサイズ, そのサイズのタイル).
+        self._preview = None
+        self._deferred = False  # Trueの間は, 作成していないタイルを描画時に作成せず, プレビューで代用する.
+
+        # ワーカースレッドでのタイルの作成.
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="OverlayRaster")
+        self.generation = 0  # 作成を取り消すたびに増える. 取り消した作成の結果を捨てるために使う.
+        self._pending = {}  # key: 作成を依頼したタイル, value: ジョブの番号. 無効化されたタイルは取り除く.
+        self._futures = []
+        self._next_job = 0
+        self._done = 0  # 非同期に作成したタイルの枚数と, 依頼した枚数（progress用）.
+        self._total = 0
+
+        # batch()の中で変更されたタイルの, 変更前の画像. 作り直したタイルが届くまで代わりに表示する.
+        self._stale = {}
+        self._batch_depth = 0
+        self._batch_updates = 0
+        self._rasterized.connect(self._onRasterized)
+
+        # 効果測定用のカウンタ.
+        self.rasterized_tiles = 0
+        self.skipped_objects = 0  # 小さすぎて描画しなかったオブジェクトの延べ数
+
+    def _extent(self, _obj: DrawingObject) -> tuple:
+        """
+        倍率に依存しない描画領域の情報. _rectでキャンバス上の描画領域に変換する.
+        :return: (相対座標の外接矩形, 線の太さ分の余白, 先頭の座標, 名前の文字列の領域（ベースライン基準）).
+        """
+        bounds = _obj.relative_bounds()
+        if bounds is None:
+            return None
+        pen_margin = _obj.line_thickness // 2 + 2
+        text_rect = self.font_metrics.boundingRect(_obj.object_name).adjusted(-1, -1, 1, 1)
+        return bounds, pen_margin, tuple(_obj.points[0].tolist()), text_rect
+
+    def _rect(self, extent: tuple, window_size: QSize = None) -> QRect:
+        """
+        _extentの情報から、現在のキャンバスサイズでの描画領域を計算する.
+        DrawingObject.bounding_rectと同じ結果になる.
+        :param window_size: キャンバスのサイズ. 省略時は現在のサイズ.
+        """
+        if extent is None:
+            return QRect()
+        (min_x, min_y, max_x, max_y), pen_margin, (x0, y0), text_rect = extent
+        if window_size is None:
+            window_size = self.window_size
+        w, h = window_size.width(), window_size.height()
+        rect = QRect(QPoint(int(min_x * w), int(min_y * h)), QPoint(int(max_x * w), int(max_y * h)))
+        rect = rect.adjusted(-pen_margin, -pen_margin, pen_margin, pen_margin)
+        return rect.united(text_rect.translated(int(x0 * w), int(y0 * h)))
+
+    def _canvas_rect(self, key: tuple) -> tuple:
+        """
+        現在のキャンバスでの描画領域と、LODで描画するかどうか. キャンバスのサイズが変わるまで使い回す.
+        :return: (QRect, bool).
+        """
+        entry = self._rects.get(key)
+        if entry is None:
+            extent = self._extents[key]
+            entry = (self._rect(extent), extent is not None and self.lod.is_visible(extent[0], self.window_size))
+            self._rects[key] = entry
+        return entry
+
+    def _tile_rect(self, tile: tuple) -> QRect:
+        return QRect(tile[0] * self.tile_size, tile[1] * self.tile_size, self.tile_size, self.tile_size)
+
+    def _tiles_of(self, rect: QRect, window_size: QSize = None):
+        """
+        指定した領域に掛かるタイルのインデックスを返すジェネレータ.
+        :param rect: 絶対座標のQRect.
+        :param window_size: キャンバスのサイズ. 省略時は現在のサイズ.
+        :return:
+        """
+        rect = rect.intersected(QRect(QPoint(0, 0), self.window_size if window_size is None else window_size))
+        if rect.isEmpty():
+            return
+        for ty in range(rect.top() // self.tile_size, rect.bottom() // self.tile_size + 1):
+            for tx in range(rect.left() // self.tile_size, rect.right() // self.tile_size + 1):
+                yield tx, ty
+
+    def _invalidate(self, rect: QRect) -> None:
+        """
+        指定した領域に掛かる作成済みのタイルを破棄する. 次に描画する時に作り直される.
+        作成を依頼中のタイルは結果を捨てるようにし, プレビューからも変更前の描画を取り除く.
+        """
+        if rect.isEmpty():
+            return
+        area = rect.intersected(QRect(QPoint(0, 0), self.window_size))
+        if area.isEmpty():
+            return
+        for tile in [tile for tile in self._pending if self._tile_rect(tile).intersects(area)]:
+            del self._pending[tile]
+            if not self._batch_depth:
+                self._stale.pop(tile, None)
+        if self._preview is not None:
+            size, tiles = self._preview
+            for tile in list(self._tiles_of(self._scaled(area, self.window_size, size), size)):
+                tiles.pop(tile, None)
+        if not self._tiles:
+            return
+        count = ((area.right() // self.tile_size - area.left() // self.tile_size + 1) *
+                 (area.bottom() // self.tile_size - area.top() // self.tile_size + 1))
+
+        # 拡大中に大きなオブジェクトを変更した場合は、領域のタイルより作成済みのタイルの方が少ない.
+        if count > len(self._tiles):
+            tiles = [tile for tile in self._tiles if self._tile_rect(tile).intersects(area)]
+        else:
+            tiles = [tile for tile in self._tiles_of(area) if tile in self._tiles]
+        for tile in tiles:
+            if self._batch_depth:
+                self._stale[tile] = self._tiles[tile]
+            self._discard(tile)
+
+    @staticmethod
+    def _scaled(rect: QRect, source: QSize, target: QSize) -> QRect:
+        """
+        sourceのキャンバス上の領域を, targetのキャンバス上で同じ位置になる領域に変換する（外側に丸める）.
+        """
+        sx, sy = target.width() / source.width(), target.height() / source.height()
+        return QRect(QPoint(int(rect.left() * sx), int(rect.top() * sy)),
+                     QPoint(int((rect.right() + 1) * sx), int((rect.bottom() + 1) * sy)))
+
+    def _discard(self, tile: tuple) -> None:
+        image = self._tiles.pop(tile)
+        if image is not None:
+            self._bytes -= image.sizeInBytes()
+
+    def updateObject(self, _obj: DrawingObject) -> QRect:
+        """
+        オブジェクトを追加、もしくは座標や色の変更を反映する.
+        変更前後の描画領域に掛かるタイルが再描画の対象となる.
+        :param _obj: DrawingObjectクラスの変数.
+        :return: 画面上で再描画が必要な領域（変更前後の描画領域を合わせたもの）.
+        """
+        key = _obj.key
+        self._batch_updates += 1
+        if key not in self._order:
+            self._order[key] = self._next_order
+            self._next_order += 1
+        self._objects[key] = _obj
+
+        old_rect = self._canvas_rect(key)[0] if key in self._extents else QRect()
+        extent = self._extent(_obj)
+        self._extents[key] = extent
+        self._rects.pop(key, None)
+        if extent is not None:
+            text_rect = extent[3]
+            self._padding = max(self._padding, extent[1],
+                                -text_rect.left(), -text_rect.top(), text_rect.right() + 1, text_rect.bottom() + 1)
+        new_rect = self._canvas_rect(key)[0]
+        dirty_rect = old_rect.united(new_rect)
+        self._invalidate(dirty_rect)
+        return dirty_rect
+
+    def removeObject(self, _obj: DrawingObject) -> QRect:
+        """
+        オブジェクトを削除し、描画されていたタイルを再描画の対象とする.
+        :param _obj: DrawingObjectクラスの変数.
+        :return: 画面上で再描画が必要な領域.
+        """
+        key = _obj.key
+        self._batch_updates += 1
+        old_rect = self._canvas_rect(key)[0] if key in self._extents else QRect()
+        self._extents.pop(key, None)
+        self._rects.pop(key, None)
+        self._invalidate(old_rect)
+        self._objects.pop(key, None)
+        self._order.pop(key, None)
+        self.lod.discard(key)
+        return old_rect
+
+    def clear(self) -> None:
+        """
+        全てのオブジェクトとタイルを破棄する.
+        :return:
+        """
+        self._objects.clear()
+        self._extents.clear()
+        self._rects.clear()
+        self._order.clear()
+        self._tiles.clear()
+        self._bytes = 0
+        self._padding = 0
+        self.lod.clear()
+        self._preview = None
+        self._cancel()
+
+    def resize(self, window_size: QSize, preview: bool = False) -> None:
+        """
+        キャンバスのサイズ（ウィンドウサイズや表示倍率）が変わった時に、作成済みのタイルを破棄する.
+        描画領域は表示する範囲のオブジェクトの分だけ相対座標から計算し直すので、オブジェクト数に比例する処理は行わない.
+        :param window_size: 新しいキャンバスのサイズ.
+        :param preview: Trueなら, rasterizeAsyncを呼ぶまでタイルを作成せず, 変更前のタイルを拡大・縮小して描画する.
+                        リサイズ中に続けて呼ばれた場合は, 最後に全て揃っていたタイルをプレビューとして使い続ける.
+        :return:
+        """
+        if window_size == self.window_size:
+            return
+        if not preview:
+            self._preview = None
+        elif self._tiles and (self._preview is None or not (self._deferred or self._pending)):
+            self._preview = (self.window_size, self._tiles)
+        self._deferred = preview
+        self._cancel()
+        self.window_size = window_size
+        self._rects.clear()
+        self._tiles = OrderedDict()
+        self._bytes = 0
+
+    def _candidates(self, area: QRect):
+        """
+        指定した領域に描画されている可能性のあるオブジェクトのkeyを返す.
+        領域がキャンバスの大半を占める場合や, 登録したオブジェクトが空間インデックスのごく一部の場合
+        （選択中のオブジェクトの強調表示など）は空間インデックスを使わずに全オブジェクトを返す.
+        """
+        w, h = self.window_size.width(), self.window_size.height()
+        if 2 * area.width() * area.height() >= w * h or 16 * len(self._extents) < len(self.index):
+            return self._extents.keys()
+        padding = self._padding
+        return self.index.query_rect((area.left() - padding) / w,
+                                     (area.top() - padding) / h,
+                                     (area.right() + 1 + padding) / w,
+                                     (area.bottom() + 1 + padding) / h,
+                                     )
+
+    def _members(self, tiles: list, entries, window_size: QSize, points_of) -> tuple:
+        """
+        タイルごとに描画するオブジェクトを振り分ける.
+        :param tiles: タイルのインデックスのリスト.
+        :param entries: タイルを囲む領域に描画されている可能性のあるオブジェクトの
+                        (オブジェクト, 描画領域, 描画するかどうか, 描画順, ...)を返すiterable.
+        :param window_size: キャンバスのサイズ.
+        :param points_of: entryを受け取り, 描画に使う相対座標を返す関数. 描画するオブジェクトごとに1回だけ呼ばれる.
+        :return: ({タイル: (オブジェクト, 描画に使う相対座標)のリスト（描画順）}, 描画しなかったオブジェクトの数).
+        """
+        area = QRect()
+        for tile in tiles:
+            area = area.united(self._tile_rect(tile))
+        members = {tile: [] for tile in tiles}
+        skipped = 0
+        for entry in entries:
+            rect = entry[1].intersected(area)
+            if rect.isEmpty():
+                continue
+            # 1ピクセルに満たないオブジェクトは描画しない.
+            if not entry[2]:
+                skipped += 1
+                continue
+            for tile in self._tiles_of(rect, window_size):
+                items = members.get(tile)
+                if items is not None:
+                    items.append(entry)
+
+        points = {}
+        for tile, items in members.items():
+            items.sort(key=lambda entry: entry[3])
+            for i, entry in enumerate(items):
+                order = entry[3]
+                if order not in points:
+                    points[order] = points_of(entry)
+                items[i] = (entry[0], points[order])
+        return members, skipped
+
+    def _rasterize_tiles(self, tiles: list) -> None:
+        """
+        タイルをまとめて作成する. 空間インデックスへの問い合わせは全てのタイルを囲む領域で1回だけ行う.
+        :param tiles: 作成するタイルのインデックスのリスト.
+        :return:
+        """
+        area = QRect()
+        for tile in tiles:
+            area = area.united(self._tile_rect(tile))
+        entries = ((self._objects[key], *self._canvas_rect(key), self._order[key])
+                   for key in self._candidates(area) if key in self._extents)
+        members, skipped = self._members(tiles, entries, self.window_size,
+                                         lambda entry: self.lod.points(entry[0], self.window_size))
+        self.skipped_objects += skipped
+        for tile, items in members.items():
+            self._pending.pop(tile, None)
+            image = self._paint_tile(tile, items, self.window_size, self.tile_size, self.color) if items else None
+            self._store(tile, image)
+
+    def _store(self, tile: tuple, image: QImage) -> None:
+        self._tiles[tile] = image
+        if image is not None:
+            self._bytes += image.sizeInBytes()
+            self.rasterized_tiles += 1
+
+    @staticmethod
+    def _paint_tile(tile: tuple, items: list, window_size: QSize, tile_size: int, color: QColor = None) -> QImage:
+        """
+        タイルに掛かるオブジェクトを描画順に描画する. ワーカースレッドからも呼ばれるので, selfの状態には触れない.
+        :param items: (オブジェクト, 描画に使う相対座標)のリスト（描画順）.
+        :param color: 指定した場合はオブジェクトの色の代わりに使う色.
+        :return: タイルのQImage.
+        """
+        image = QImage(tile_size, tile_size, QImage.Format.Format_ARGB32_Premultiplied)
+        image.fill(Qt.transparent)
+        painter = QPainter(image)
+        painter.translate(-tile[0] * tile_size, -tile[1] * tile_size)
+        for _obj, points in items:
+            _obj.paint(painter, window_size, points, color)
+        painter.end()
+        return image
+
+    def rasterizeAsync(self, rect: QRect = None) -> int:
+        """
+        領域に掛かるタイルのうち, まだ作成していないものをワーカースレッドで作成する.
+        作成したタイルはGUIスレッドで保持され, CHUNK_TILES枚ごとにtilesReadyとprogressが発行される.
+        全て揃ったらプレビューは捨てる.
+        GUIスレッドでは対象のオブジェクトを空間インデックスから探して座標をコピーするだけで,
+        簡略化とタイルへの振り分け, 描画はワーカースレッドで行う.
+        :param rect: 指定した場合は、この領域に掛かるタイルだけを作成する（表示されている範囲を想定）. 省略時はキャンバス全体.
+        :return: 作成を依頼したタイルの数.
+        """
+        self._deferred = False
+        tiles = [tile for tile in self._tiles_of(QRect(QPoint(0, 0), self.window_size) if rect is None else rect)
+                 if tile not in self._tiles and tile not in self._pending]
+        if not tiles:
+            if not self._pending:
+                self._preview = None
+            return 0
+
+        # ワーカースレッドではGUIスレッドで変更される辞書や空間インデックス, LODのキャッシュに触れないよう, 必要な情報を渡しておく.
+        # 座標は修正時にその場で書き換えられるので, コピーを渡す. 簡略化はワーカースレッドでコピーに対して行う.
+        # 作成中に変更されたオブジェクトのタイルは_invalidateで_pendingから外れ, 結果は捨てられる.
+        area = QRect()
+        for tile in tiles:
+            area = area.united(self._tile_rect(tile))
+        snapshot = [(self._objects[key], self._extents[key], self._order[key],
+                     np.array(self._objects[key].points, dtype=np.float64))
+                    for key in self._candidates(area) if self._extents.get(key) is not None]
+
+        job = self._next_job
+        self._next_job += 1
+        for tile in tiles:
+            self._pending[tile] = job
+        self._futures.append(self.executor.submit(self._assignTask, self.generation, job,
+                                                  self.window_size, tiles, snapshot))
+        self._total += len(tiles)
+        self.progress.emit(self._done, self._total)
+        return len(tiles)
+
+    def _assignTask(self, generation: int, job: int, window_size: QSize, tiles: list, snapshot: list) -> None:
+        """
+        ワーカースレッドでオブジェクトをタイルに振り分け, CHUNK_TILES枚ずつの描画を他のワーカースレッドにも分けて依頼する.
+        オブジェクトの無いタイルは描画せずにGUIスレッドに渡す.
+        """
+        entries = ((_obj, self._rect(extent, window_size), self.lod.is_visible(extent[0], window_size), order, points)
+                   for _obj, extent, order, points in snapshot)
+        members, skipped = self._members(tiles, entries, window_size,
+                                         lambda entry: self.lod.simplified(entry[4], window_size))
+        if generation != self.generation:
+            return
+
+        empty = {tile: None for tile, items in members.items() if not items}
+        chunk = []
+        for tile, items in members.items():
+            if not items:
+                continue
+            chunk.append((tile, items))
+            if len(chunk) == self.CHUNK_TILES:
+                self.executor.submit(self._paintTask, generation, job, window_size, chunk)
+                chunk = []
+        if chunk:
+            self.executor.submit(self._paintTask, generation, job, window_size, chunk)
+        self._rasterized.emit(generation, job, empty, skipped)
+
+    def _paintTask(self, generation: int, job: int, window_size: QSize, chunk: list) -> None:
+        """
+        ワーカースレッドでタイルを描画し, 結果をGUIスレッドに渡す. 途中で取り消されたら残りは描画しない.
+        """
+        images = {}
+        for tile, items in chunk:
+            if generation != self.generation:
+                return
+            images[tile] = self._paint_tile(tile, items, window_size, self.tile_size, self.color)
+        self._rasterized.emit(generation, job, images, 0)
+
+    def _onRasterized(self, generation: int, job: int, images: dict, skipped: int) -> None:
+        if generation != self.generation:
+            return
+        self.skipped_objects += skipped
+        area = QRect()
+        for tile, image in images.items():
+            # 作成中に無効化されたタイルや, 先に描画時に作成したタイルの結果は捨てる.
+            if self._pending.get(tile) != job:
+                continue
+            del self._pending[tile]
+            self._stale.pop(tile, None)
+            self._store(tile, image)
+            area = area.united(self._tile_rect(tile))
+        self._futures = [future for future in self._futures if not future.done()]
+        self._evict()
+
+        # 無効化されて結果を捨てたタイルも, 作成が終わったものとして数える.
+        self._done = self._total - len(self._pending)
+        self.progress.emit(self._done, self._total)
+        if not self._pending:
+            self._preview = None
+            self._stale.clear()
+            self._done = self._total = 0
+        if not area.isEmpty():
+            self.tilesReady.emit(area)
+
+    def _cancel(self) -> None:
+        """
+        依頼したタイルの作成を全て取り消す. 始まっていない振り分けは実行しない.
+        描画は世代が変わるので, 始まっていないものは何もせずに終わり, 作成中のものは残りを描画せず結果も捨てられる.
+        """
+        self.generation += 1
+        for future in self._futures:
+            future.cancel()
+        self._futures.clear()
+        self._pending.clear()
+        self._stale.clear()
+        if self._total:
+            self._done = self._total = 0
+            self.progress.emit(0, 0)
+
+    def cancel(self) -> None:
+        """
+        依頼したタイルの作成を取り消す. 作成していないタイルは, 次に描画する時に作成される.
+        """
+        self._cancel()
+        self._preview = None
+        self._deferred = False
+
+    @contextmanager
+    def batch(self, rect: QRect = None):
+        """
+        多数のオブジェクトをまとめて変更する間に使うコンテキストマネージャ.
+            with compositor.batch(visible_rect):
+                for _obj in objects:
+                    compositor.updateObject(_obj)
+        ASYNC_MIN_OBJECTS以上のオブジェクトが変更された場合は, 領域に掛かるタイルをrasterizeAsyncで作り直し,
+        届くまでは変更されたタイルの変更前の画像を表示する. 少なければ描画する時に作成する.
+        :param rect: 作り直す領域（表示されている範囲を想定）. 省略時はキャンバス全体.
+        """
+        if self._batch_depth == 0:
+            self._batch_updates = 0
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                if self._batch_updates >= self.ASYNC_MIN_OBJECTS:
+                    self.rasterizeAsync(rect)
+                for tile in [tile for tile in self._stale if tile not in self._pending]:
+                    del self._stale[tile]
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    def shutdown(self) -> None:
+        """
+        タイルの作成を取り消し, 作成中のものが終わるまで待つ. アプリケーションの終了時に呼ぶ.
+        """
+        self._cancel()
+        self.executor.shutdown(wait=True)
+
+    def _evict(self) -> None:
+        """
+        上限を超えている間, 最も長く使われていないタイルから破棄する.
+        """
+        if self.budget_bytes is None:
+            return
+        while self._tiles and (self._bytes > self.budget_bytes or len(self._tiles) > self.MAX_TILES):
+            self._discard(next(iter(self._tiles)))
+
+    def _prepare(self, rect: QRect) -> list:
+        """
+        領域に掛かるタイルのうち, まだ作成していないものを作成する.
+        :return: 領域に掛かるタイルのインデックスのリスト.
+        """
+        tiles = list(self._tiles_of(QRect(QPoint(0, 0), self.window_size) if rect is None else rect))
+        missing = [tile for tile in tiles if tile not in self._tiles]
+        if missing:
+            self._rasterize_tiles(missing)
+        return tiles
+
+    def flush(self, rect: QRect = None) -> None:
+        """
+        まだ作成していないタイルを作成する.
+        :param rect: 指定した場合は、この領域に掛かるタイルだけを作成する. 省略時はキャンバス全体.
+        :return:
+        """
+        self._prepare(rect)
+        self._evict()
+
+    def draw(self, painter: QPainter, rect: QRect = None) -> None:
+        """
+        オーバーレイをpainterに重ねる. 必要に応じて先にタイルを作成する.
+        :param painter: 描画先のQPainter.
+        :param rect: 指定した場合は、この領域に掛かるタイルだけを描画する（paintEventのevent.rect()を想定）.
+                     省略時はキャンバス全体.
+        :return:
+        """
+        tiles = list(self._tiles_of(QRect(QPoint(0, 0), self.window_size) if rect is None else rect))
+        missing = [tile for tile in tiles if tile not in self._tiles]
+
+        # リサイズ中や作成を依頼中のタイルはここでは作成せず, 変更前の画像かプレビューで代用する.
+        waiting = [tile for tile in missing if self._deferred or tile in self._pending]
+        if waiting:
+            missing = [tile for tile in missing if tile not in self._pending and not self._deferred]
+            for tile in waiting:
+                image = self._stale.get(tile)
+                if image is not None:
+                    painter.drawImage(QPoint(tile[0] * self.tile_size, tile[1] * self.tile_size), image)
+            self._draw_preview(painter, [tile for tile in waiting if tile not in self._stale])
+        if missing:
+            self._rasterize_tiles(missing)
+
+        for tile in tiles:
+            image = self._tiles.get(tile, False)
+            if image is False:
+                continue
+            # 描画したタイルは最近使ったものとして後ろに並べ替える.
+            self._tiles.move_to_end(tile)
+            if image is not None:
+                painter.drawImage(QPoint(tile[0] * self.tile_size, tile[1] * self.tile_size), image)
+        self._evict()
+
+    def _draw_preview(self, painter: QPainter, tiles: list) -> None:
+        """
+        プレビューのタイルを現在のキャンバスのサイズに拡大・縮小し, 指定したタイルの範囲にだけ描画する.
+        """
+        if self._preview is None:
+            return
+        size, preview = self._preview
+        region = QRegion()
+        for tile in tiles:
+            region += self._tile_rect(tile)
+
+        painter.save()
+        painter.setClipRegion(region, Qt.ClipOperation.IntersectClip)
+        painter.scale(self.window_size.width() / size.width(), self.window_size.height() / size.height())
+        for tile in self._tiles_of(self._scaled(region.boundingRect(), self.window_size, size), size):
+            image = preview.get(tile)
+            if image is not None:
+                painter.drawImage(QPoint(tile[0] * self.tile_size, tile[1] * self.tile_size), image)
+        painter.restore()
+
+    @property
+    def tile_count(self) -> int:
+        return len(self._tiles)
+
+    def memory_bytes(self) -> int:
+        """
+        タイルが使用しているピクセルデータのバイト数を返す.
+        :return:
+        """
+        return self._bytes
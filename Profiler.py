@@ -0,0 +1,177 @@
+import csv
+import functools
+from collections import defaultdict, deque
+from contextlib import nullcontext
+from time import perf_counter
+
+
+# 計測が無効な時に返す、何もしないコンテキストマネージャ.
+_NULL_TIMER = nullcontext()
+
+
+class _Timer:
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name: str):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.name, perf_counter() - self.start)
+        return False
+
+
+class Profiler:
+    """
+    処理時間を名前ごとに計測するクラス.
+
+    無効な間は計測もI/Oも行わない（フラグを1回確認するだけ）.
+    有効な間は、名前ごとに直近window回分の処理時間を保持してパーセンタイルを計算し、
+    フレーム（paintEvent）ごとの処理時間の合計を行として記録する.
+    """
+
+    # パーセンタイルの計算に使うサンプル数.
+    WINDOW = 300
+
+    # CSVに書き出せるフレーム数の上限.
+    MAX_FRAMES = 100000
+
+    def __init__(self, enabled: bool = False, window: int = WINDOW, max_frames: int = MAX_FRAMES):
+        self.enabled = enabled
+        self.window = window
+        self._samples = defaultdict(lambda: deque(maxlen=self.window))  # key: 名前, value: 処理時間(秒)
+        self._current_frame = defaultdict(float)  # 現在のフレームでの名前ごとの処理時間の合計
+        self._frames = deque(maxlen=max_frames)  # (フレーム番号, 時刻, {名前: 処理時間})
+        self._frame_count = 0
+        self._skipping = False  # Trueの間は現在のフレームを記録しない
+        self._started_at = perf_counter()
+
+    def setEnabled(self, enabled: bool) -> None:
+        self.enabled = enabled
+        self._skipping = False
+
+    def reset(self) -> None:
+        self._samples.clear()
+        self._current_frame.clear()
+        self._frames.clear()
+        self._frame_count = 0
+        self._skipping = False
+        self._started_at = perf_counter()
+
+    def record(self, name: str, seconds: float) -> None:
+        """
+        処理時間を記録する.
+        :param name: 計測対象の名前.
+        :param seconds: 処理時間(秒).
+        :return:
+        """
+        if not self.enabled or self._skipping:
+            return
+        self._samples[name].append(seconds)
+        self._current_frame[name] += seconds
+
+    def timer(self, name: str):
+        """
+        withブロックの処理時間を計測するコンテキストマネージャを返す.
+        :param name: 計測対象の名前.
+        :return:
+        """
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name)
+
+    def measure(self, name: str, frame: bool = False):
+        """
+        関数の処理時間を計測するデコレータ.
+        :param name: 計測対象の名前.
+        :param frame: Trueの場合, 関数の終了を1フレームの終わりとして記録する(paintEventを想定).
+        :return:
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                start = perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.record(name, perf_counter() - start)
+                    if frame:
+                        self.end_frame()
+            return wrapper
+        return decorator
+
+    def end_frame(self) -> None:
+        """
+        現在のフレームで計測した処理時間を1行として記録する.
+        :return:
+        """
+        if not self.enabled:
+            return
+        if self._skipping:
+            # スキップ前に記録された処理時間は次のフレームに含める.
+            self._skipping = False
+            return
+        self._frames.append((self._frame_count, perf_counter() - self._started_at, dict(self._current_frame)))
+        self._frame_count += 1
+        self._current_frame.clear()
+
+    def skip_frame(self) -> None:
+        """
+        現在のフレームを計測結果に含めない（HUDだけの再描画など、ユーザーの操作によらないフレーム用）.
+        end_frameまでに記録される処理時間も捨てる.
+        :return:
+        """
+        if self.enabled:
+            self._skipping = True
+
+    def names(self) -> list:
+        return sorted(self._samples)
+
+    def percentiles(self, name: str, qs: tuple = (50, 95, 99)) -> tuple:
+        """
+        直近の処理時間のパーセンタイルを返す.
+        :param name: 計測対象の名前.
+        :param qs: 計算するパーセンタイル.
+        :return: 秒単位のパーセンタイルのタプル. サンプルが無い場合はNone.
+        """
+        samples = sorted(self._samples.get(name, ()))
+        if not samples:
+            return None
+        last = len(samples) - 1
+        return tuple(samples[min(last, int(round(q / 100 * last)))] for q in qs)
+
+    def summary_lines(self) -> list:
+        """
+        HUDに表示する文字列のリスト. 名前ごとに p50/p95/p99 をミリ秒で表示する.
+        """
+        lines = [f"{'timer':<16}{'n':>5}{'p50':>8}{'p95':>8}{'p99':>8}  [ms]"]
+        for name in self.names():
+            p50, p95, p99 = self.percentiles(name)
+            lines.append(f"{name:<16}{len(self._samples[name]):>5}"
+                         f"{p50 * 1e3:>8.2f}{p95 * 1e3:>8.2f}{p99 * 1e3:>8.2f}")
+        return lines
+
+    def export_csv(self, path: str) -> int:
+        """
+        フレームごとの処理時間(ミリ秒)をCSVに書き出す.
+        :param path: 書き出すファイルのパス.
+        :return: 書き出したフレーム数.
+        """
+        names = sorted({name for _, _, timings in self._frames for name in timings})
+        with open(path, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(["frame", "time_s"] + [f"{name}_ms" for name in names])
+            for frame, at, timings in self._frames:
+                writer.writerow([frame, f"{at:.6f}"] +
+                                [f"{timings[name] * 1e3:.4f}" if name in timings else "" for name in names])
+        return len(self._frames)
+
+
+# アプリケーション全体で共有する計測用のインスタンス.
+profiler = Profiler()
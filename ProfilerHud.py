@@ -0,0 +1,89 @@
+from PySide6.QtCore import Qt, QTimer, QRect
+from PySide6.QtGui import QPainter, QColor, QFont, QFontMetrics
+from PySide6.QtWidgets import QWidget
+
+from Profiler import Profiler
+
+
+class ProfilerHud(QWidget):
+    """
+    Profilerの計測結果をキャンバスの上に重ねて表示するウィジェット.
+    マウス操作は下のキャンバスにそのまま渡す.
+    """
+
+    # 表示を更新する間隔(ミリ秒).
+    REFRESH_INTERVAL = 250
+
+    def __init__(self, profiler: Profiler, extra_lines=None, parent: QWidget = None):
+        """
+        :param profiler: 表示するProfiler.
+        :param extra_lines: 追加で表示する文字列のリストを返す関数（キャッシュのヒット率など）.
+        :param parent: 重ねて表示する親ウィジェット.
+        """
+        super().__init__(parent)
+        self.profiler = profiler
+        self.extra_lines = extra_lines
+        self.setAttribute(Qt.WA_TransparentForMouseEvents)
+        self.shownLines = []  # 現在表示している文字列
+
+        self.hudFont = QFont("monospace")
+        self.hudFont.setStyleHint(QFont.TypeWriter)
+        self.hudFont.setPointSize(9)
+
+        self.timer = QTimer(self)
+        self.timer.setInterval(self.REFRESH_INTERVAL)
+        self.timer.timeout.connect(self.refresh)
+        self.hide()
+
+    def lines(self) -> list:
+        lines = self.profiler.summary_lines()
+        if self.extra_lines is not None:
+            lines += self.extra_lines()
+        return lines
+
+    def refresh(self) -> None:
+        """
+        表示内容に合わせて大きさを変え、親ウィジェットの右上に配置し直す.
+        再描画は下のキャンバスのpaintEventも呼ぶので, 表示内容か位置が変わった時だけ行う.
+        :return:
+        """
+        metrics = QFontMetrics(self.hudFont)
+        lines = self.lines()
+        geometry = self.hudGeometry(metrics, lines)
+        if lines == self.shownLines and geometry == self.geometry():
+            return
+        self.shownLines = lines
+        self.setGeometry(geometry)
+        self.update()
+
+    def hudGeometry(self, metrics: QFontMetrics, lines: list) -> QRect:
+        """
+        :param metrics: 表示に使うフォントのQFontMetrics.
+        :param lines: 表示する文字列のリスト.
+        :return: 親ウィジェットの右上に合わせたHUDの領域.
+        """
+        width = max(metrics.horizontalAdvance(line) for line in lines) + 12
+        height = metrics.lineSpacing() * len(lines) + 8
+        parent = self.parentWidget()
+        x = 0 if parent is None else max(0, parent.width() - width - 10)
+        return QRect(x, 50, width, height)
+
+    def setVisible(self, visible: bool) -> None:
+        super().setVisible(visible)
+        if visible:
+            self.refresh()
+            self.timer.start()
+        else:
+            self.timer.stop()
+
+    def paintEvent(self, event) -> None:
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), QColor(0, 0, 0, 160))
+        painter.setFont(self.hudFont)
+        painter.setPen(QColor(255, 255, 255))
+        metrics = QFontMetrics(self.hudFont)
+        y = 4 + metrics.ascent()
+        for line in self.shownLines:
+            painter.drawText(6, y, line)
+            y += metrics.lineSpacing()
+        painter.end()
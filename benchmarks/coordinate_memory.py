@@ -0,0 +1,90 @@
+"""
+座標の保持方法によるメモリ使用量を比較するスクリプト.
+
+- qpointf: 従来の保持方法（__dict__を持つオブジェクト + QPointFのリスト）
+- array  : DrawingObject（__slots__ + float64の連続した配列）
+
+シナリオごとに別プロセスで実行し、最大RSSの増加量を頂点数で割って比較する.
+
+使い方: python benchmarks/coordinate_memory.py --vertices 100000 --per-object 2000
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def peak_rss_bytes() -> int:
+    # ru_maxrssはLinuxではKB, macOSではbyte単位.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class LegacyDrawingObject:
+    """
+    比較用. 配列化する前のDrawingObjectと同じく、__dict__とQPointFのリストで座標を保持する.
+    """
+    def __init__(self, id, object_type, coordinates):
+        self.id = id
+        self.object_name = f"{object_type}_{id}"
+        self.object_type = object_type
+        self.coordinates = coordinates
+        self.is_being_modified = False
+        self.is_currently_drawing = False
+        self.line_thickness = 2
+        self.color = None
+        self.custom_color = None
+        self.layerImage = None
+        self.modifying_coordinate_index = None
+
+
+def run_scenario(scenario: str, n_vertices: int, per_object: int) -> None:
+    import random
+    from PySide6.QtCore import QPointF
+    from DrawingObject import DrawingObject
+
+    # 座標は都度生成し、計測対象以外の大きな配列を作らない.
+    rng = random.Random(0)
+
+    baseline = peak_rss_bytes()
+    objects = []
+    for i, start in enumerate(range(0, n_vertices, per_object)):
+        n = min(per_object, n_vertices - start)
+        if scenario == "qpointf":
+            objects.append(LegacyDrawingObject(i, "PolyLine", [QPointF(rng.random(), rng.random()) for _ in range(n)]))
+        else:
+            # 描画中と同じく1点ずつ追加し、確定時にcompactする.
+            _obj = DrawingObject(id=i, object_type="PolyLine")
+            for _ in range(n):
+                _obj.append_coordinate(QPointF(rng.random(), rng.random()))
+            _obj.compact()
+            objects.append(_obj)
+    print(peak_rss_bytes() - baseline)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vertices", type=int, default=100000)
+    parser.add_argument("--per-object", type=int, default=2000)
+    parser.add_argument("--scenario", choices=("qpointf", "array"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.scenario is not None:
+        run_scenario(args.scenario, args.vertices, args.per_object)
+        return
+
+    print(f"{args.vertices} vertices, {args.per_object} vertices per PolyLine")
+    print(f"{'storage':<10}{'RSS [MB]':>12}{'bytes/vertex':>15}")
+    for scenario in ("qpointf", "array"):
+        output = subprocess.run([sys.executable, __file__, "--scenario", scenario,
+                                 "--vertices", str(args.vertices), "--per-object", str(args.per_object)],
+                                check=True, capture_output=True, text=True).stdout
+        delta = int(output.strip().splitlines()[-1])
+        print(f"{scenario:<10}{delta / 1024 ** 2:>12.1f}{delta / args.vertices:>15.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+モジュールのimportに掛かる時間を, 新しいPythonプロセスで計測するスクリプト.
+
+各シナリオのimport文を別プロセスでrepeats回実行して中央値を表示し,
+PySide6とShapelyが読み込まれたかどうかも表示する. coreパッケージはどちらも読み込まないはず.
+
+使い方: python benchmarks/import_time.py --repeats 7
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (名前, import文).
+SCENARIOS = (
+    ("numpy (reference)", "import numpy"),
+    ("core model", "from core.Annotation import Annotation"),
+    ("core annotation file", "from core import AnnotationFile"),
+    ("core hit test", "from core.GeometryCache import GeometryCache"),
+    ("core project store", "from core.ProjectStore import ProjectStore"),
+    ("app (import main)", "import main"),
+)
+
+_CHILD = """
+import json, sys, time
+start = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "pyside6": "PySide6" in sys.modules, "shapely": "shapely" in sys.modules}}))
+"""
+
+
+def measure(statement: str, repeats: int) -> dict:
+    """
+    import文を新しいプロセスでrepeats回実行する.
+    :return: {"seconds": 中央値, "pyside6": bool, "shapely": bool}.
+    """
+    results = []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, "-c", _CHILD.format(statement=statement)],
+                                cwd=ROOT, capture_output=True, text=True, check=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    return {"seconds": statistics.median(r["seconds"] for r in results),
+            "pyside6": results[-1]["pyside6"],
+            "shapely": results[-1]["shapely"],
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeats", type=int, default=7)
+    args = parser.parse_args()
+
+    print(f"{'scenario':<24}{'import [ms]':>12}{'PySide6':>10}{'shapely':>10}")
+    for name, statement in SCENARIOS:
+        result = measure(statement, args.repeats)
+        print(f"{name:<24}{result['seconds'] * 1000:>12.1f}{str(result['pyside6']):>10}{str(result['shapely']):>10}")
+
+
+if __name__ == "__main__":
+    main()
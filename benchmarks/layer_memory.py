@@ -0,0 +1,62 @@
+"""
+オブジェクトごとのレイヤーが使用するメモリ量を、合成したシーンで比較するスクリプト.
+
+- window : 従来のウィンドウサイズのレイヤー（オブジェクト数 x ウィンドウのピクセル数）
+- bbox   : オブジェクトの描画領域の大きさのレイヤー（DrawingObject.render_layer）
+- overlay: 確定済みオブジェクトをまとめたタイル（OverlayCompositor）
+
+使い方: python benchmarks/layer_memory.py --width 8000 --height 6000 --objects 1000
+"""
+import argparse
+import os
+import sys
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PySide6.QtCore import QSize
+from PySide6.QtGui import QGuiApplication, QImage, QFontMetrics, QFont
+
+from OverlayCompositor import OverlayCompositor
+from core.SpatialIndex import SpatialIndex
+from scenes import make_scene
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--width", type=int, default=8000)
+    parser.add_argument("--height", type=int, default=6000)
+    parser.add_argument("--objects", type=int, default=1000)
+    args = parser.parse_args()
+
+    app = QGuiApplication.instance() or QGuiApplication(sys.argv)
+    window_size = QSize(args.width, args.height)
+    font_metrics = QFontMetrics(QFont())
+    objects = make_scene(args.objects)
+
+    # ウィンドウサイズのレイヤーは1枚分だけ確保してオブジェクト数を掛ける.
+    window_layer_bytes = QImage(window_size, QImage.Format.Format_ARGB32).sizeInBytes()
+    window_total = window_layer_bytes * len(objects)
+
+    bbox_total = 0
+    for _obj in objects:
+        layer, _ = _obj.render_layer(window_size, font_metrics)
+        bbox_total += 0 if layer is None else layer.sizeInBytes()
+
+    # キャンバス全体のタイルを作成した時の量を測るので, タイルの上限は設けない.
+    index = SpatialIndex()
+    compositor = OverlayCompositor(window_size, font_metrics, index, budget_bytes=None)
+    for _obj in objects:
+        compositor.updateObject(_obj)
+        index.update(_obj.key, _obj.relative_bounds())
+    compositor.flush()
+    overlay_total = compositor.memory_bytes()
+
+    print(f"scene  : {len(objects)} objects on {args.width}x{args.height}")
+    print(f"{'mode':<8}{'total [MB]':>14}{'per object [KB]':>18}")
+    for name, total in (("window", window_total), ("bbox", bbox_total), ("overlay", overlay_total)):
+        print(f"{name:<8}{total / 1024 ** 2:>14.1f}{total / 1024 / len(objects):>18.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+MaskExportでプロジェクトの全画像のラベルマップとCOCO形式のRLEを書き出す時間を, プロセスの数を変えて測るスクリプト.
+
+使い方: python benchmarks/mask_export.py --images 200 --megapixels 12 --objects 100 --workers 1 4
+"""
+import argparse
+import math
+import os
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core import MaskExport
+from core.ProjectStore import ProjectStore
+from scenes import make_scene
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", type=int, default=200)
+    parser.add_argument("--megapixels", type=float, default=12)
+    parser.add_argument("--objects", type=int, default=100, help="1枚あたりのオブジェクト数")
+    parser.add_argument("--workers", type=int, nargs="+", default=(1, MaskExport.WORKERS))
+    parser.add_argument("--no-label-maps", action="store_true")
+    args = parser.parse_args()
+
+    # 4:3の画像でmegapixelsになるサイズ.
+    height = int(math.sqrt(args.megapixels * 1e6 * 3 / 4))
+    size = (int(height * 4 / 3), height)
+
+    with tempfile.TemporaryDirectory() as directory:
+        project_path = os.path.join(directory, "bench.drwproj")
+        store = ProjectStore()
+        store.open(project_path)
+        paths = [os.path.join(directory, f"image_{i:06d}.png") for i in range(args.images)]
+        store.add_images(paths)
+        scenes = [make_scene(args.objects, seed=seed) for seed in range(4)]
+        for i, path in enumerate(paths):
+            store.open_image(path)
+            store.set_image_size(path, size)
+            store.replace(scenes[i % len(scenes)])
+        store.close()
+        print(f"{args.images} images of {size[0]}x{size[1]}, {args.objects} objects each")
+
+        for workers in args.workers:
+            output = os.path.join(directory, f"out_{workers}")
+            start = time.perf_counter()
+            result = MaskExport.export_dataset(MaskExport.project_items(project_path), output,
+                                               workers=workers, label_maps=not args.no_label_maps)
+            elapsed = time.perf_counter() - start
+            print(f"workers {workers:<3}{elapsed:>10.2f} s{args.images / elapsed:>10.1f} images/s"
+                  f"{result['annotations']:>10} annotations")
+
+    # ru_maxrssはLinuxではKB. 子プロセスは終了したものの最大値.
+    for who, label in ((resource.RUSAGE_SELF, "main"), (resource.RUSAGE_CHILDREN, "workers")):
+        print(f"peak rss ({label}) {resource.getrusage(who).ru_maxrss / 1024:.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+ProjectStoreに多数の画像とオブジェクトを書き込み, 画像ごとの読み込みとプロジェクト全体の集計の時間を測るスクリプト.
+
+使い方: python benchmarks/project_store.py --images 10000 --objects 100
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.ProjectStore import ProjectStore
+from scenes import make_scene
+
+
+def timed(label: str, function):
+    start = time.perf_counter()
+    result = function()
+    print(f"{label:<28}{time.perf_counter() - start:>10.3f} s")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", type=int, default=10000)
+    parser.add_argument("--objects", type=int, default=100, help="1枚あたりのオブジェクト数")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = ProjectStore()
+        store.open(os.path.join(directory, "bench.drwproj"))
+        paths = [os.path.join(directory, f"image_{i:06d}.png") for i in range(args.images)]
+        timed("add images", lambda: store.add_images(paths))
+
+        # 画像ごとにシーンを変えるとシーンの作成に時間が掛かるので, 数種類を使い回す.
+        # 矩形の無い画像を作るため, 10枚に1枚は線だけにする.
+        scenes = [make_scene(args.objects, seed=seed) for seed in range(4)]
+        lines_only = [_obj for _obj in scenes[0] if _obj.object_type == "Line"]
+
+        def populate():
+            for i, path in enumerate(paths):
+                store.open_image(path)
+                store.replace(lines_only if i % 10 == 0 else scenes[i % len(scenes)])
+        timed(f"write {args.images * args.objects} objects", populate)
+        print(f"{'file size':<28}{os.path.getsize(store.path) / 1024 ** 2:>10.1f} MB")
+
+        objects = timed("open one image", lambda: store.open_image(paths[args.images // 2 + 1]))
+        assert len(objects) == args.objects
+        counts = timed("count by type", store.count_by_type)
+        print(f"{'':<28}{counts}")
+        without = timed("images without rectangles", lambda: store.images_without("Rectangle"))
+        print(f"{'':<28}{len(without)} images")
+        timed("find objects in region", lambda: store.find_objects(paths[0], (0.4, 0.4, 0.6, 0.6)))
+
+        def edit():
+            for _obj in objects[:store.batch_size // 2]:
+                _obj.coordinates = _obj.points + 0.001
+                store.record(_obj)
+            store.commit()
+        timed(f"commit {store.batch_size // 2} edits", edit)
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
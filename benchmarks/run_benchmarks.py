@@ -0,0 +1,319 @@
+"""
+DrawingAppをQtのoffscreenプラットフォームで動かし、合成したシーンで主要な処理の時間を計測するスクリプト.
+
+画像サイズ(メガピクセル)とオブジェクト数の組み合わせ（シナリオ）ごとに別プロセスで実行し、
+以下を計測してJSONに書き出す.
+
+- import_image_s : 画像の読み込み（DrawingApp.loadImage）
+- populate_s     : オブジェクトの登録（DrawingApp.commitDrawingObject）
+- first_frame_s  : 登録後の最初の描画（オーバーレイのラスタライズを含む）
+- frame_s        : 2回目以降の描画（p50/p95）
+- zoom_s         : 表示倍率を変えた直後の描画（表示範囲のタイルの作成を含む, p50/p95）
+- hit_test_s     : クリック時の当たり判定（DrawingApp.findClosestObject, p50/p95）
+- snap_s         : マウス移動時の頂点スナップの検索（DrawingApp.findSnapVertex, 初回は頂点の登録を含む, p50/p95）
+- range_select_s : 範囲選択（DrawingApp.isInsideOfRect + selectObjects, p50/p95）
+- resize_s       : リサイズと直後の描画（オーバーレイは変更前のタイルを拡大・縮小したプレビュー）
+- resize_settled_s: リサイズが止まってから, 新しいサイズのオーバーレイのタイルがワーカースレッドで揃うまで
+- export_s       : 描画結果の書き出し（DrawingApp.saveDrawing, バイナリ形式）
+- load_s         : 書き出した描画結果の読み込み（DrawingApp.loadDrawing）
+- peak_rss_mb    : プロセスの最大RSS
+
+使い方:
+    python benchmarks/run_benchmarks.py --output results.json
+    python benchmarks/run_benchmarks.py --sizes 1 12 --objects 100 1000 --output results.json
+    python benchmarks/run_benchmarks.py --compare before.json after.json
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from time import perf_counter
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# 既定のシナリオ.
+SIZES_MP = (1, 12, 50)
+OBJECT_COUNTS = (100, 1000, 10000, 100000)
+
+# 比較の時に表示する指標. 分布を持つものはp50を比較する.
+METRICS = ("import_image_s", "populate_s", "first_frame_s", "frame_s", "zoom_s", "hit_test_s", "snap_s",
+           "range_select_s", "resize_s", "resize_settled_s", "export_s", "load_s", "peak_rss_mb")
+
+
+def image_size(megapixels: float) -> tuple:
+    """
+    4:3の画像でmegapixelsになる(width, height)を返す.
+    """
+    height = int(math.sqrt(megapixels * 1e6 * 3 / 4))
+    return int(height * 4 / 3), height
+
+
+def distribution(samples: list) -> dict:
+    """
+    処理時間(秒)のリストからp50/p95を計算する.
+    """
+    samples = sorted(samples)
+    last = len(samples) - 1
+    return {"p50": statistics.median(samples),
+            "p95": samples[min(last, int(round(0.95 * last)))],
+            "n": len(samples),
+            }
+
+
+def timed(func) -> float:
+    start = perf_counter()
+    func()
+    return perf_counter() - start
+
+
+def run_scenario(megapixels: float, n_objects: int, repeats: int, seed: int) -> dict:
+    """
+    1つのシナリオを現在のプロセスで実行する.
+    :param megapixels: 画像のサイズ.
+    :param n_objects: オブジェクト数.
+    :param repeats: 分布を取る指標の計測回数.
+    :param seed: 乱数のシード.
+    :return: 計測結果.
+    """
+    from PySide6.QtCore import QPoint, QSize
+    from PySide6.QtGui import QImage, QColor
+    from PySide6.QtWidgets import QApplication
+
+    from main import DrawingApp
+    from scenes import make_scene
+
+    app = QApplication.instance() or QApplication([])
+    window = DrawingApp()
+    window.show()
+    app.processEvents()
+
+    rng = random.Random(seed)
+    width, height = image_size(megapixels)
+    result = {"megapixels": megapixels, "width": width, "height": height, "objects": n_objects}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # 画像の読み込み. JPEGは書き出しも読み込みも速いので計測用の画像に使う.
+        path = os.path.join(tmp, "image.jpg")
+        image = QImage(width, height, QImage.Format_RGB32)
+        image.fill(QColor(200, 200, 200))
+        image.save(path, quality=90)
+        del image
+
+        def load_image():
+            # 巨大な画像はワーカースレッドでImagePyramidを作成するので, 表示が切り替わるまでを計測する.
+            window.loadImage(path)
+            while window.pendingImagePath is not None:
+                app.processEvents()
+
+        result["import_image_s"] = timed(load_image)
+        app.processEvents()
+        # リサイズが止まった時の処理を済ませ, 以降のオーバーレイは描画時に作成されるようにしておく.
+        window.resizeSettleTimer.stop()
+        window.onResizeSettled()
+        assert window.size() == QSize(width, height), window.size()
+
+        # オブジェクトの登録. ID以降の番号から新しいオブジェクトを作成できるようにしておく.
+        objects = make_scene(n_objects, seed)
+
+        def populate():
+            for _obj in objects:
+                window.commitDrawingObject(_obj)
+
+        result["populate_s"] = timed(populate)
+        window.lineID = len(window.linesDict)
+        window.rectAngleID = len(window.rectAngleDict)
+        window.polyLineID = len(window.polyLinesDict)
+
+        # 描画. repaintはpaintEventを同期的に実行する.
+        result["first_frame_s"] = timed(window.repaint)
+        result["frame_s"] = distribution([timed(window.repaint) for _ in range(repeats)])
+
+        # 拡大・縮小. 1〜32倍をランダムな位置を中心に切り替え, 表示範囲のタイルを作り直す.
+        samples = []
+        for i in range(repeats):
+            center = QPoint(rng.randrange(window.width()), rng.randrange(window.height()))
+            zoom = 2 ** (i % 6)
+            samples.append(timed(lambda: (window.zoomAt(center, zoom), window.repaint())))
+        result["zoom_s"] = distribution(samples)
+        window.resetViewport()
+        window.repaint()
+
+        # 当たり判定. 半分はオブジェクトの頂点上, 半分は画像上のランダムな位置をクリックする.
+        points = []
+        for i in range(repeats):
+            if i % 2 == 0 and objects:
+                vertex = rng.choice(objects).point(0)
+                points.append(QPoint(int(vertex.x() * width), int(vertex.y() * height)))
+            else:
+                points.append(QPoint(rng.randrange(width), rng.randrange(height)))
+        result["hit_test_s"] = distribution([timed(lambda: window.findClosestObject(p)) for p in points])
+
+        # 頂点スナップ. 当たり判定と同じ位置で探す.
+        window.snapping = True
+        result["snap_s"] = distribution([timed(lambda: window.findSnapVertex(p)) for p in points])
+        window.snapping = False
+
+        # 範囲選択. 画像の1/10程度の矩形で選択し, 選択を解除する処理は計測に含めない.
+        samples = []
+        for _ in range(repeats):
+            x, y = rng.randrange(width - width // 10), rng.randrange(height - height // 10)
+            rect = [QPoint(x, y), QPoint(x + width // 10, y + height // 10)]
+            start = perf_counter()
+            window.selectObjects(window.isInsideOfRect(rect))
+            samples.append(perf_counter() - start)
+            window.clearSelection()
+        result["range_select_s"] = distribution(samples)
+        window.repaint()
+
+        # リサイズ. 縮小して描画し, 元に戻す.
+        def resize():
+            window.resize(width * 9 // 10, height * 9 // 10)
+            window.repaint()
+
+        result["resize_s"] = timed(resize)
+
+        def settle():
+            window.onResizeSettled()
+            while window.compositor.pending_count:
+                app.processEvents()
+                time.sleep(0.001)
+            window.repaint()
+
+        result["resize_settled_s"] = timed(settle)
+        window.resize(width, height)
+        app.processEvents()
+
+        # 書き出しと読み込み.
+        drawing = os.path.join(tmp, "drawing.drwb")
+        result["export_s"] = timed(lambda: window.saveDrawing(drawing))
+        result["load_s"] = timed(lambda: window.loadDrawing(drawing))
+
+        # 一時ディレクトリを消す前に, 画像の隣に書いている編集ジャーナルを閉じる.
+        window.journal.close()
+
+    # ru_maxrssはLinuxではKB, macOSではバイト.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result["peak_rss_mb"] = peak / (1024 ** 2 if sys.platform == "darwin" else 1024)
+
+    window.close()
+    return result
+
+
+def metadata() -> dict:
+    """
+    結果を比較する時に必要な実行環境の情報.
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    import PySide6
+    import numpy
+    import shapely
+    return {"commit": commit,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "pyside6": PySide6.__version__,
+            "numpy": numpy.__version__,
+            "shapely": shapely.__version__,
+            "platform": platform.platform(),
+            "qpa": os.environ.get("QT_QPA_PLATFORM"),
+            }
+
+
+def run_all(args) -> dict:
+    """
+    シナリオごとに子プロセスを起動して計測する. 最大RSSをシナリオごとに分けて測るため.
+    """
+    results = []
+    for megapixels in args.sizes:
+        for n_objects in args.objects:
+            print(f"{megapixels} MP, {n_objects} objects ...", file=sys.stderr, flush=True)
+            completed = subprocess.run([sys.executable, os.path.abspath(__file__),
+                                        "--scenario", str(megapixels), str(n_objects),
+                                        "--repeats", str(args.repeats), "--seed", str(args.seed)],
+                                       capture_output=True, text=True)
+            if completed.returncode != 0:
+                print(completed.stderr, file=sys.stderr)
+                results.append({"megapixels": megapixels, "objects": n_objects,
+                                "error": completed.stderr.strip().splitlines()[-1:]})
+                continue
+            results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+    return {"meta": metadata(), "results": results}
+
+
+def value(result: dict, metric: str):
+    v = result.get(metric)
+    return v["p50"] if isinstance(v, dict) else v
+
+
+def compare(old_path: str, new_path: str) -> None:
+    """
+    2つの結果ファイルをシナリオごとに比較し, 新/旧の比を表示する.
+    """
+    with open(old_path) as file:
+        old = json.load(file)
+    with open(new_path) as file:
+        new = json.load(file)
+
+    print(f"old: {old['meta'].get('commit')} ({old['meta'].get('time')})")
+    print(f"new: {new['meta'].get('commit')} ({new['meta'].get('time')})")
+    old_results = {(r["megapixels"], r["objects"]): r for r in old["results"]}
+    for r in new["results"]:
+        o = old_results.get((r["megapixels"], r["objects"]))
+        if o is None:
+            continue
+        print(f"\n{r['megapixels']} MP, {r['objects']} objects")
+        for metric in METRICS:
+            before, after = value(o, metric), value(r, metric)
+            if before is None or after is None:
+                continue
+            ratio = after / before if before else float("nan")
+            print(f"  {metric:<16}{before:>12.4g}{after:>12.4g}{ratio:>8.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=float, nargs="+", default=SIZES_MP, help="画像サイズ(メガピクセル)")
+    parser.add_argument("--objects", type=int, nargs="+", default=OBJECT_COUNTS, help="オブジェクト数")
+    parser.add_argument("--repeats", type=int, default=20, help="分布を取る指標の計測回数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="結果を書き出すJSONファイル. 省略時は標準出力")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="2つの結果ファイルを比較する")
+    parser.add_argument("--scenario", nargs=2, metavar=("MEGAPIXELS", "OBJECTS"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    if args.scenario:
+        # 子プロセスとして1つのシナリオを実行し, 結果を標準出力の最終行に書く.
+        result = run_scenario(float(args.scenario[0]), int(args.scenario[1]), args.repeats, args.seed)
+        print(json.dumps(result))
+        return
+
+    report = run_all(args)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+"""
+ベンチマーク用に、相対座標でランダムな線・矩形・ポリラインを作成するモジュール.
+"""
+import random
+
+from PySide6.QtCore import QPointF
+
+from DrawingObject import DrawingObject
+
+
+def make_scene(n_objects: int, seed: int = 0, extent: float = 0.05) -> list:
+    """
+    相対座標でランダムな線・矩形・ポリラインを作成する.
+    :param n_objects: 作成するオブジェクト数. 線・矩形・ポリラインの順に繰り返す.
+    :param seed: 乱数のシード.
+    :param extent: 各オブジェクトの大きさ（画像に対する割合）の最大値.
+    :return: DrawingObjectのリスト. idは種類ごとに0からの連番.
+    """
+    rng = random.Random(seed)
+    objects = []
+    ids = {object_type: 0 for object_type in DrawingObject.TYPES}
+    for i in range(n_objects):
+        object_type = DrawingObject.TYPES[i % len(DrawingObject.TYPES)]
+        x, y = rng.uniform(0.0, 1.0 - extent), rng.uniform(0.0, 1.0 - extent)
+        n_points = 2 if object_type != "PolyLine" else rng.randint(3, 10)
+        coordinates = [QPointF(x, y)]
+        for _ in range(n_points - 1):
+            coordinates.append(QPointF(x + rng.uniform(0.0, extent), y + rng.uniform(0.0, extent)))
+        objects.append(DrawingObject(id=ids[object_type], object_type=object_type, coordinates=coordinates))
+        ids[object_type] += 1
+    return objects
@@ -0,0 +1,145 @@
+import numpy as np
+
+
+class Annotation:
+    """
+    オブジェクト（線・矩形・ポリライン）1つ分のデータ. Qtに依存しない.
+
+    座標は画像に対する相対座標(0〜1)のNumPy配列で持ち, 色は(r, g, b, a)の0〜255の整数のタプルで持つ.
+    描画・レイヤーなど画面に関する処理はサブクラスのDrawingObjectが持つ.
+    """
+
+    # 描画可能なオブジェクトの定義をクラス変数に格納する.
+    TYPES = ('Line', 'Rectangle', 'PolyLine')
+
+    # オブジェクトのタイプごとの色(RGBA).
+    DEFAULT_RGBA = {'Line': (227, 23, 138, 127),
+                    'Rectangle': (227, 149, 23, 127),
+                    'PolyLine': (181, 107, 201, 127),
+                    }
+    FALLBACK_RGBA = (0, 0, 0, 127)
+
+    # 大量のオブジェクトを保持するので、インスタンスごとの__dict__を持たせない.
+    __slots__ = ('id', 'object_name', 'object_type', 'version', '_points', '_count',
+                 'line_thickness', 'custom_rgba',
+                 )
+
+    def __init__(self,
+                 id: int,
+                 object_type: str,
+                 coordinates=None,
+                 rgba: tuple = None,
+                 line_thickness: int = 2,
+                 ):
+        """
+        :param id: 種類ごとの番号.
+        :param object_type: TYPESのどれか.
+        :param coordinates: 相対座標. (x, y)のリストか(n, 2)の配列.
+        :param rgba: オブジェクト固有の色(r, g, b, a). Noneなら種類ごとの既定の色.
+        :param line_thickness: 線の太さ（ピクセル値）.
+        """
+        if object_type not in self.TYPES:
+            raise ValueError(f"Invalid object type. Allowed types are: {self.TYPES}")
+
+        self.id = id
+        self.object_name = f"{object_type}_{id}"
+        self.object_type = object_type
+        self.version = 0  # 座標が変更されるたびに増える番号. キャッシュの無効化に使う.
+        # 相対座標は(capacity, 2)のfloat64配列に連続して格納し、先頭の_count行が有効な座標.
+        # _pointsと_countはcoordinatesのsetterで設定する.
+        self.coordinates = [] if coordinates is None else coordinates
+        self.line_thickness = line_thickness
+        self.custom_rgba = None if rgba is None else tuple(int(c) for c in rgba)
+
+    @property
+    def key(self) -> tuple:
+        """
+        オブジェクトの種類とidの組. 種類をまたいでオブジェクトを一意に識別する.
+        """
+        return self.object_type, self.id
+
+    @property
+    def points(self) -> np.ndarray:
+        """
+        相対座標の(n, 2)配列. 内部の配列のビューなので書き換えないこと.
+        """
+        return self._points[:self._count]
+
+    @property
+    def coordinate_count(self) -> int:
+        return self._count
+
+    @property
+    def rgba(self) -> tuple:
+        """
+        表示に使う色(r, g, b, a). 固有の色が無ければ種類ごとの既定の色.
+        """
+        if self.custom_rgba is not None:
+            return self.custom_rgba
+        return self.DEFAULT_RGBA.get(self.object_type, self.FALLBACK_RGBA)
+
+    def _get_coordinates(self) -> list:
+        return [tuple(p) for p in self.points.tolist()]
+
+    def _set_coordinates(self, coordinates) -> None:
+        # QPointFなど, x()とy()を持つ点のリストも受け付ける.
+        if not isinstance(coordinates, np.ndarray) and len(coordinates) > 0 and callable(
+                getattr(coordinates[0], "x", None)):
+            coordinates = [(p.x(), p.y()) for p in coordinates]
+        points = np.array(coordinates, dtype=np.float64).reshape(-1, 2)
+        self._points = points
+        self._count = len(points)
+        self.version += 1
+
+    coordinates = property(_get_coordinates, _set_coordinates, doc="""
+        相対座標(x, y)のリスト. 呼び出すたびに配列から作成するので、大量の座標を扱う処理ではpointsを使うこと.
+        代入すると座標を全て置き換える（(x, y)のリスト, もしくは(n, 2)の配列）.
+        """)
+
+    def append_point(self, x: float, y: float) -> None:
+        """
+        座標を末尾に追加する. 配列が足りなくなったら倍の大きさで確保し直す.
+        :param x: 相対座標のx.
+        :param y: 相対座標のy.
+        :return:
+        """
+        if self._count == len(self._points):
+            grown = np.empty((max(4, 2 * len(self._points)), 2), dtype=np.float64)
+            grown[:self._count] = self._points[:self._count]
+            self._points = grown
+        self._points[self._count] = (x, y)
+        self._count += 1
+        self.version += 1
+
+    def replace_point(self, index: int, x: float, y: float) -> None:
+        """
+        指定したindexの座標を置き換える.
+        :param index: 置き換える座標のindex.
+        :param x: 相対座標のx.
+        :param y: 相対座標のy.
+        :return:
+        """
+        self.points[index] = (x, y)
+        self.version += 1
+
+    def compact(self) -> None:
+        """
+        追加用に確保していた余分な配列を解放する. 描画を確定した時に呼ぶ.
+        """
+        if len(self._points) != self._count:
+            self._points = self._points[:self._count].copy()
+
+    def relative_bounds(self) -> tuple:
+        """
+        相対座標での外接矩形を返す関数.
+        :return: (min_x, min_y, max_x, max_y). 座標が無い場合はNone.
+        """
+        if self._count == 0:
+            return None
+        min_x, min_y = self.points.min(axis=0).tolist()
+        max_x, max_y = self.points.max(axis=0).tolist()
+        return min_x, min_y, max_x, max_y
+
+    def __repr__(self):
+        return (f"Annotation(type={self.object_type}, id={self.id}, coordinates={self.coordinates}, "
+                f"rgba={self.custom_rgba}, thickness={self.line_thickness})")
@@ -0,0 +1,373 @@
+"""
+描画したオブジェクトの保存と読み込みを行うモジュール.
+
+- JSON形式(.json)  : 他のツールとの受け渡し用. 座標は相対座標(0〜1).
+- バイナリ形式(.drwb): 大量の頂点を高速に読み書きするための列指向の形式.
+- 旧形式(.txt)     : 以前のexportDrawingが書き出した辞書型のrepr. 読み込みのみ.
+
+どの形式も書き出しはオブジェクトを1つずつ受け取って書き進めるので、
+ファイル全体の内容をメモリ上に作ることはない. 書き出しは一時ファイル(<path>.tmp)に行い,
+全て書けた時だけ元のファイルと置き換えるので, 途中で失敗しても以前のファイルは残る.
+
+画像のサイズは(width, height)のタプルで扱う. 読み込んだオブジェクトはfactory（既定ではAnnotation）で作成するので,
+アプリケーションからはDrawingObjectを渡して直接作成させる.
+"""
+import json
+import os
+import re
+import struct
+
+import numpy as np
+
+from core.Annotation import Annotation
+
+
+# JSON形式の識別子とバージョン.
+JSON_FORMAT = "drawing-annotations"
+FORMAT_VERSION = 1
+
+# バイナリ形式のヘッダ. マジック, バージョン, オブジェクト数, 総頂点数, 画像の幅と高さ（不明なら0）.
+BINARY_MAGIC = b"DRWANNO\0"
+BINARY_HEADER = struct.Struct("<8sIQQII")
+
+# 拡張子ごとの形式.
+BINARY_EXTENSIONS = (".drwb",)
+LEGACY_EXTENSIONS = (".txt",)
+
+
+def rgba_to_argb(rgba: tuple) -> int:
+    """
+    (r, g, b, a)を0xAARRGGBBの整数にする. バイナリ形式とProjectStoreで使う.
+    """
+    r, g, b, a = rgba
+    return (a << 24) | (r << 16) | (g << 8) | b
+
+
+def rgba_from_argb(argb: int) -> tuple:
+    argb = int(argb)
+    return (argb >> 16) & 0xFF, (argb >> 8) & 0xFF, argb & 0xFF, (argb >> 24) & 0xFF
+
+
+def rgba_to_hex(rgba: tuple) -> str:
+    """
+    (r, g, b, a)を"#aarrggbb"の文字列にする. JSON形式の色の表記（QColor.HexArgbと同じ）.
+    """
+    return f"#{rgba_to_argb(rgba):08x}"
+
+
+def rgba_from_hex(text: str) -> tuple:
+    """
+    "#aarrggbb", "#rrggbb", "#rgb"の文字列を(r, g, b, a)にする.
+    """
+    digits = text.lstrip("#")
+    if len(digits) == 3:
+        digits = "".join(c * 2 for c in digits)
+    if len(digits) == 6:
+        digits = "ff" + digits
+    if len(digits) != 8:
+        raise ValueError(f"Invalid color: {text}")
+    return rgba_from_argb(int(digits, 16))
+
+
+def _finish(file, path: str, succeeded: bool) -> None:
+    """
+    書き出した一時ファイルを閉じ, 成功していればpathと置き換え, 失敗していれば削除する.
+    """
+    if succeeded:
+        file.flush()
+        os.fsync(file.fileno())
+    file.close()
+    if succeeded:
+        os.replace(file.name, path)
+    else:
+        os.remove(file.name)
+
+
+def object_to_record(_obj: Annotation) -> dict:
+    """
+    オブジェクトをJSONに書き出せる辞書に変換する.
+    """
+    return {"type": _obj.object_type,
+            "id": _obj.id,
+            "coordinates": _obj.points.tolist(),
+            "color": None if _obj.custom_rgba is None else rgba_to_hex(_obj.custom_rgba),
+            "thickness": _obj.line_thickness,
+            }
+
+
+def object_from_record(record: dict, factory=Annotation) -> Annotation:
+    """
+    object_to_recordで変換した辞書からオブジェクトを作成する.
+    :param record: object_to_recordの辞書.
+    :param factory: (id, object_type, coordinates, rgba, line_thickness)を受け取ってオブジェクトを作る関数.
+    """
+    color = record.get("color")
+    return factory(record["id"],
+                   record["type"],
+                   np.array(record["coordinates"], dtype=np.float64).reshape(-1, 2),
+                   None if color is None else rgba_from_hex(color),
+                   record.get("thickness", 2),
+                   )
+
+
+class JsonAnnotationWriter:
+    """
+    JSON形式でオブジェクトを1つずつ書き出すクラス. withで使う.
+
+        with JsonAnnotationWriter(path, image_size) as writer:
+            for _obj in objects:
+                writer.write(_obj)
+    """
+
+    def __init__(self, path: str, image_size: tuple = None):
+        self.path = path
+        self.image_size = image_size
+        self.file = None
+        self.count = 0
+
+    def __enter__(self):
+        self.file = open(self.path + ".tmp", 'w', encoding='utf-8')
+        image = None
+        if self.image_size is not None:
+            image = {"width": self.image_size[0], "height": self.image_size[1]}
+        header = json.dumps({"format": JSON_FORMAT, "version": FORMAT_VERSION, "image": image})
+        # 末尾の"}"を外し、objectsの配列を書き進められるようにする.
+        self.file.write(header[:-1] + ', "objects": [')
+        return self
+
+    def write(self, _obj: Annotation) -> None:
+        self.file.write(("\n" if self.count == 0 else ",\n") + json.dumps(object_to_record(_obj)))
+        self.count += 1
+
+    def __exit__(self, exc_type, *exc):
+        succeeded = False
+        try:
+            if exc_type is None:
+                self.file.write("\n]}\n")
+                succeeded = True
+        finally:
+            _finish(self.file, self.path, succeeded)
+        return False
+
+
+class BinaryAnnotationWriter:
+    """
+    バイナリ形式でオブジェクトを1つずつ書き出すクラス. withで使う.
+
+    ファイルの構成（リトルエンディアン）:
+        ヘッダ(BINARY_HEADER)
+        xy        float64 (総頂点数, 2)  全オブジェクトの相対座標を連結したもの
+        offsets   uint64  (n + 1)        各オブジェクトの頂点の開始位置（末尾に総頂点数）
+        ids       int64   (n)
+        colors    uint32  (n)            ARGB. has_colorが0なら種類ごとの既定の色
+        thickness uint16  (n)
+        types     uint8   (n)            Annotation.TYPESのindex
+        has_color uint8   (n)
+
+    座標は届いた順にそのまま書き、オブジェクトごとの小さな列だけを保持して最後に書く.
+    オブジェクト数と総頂点数は書き終わってからヘッダに書き戻す.
+    """
+
+    def __init__(self, path: str, image_size: tuple = None):
+        self.path = path
+        self.image_size = image_size
+        self.file = None
+        self.offsets = [0]
+        self.ids = []
+        self.colors = []
+        self.thickness = []
+        self.types = []
+        self.has_color = []
+
+    def __enter__(self):
+        self.file = open(self.path + ".tmp", 'wb')
+        self.file.write(bytes(BINARY_HEADER.size))
+        return self
+
+    def write(self, _obj: Annotation) -> None:
+        self.file.write(np.ascontiguousarray(_obj.points, dtype='<f8').tobytes())
+        self.offsets.append(self.offsets[-1] + _obj.coordinate_count)
+        self.ids.append(_obj.id)
+        self.colors.append(0 if _obj.custom_rgba is None else rgba_to_argb(_obj.custom_rgba))
+        self.thickness.append(_obj.line_thickness)
+        self.types.append(Annotation.TYPES.index(_obj.object_type))
+        self.has_color.append(_obj.custom_rgba is not None)
+
+    def __exit__(self, exc_type, *exc):
+        succeeded = False
+        try:
+            if exc_type is None:
+                self.file.write(np.array(self.offsets, dtype='<u8').tobytes())
+                self.file.write(np.array(self.ids, dtype='<i8').tobytes())
+                self.file.write(np.array(self.colors, dtype='<u4').tobytes())
+                self.file.write(np.array(self.thickness, dtype='<u2').tobytes())
+                self.file.write(np.array(self.types, dtype='u1').tobytes())
+                self.file.write(np.array(self.has_color, dtype='u1').tobytes())
+
+                width, height = (0, 0) if self.image_size is None else self.image_size
+                self.file.seek(0)
+                self.file.write(BINARY_HEADER.pack(BINARY_MAGIC, FORMAT_VERSION,
+                                                   len(self.ids), self.offsets[-1], width, height))
+                succeeded = True
+        finally:
+            _finish(self.file, self.path, succeeded)
+        return False
+
+
+def save(path: str, objects, image_size: tuple = None) -> int:
+    """
+    オブジェクトをファイルに書き出す. 形式は拡張子で決める（.drwbならバイナリ, それ以外はJSON）.
+    :param path: 書き出すファイルのパス.
+    :param objects: Annotation（DrawingObject）のiterable. ジェネレータでもよい.
+    :param image_size: 画像のサイズ(width, height). 分かっていれば記録しておく.
+    :return: 書き出したオブジェクト数.
+    """
+    is_binary = os.path.splitext(path)[1].lower() in BINARY_EXTENSIONS
+    writer = BinaryAnnotationWriter(path, image_size) if is_binary else JsonAnnotationWriter(path, image_size)
+    count = 0
+    with writer:
+        for _obj in objects:
+            writer.write(_obj)
+            count += 1
+    return count
+
+
+def load_json(path: str, factory=Annotation) -> (list, tuple):
+    """
+    JSON形式のファイルを読み込む. 内容の形が正しくない場合はValueErrorにする.
+    :param factory: オブジェクトを作る関数. object_from_recordを参照.
+    :return: (オブジェクトのリスト, 画像のサイズ(width, height)（記録されていなければNone）).
+    """
+    with open(path, encoding='utf-8') as file:
+        document = json.load(file)
+    if not isinstance(document, dict) or document.get("format") != JSON_FORMAT:
+        raise ValueError(f"{path} is not a {JSON_FORMAT} file.")
+    if document.get("version", 0) > FORMAT_VERSION:
+        raise ValueError(f"Unsupported format version: {document.get('version')}")
+
+    try:
+        objects = [object_from_record(record, factory) for record in document["objects"]]
+        image = document.get("image")
+        return objects, None if image is None else (image["width"], image["height"])
+    except (TypeError, KeyError, IndexError, AttributeError) as error:
+        raise ValueError(f"{path} has malformed objects: {error!r}") from error
+
+
+def load_binary(path: str, factory=Annotation) -> (list, tuple):
+    """
+    バイナリ形式のファイルを読み込む. 途中で切れているなど壊れたファイルはValueErrorにする.
+    :param factory: オブジェクトを作る関数. object_from_recordを参照.
+    :return: (オブジェクトのリスト, 画像のサイズ(width, height)（記録されていなければNone）).
+    """
+    with open(path, 'rb') as file:
+        data = file.read()
+
+    try:
+        return _parse_binary(path, data, factory)
+    except (struct.error, TypeError, IndexError) as error:
+        raise ValueError(f"{path} is a corrupted annotation binary file: {error!r}") from error
+
+
+def _parse_binary(path: str, data: bytes, factory) -> (list, tuple):
+    magic, version, n_objects, n_vertices, width, height = BINARY_HEADER.unpack_from(data)
+    if magic != BINARY_MAGIC:
+        raise ValueError(f"{path} is not an annotation binary file.")
+    if version > FORMAT_VERSION:
+        raise ValueError(f"Unsupported format version: {version}")
+
+    # 各列を順番に切り出す.
+    position = BINARY_HEADER.size
+
+    def column(dtype, count):
+        nonlocal position
+        array = np.frombuffer(data, dtype=dtype, count=count, offset=position)
+        position += array.nbytes
+        return array
+
+    xy = column('<f8', n_vertices * 2).reshape(-1, 2)
+    offsets = column('<u8', n_objects + 1).astype(np.intp)
+    ids = column('<i8', n_objects).tolist()
+    colors = column('<u4', n_objects).tolist()
+    thickness = column('<u2', n_objects).tolist()
+    types = column('u1', n_objects).tolist()
+    has_color = column('u1', n_objects).tolist()
+
+    objects = []
+    starts = offsets.tolist()
+    for i in range(n_objects):
+        objects.append(factory(ids[i],
+                               Annotation.TYPES[types[i]],
+                               # 読み込んだbytesのビューだが, Annotation側でコピーされる.
+                               xy[starts[i]:starts[i + 1]],
+                               rgba_from_argb(colors[i]) if has_color[i] else None,
+                               thickness[i],
+                               ))
+    return objects, None if width == 0 or height == 0 else (width, height)
+
+
+# 旧形式の読み込みに使う正規表現.
+_LEGACY_DICT = re.compile(r"defaultdict\(")
+_LEGACY_KEY = re.compile(r"(?:\{|,)\s*(\d+)\s*:\s*")
+_LEGACY_POINT = re.compile(r"(QPointF?)\(\s*([-+0-9.eE]+)\s*,\s*([-+0-9.eE]+)\s*\)")
+_LEGACY_TYPE = re.compile(r"type=(\w+)")
+_LEGACY_THICKNESS = re.compile(r"thickness=(\d+)")
+
+
+def import_legacy(path: str, window_size: tuple, factory=Annotation) -> list:
+    """
+    以前のexportDrawingが書き出したテキストファイル（rectAngleDictとpolyLinesDictのrepr）を読み込む.
+    evalはせず、正規表現で座標だけを取り出す.
+
+    QPoint（絶対座標）で書かれた古いファイルはwindow_sizeで相対座標に変換する.
+    色は書き出した時点の表示色（選択中の緑など）なので読み込まず、種類ごとの既定の色にする.
+
+    :param path: 旧形式のファイルのパス.
+    :param window_size: 絶対座標を相対座標に変換するためのサイズ(width, height). 書き出した時の画像のサイズ.
+    :param factory: オブジェクトを作る関数. object_from_recordを参照.
+    :return: オブジェクトのリスト.
+    """
+    with open(path, encoding='utf-8') as file:
+        text = file.read()
+
+    # 1つ目の辞書が矩形, 2つ目の辞書がポリライン.
+    starts = [m.start() for m in _LEGACY_DICT.finditer(text)]
+    sections = [text[s:e] for s, e in zip(starts, starts[1:] + [len(text)])]
+    objects = []
+    for default_type, section in zip(("Rectangle", "PolyLine"), sections):
+        keys = list(_LEGACY_KEY.finditer(section))
+        for key, next_key in zip(keys, keys[1:] + [None]):
+            body = section[key.end():len(section) if next_key is None else next_key.start()]
+            coordinates = []
+            for class_name, x, y in _LEGACY_POINT.findall(body):
+                x, y = float(x), float(y)
+                if class_name == "QPoint":
+                    x, y = x / window_size[0], y / window_size[1]
+                coordinates.append((x, y))
+            if not coordinates:
+                continue
+
+            object_type = _LEGACY_TYPE.search(body)
+            thickness = _LEGACY_THICKNESS.search(body)
+            objects.append(factory(int(key.group(1)),
+                                   default_type if object_type is None else object_type.group(1),
+                                   coordinates,
+                                   None,
+                                   2 if thickness is None else int(thickness.group(1)),
+                                   ))
+    return objects
+
+
+def load(path: str, window_size: tuple = None, factory=Annotation) -> (list, tuple):
+    """
+    拡張子で形式を判定してファイルを読み込む.
+    :param path: 読み込むファイルのパス.
+    :param window_size: 旧形式の絶対座標を変換するためのサイズ(width, height).
+    :param factory: オブジェクトを作る関数. object_from_recordを参照.
+    :return: (オブジェクトのリスト, 画像のサイズ(width, height)（記録されていなければNone）).
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension in BINARY_EXTENSIONS:
+        return load_binary(path, factory)
+    if extension in LEGACY_EXTENSIONS:
+        return import_legacy(path, window_size, factory), None
+    return load_json(path, factory)
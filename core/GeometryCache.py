@@ -0,0 +1,84 @@
+from collections import namedtuple
+
+from core.Annotation import Annotation
+from core import HitTest
+
+
+# キャッシュされる内容.
+# linestring: 絶対座標のLineString, buffered: marginを付けてprepare済みのPolygon, bounds: bufferedの外接矩形.
+CachedGeometry = namedtuple("CachedGeometry", ["linestring", "buffered", "bounds"])
+
+
+class GeometryCache:
+    """
+    当たり判定に使うShapelyのジオメトリを、オブジェクトごとにキャッシュするクラス.
+
+    キャッシュは同じオブジェクトで, version（座標が変わると増える）とウィンドウサイズが
+    同じ間だけ有効で、どれかが変わった時だけ作り直す.
+    削除して作り直したオブジェクトは同じkeyとversionになることがあるので, オブジェクト自体も比較する.
+    Shapelyは最初にジオメトリを作る時にimportする.
+    """
+
+    def __init__(self, margin: float, builder=HitTest.linestring):
+        """
+        :param margin: 当たり判定の余白(ピクセル).
+        :param builder: (Annotation, (width, height)) -> LineString の関数.
+        """
+        self.builder = builder
+        self.margin = margin
+        self._entries = {}  # key: オブジェクトのkey, value: (オブジェクト, version, (width, height), CachedGeometry)
+
+        # 効果測定用のカウンタ.
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, _obj: Annotation, size: tuple) -> CachedGeometry:
+        """
+        オブジェクトのジオメトリを返す. キャッシュが古ければ作り直す.
+        :param _obj: Annotation（DrawingObject）.
+        :param size: 絶対座標に戻すために必要なキャンバスのサイズ(width, height).
+        :return: CachedGeometry.
+        """
+        import shapely
+
+        entry = self._entries.get(_obj.key)
+        if entry is not None and entry[0] is _obj and entry[1] == _obj.version and entry[2] == size:
+            self.hits += 1
+            return entry[3]
+
+        self.misses += 1
+        linestring = self.builder(_obj, size)
+        buffered = linestring.buffer(self.margin)
+        shapely.prepare(buffered)
+        geometry = CachedGeometry(linestring, buffered, buffered.bounds)
+        self._entries[_obj.key] = (_obj, _obj.version, size, geometry)
+        return geometry
+
+    def contains(self, _obj: Annotation, size: tuple, x: float, y: float) -> bool:
+        """
+        絶対座標の点(x, y)が、オブジェクトにmarginを付けた領域の中にあるかどうか.
+        """
+        import shapely
+
+        geometry = self.get(_obj, size)
+        min_x, min_y, max_x, max_y = geometry.bounds
+        if not (min_x <= x <= max_x and min_y <= y <= max_y):
+            return False
+        return bool(shapely.contains_xy(geometry.buffered, x, y))
+
+    def discard(self, _obj: Annotation) -> None:
+        self._entries.pop(_obj.key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        """
+        ヒット数・ミス数・ヒット率を返す.
+        """
+        total = self.hits + self.misses
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self._entries),
+                }
@@ -0,0 +1,72 @@
+"""
+クリックした位置に対する当たり判定に使う関数. 座標はNumPy配列, サイズは(width, height)のタプルで扱う.
+Shapelyは外形のLineStringを作る時に初めてimportする.
+"""
+import numpy as np
+
+from core.Annotation import Annotation
+from core.Transforms import to_absolute
+
+
+def rectangle_corners(bounds: tuple) -> np.ndarray:
+    """
+    外接矩形の四隅を, (min_x, min_y), (max_x, min_y), (max_x, max_y), (min_x, max_y)の順に返す.
+    :param bounds: (min_x, min_y, max_x, max_y).
+    :return: (4, 2)の配列.
+    """
+    min_x, min_y, max_x, max_y = bounds
+    return np.array([(min_x, min_y), (max_x, min_y), (max_x, max_y), (min_x, max_y)], dtype=np.float64)
+
+
+def closest_vertex(_obj: Annotation, x: float, y: float) -> (int, np.ndarray):
+    """
+    相対座標の点(x, y)に最も近い頂点を探す. 矩形の場合は四隅(rectangle_corners)から探す.
+    :param _obj: Annotation.
+    :param x: 相対座標のx.
+    :param y: 相対座標のy.
+    :return: (頂点のindex, 頂点の相対座標). 座標が無い場合は(-1, None).
+    """
+    if _obj.coordinate_count == 0:
+        return -1, None
+    if _obj.object_type == "Rectangle":
+        vertices = rectangle_corners(_obj.relative_bounds())
+    else:
+        vertices = _obj.points
+
+    # 全ての座標との距離(の2乗)をまとめて計算し、最も近い点を選ぶ.
+    distances = ((vertices - (x, y)) ** 2).sum(axis=1)
+    index = int(np.argmin(distances))
+    return index, vertices[index]
+
+
+def rectangle_drag_points(bounds: tuple, corner: int) -> np.ndarray:
+    """
+    矩形の角をドラッグして修正する時の座標. 先頭がドラッグする角, 2番目がその対角（固定される角）.
+    :param bounds: 矩形の(min_x, min_y, max_x, max_y).
+    :param corner: rectangle_cornersのindex.
+    :return: (2, 2)の配列.
+    """
+    corners = rectangle_corners(bounds)
+    return corners[[corner, (corner + 2) % 4]]
+
+
+def outline(_obj: Annotation, size: tuple) -> np.ndarray:
+    """
+    当たり判定に使う外形を絶対座標の折れ線で返す. 矩形は四隅を一周する閉じた折れ線にする.
+    :param _obj: Annotation.
+    :param size: キャンバスのサイズ(width, height).
+    :return: int64の(n, 2)配列.
+    """
+    points = to_absolute(_obj.points, size)
+    if _obj.object_type == "Rectangle":
+        corners = rectangle_corners((*points.min(axis=0).tolist(), *points.max(axis=0).tolist()))
+        points = np.concatenate([corners, corners[:1]]).astype(np.int64)
+    return points
+
+
+def linestring(_obj: Annotation, size: tuple):
+    """
+    外形(outline)のShapelyのLineStringを返す.
+    """
+    import shapely
+    return shapely.LineString(outline(_obj, size))
@@ -0,0 +1,453 @@
+"""
+注釈を学習用のマスクに書き出すモジュール. Qtに依存しない.
+
+線・矩形・ポリラインを画像の元の解像度で塗り, 以下を書き出す.
+
+- ラベルマップ: 画素ごとにオブジェクトの種類の番号(CATEGORIES, 背景は0)を持つuint8の(height, width)配列.
+               NumPyの.npy形式で, STRIP_ROWS行ずつ塗ってはファイルに書き込む.
+- COCO形式のJSON: オブジェクトごとのマスクを非圧縮のRLE（列優先の連長）で持つ.
+                  画像の列をSTRIP_ROWS列ずつ塗ってはランに変換するので, マスク全体を作らない.
+
+線とポリラインは太さline_thicknessの線（端は丸）, 矩形は内側を塗りつぶした領域として扱う.
+画素は中心が領域に含まれる場合に塗る. 各行（RLEでは各列）で領域に含まれる区間を座標から直接計算するので,
+オブジェクトの外接矩形の外側の画素には触れない.
+
+データセット全体はexport_datasetでプロセスプールに画像ごとに振り分けて書き出す.
+    python -m core.MaskExport project.drwproj masks/ --workers 8
+"""
+import argparse
+import json
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import numpy as np
+
+from core.Annotation import Annotation
+
+# オブジェクトの種類ごとのラベル. 0は背景.
+CATEGORIES = {"Line": 1, "Rectangle": 2, "PolyLine": 3}
+
+# 一度に塗る行数（RLEでは列数）.
+STRIP_ROWS = 256
+
+# 書き出しに使うプロセスの数.
+WORKERS = max(1, os.cpu_count() or 1)
+
+# 領域の境界ちょうどにある画素の中心を, 行ごと・列ごとのどちらで処理しても同じく塗るための余裕（ピクセル）.
+_EPSILON = 1e-6
+
+
+def _linear_range(a, b, lo, hi) -> tuple:
+    """
+    lo <= a * x + b <= hi を満たすxの範囲を返す. 配列はブロードキャストされる.
+    :return: (下限, 上限). 解が無い場合は下限 > 上限.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        p = (lo - b) / a
+        q = (hi - b) / a
+    x_lo = np.where(a > 0, p, q)
+    x_hi = np.where(a > 0, q, p)
+
+    # a == 0 の場合は, bが範囲内なら全てのx, そうでなければ解なし.
+    flat = a == 0
+    inside = (b >= lo) & (b <= hi)
+    x_lo = np.where(flat, np.where(inside, -np.inf, np.inf), x_lo)
+    x_hi = np.where(flat, np.where(inside, np.inf, -np.inf), x_hi)
+    return x_lo, x_hi
+
+
+class Shape:
+    """
+    1つのオブジェクトを塗る領域. 太さのある線分（端が丸いカプセル）の集まりか, 塗りつぶした矩形.
+    座標は画像のピクセル単位で, 画素(i, j)の中心は(i + 0.5, j + 0.5).
+    """
+
+    __slots__ = ("segments", "radius", "box", "bounds")
+
+    def __init__(self, segments: np.ndarray = None, radius: float = 0.0, box: tuple = None):
+        """
+        :param segments: 線分の(n, 4)配列(x0, y0, x1, y1). 長さ0の線分は点（円）になる.
+        :param radius: 線の太さの半分.
+        :param box: 塗りつぶす矩形(min_x, min_y, max_x, max_y). 指定した場合segmentsは使わない.
+        """
+        self.segments = segments
+        self.radius = radius
+        self.box = box
+        if box is not None:
+            self.bounds = tuple(box)
+        else:
+            xs, ys = segments[:, 0::2], segments[:, 1::2]
+            self.bounds = (xs.min() - radius, ys.min() - radius, xs.max() + radius, ys.max() + radius)
+
+    def intervals(self, ys: np.ndarray) -> tuple:
+        """
+        水平線 y = ys[k] のうち, 領域に含まれるxの範囲を線分ごとに返す.
+        カプセルは凸なので, 両端の円と線分に沿った帯のそれぞれの範囲を合わせたものが1つの区間になる.
+        :param ys: 行のyの配列(m,).
+        :return: (下限, 上限). 共に(m, 線分の数)の配列. 含まれない場合は下限 > 上限.
+        """
+        y = ys[:, None]
+        if self.box is not None:
+            min_x, min_y, max_x, max_y = self.box
+            inside = (y >= min_y - _EPSILON) & (y <= max_y + _EPSILON)
+            return np.where(inside, min_x - _EPSILON, np.inf), np.where(inside, max_x + _EPSILON, -np.inf)
+
+        x0, y0, x1, y1 = (self.segments[:, i][None, :] for i in range(4))
+        r = self.radius + _EPSILON
+        lo = np.full((len(ys), len(self.segments)), np.inf)
+        hi = np.full((len(ys), len(self.segments)), -np.inf)
+
+        # 両端の円.
+        for cx, cy in ((x0, y0), (x1, y1)):
+            h2 = r * r - (y - cy) ** 2
+            half = np.sqrt(np.maximum(h2, 0.0))
+            lo = np.where(h2 >= 0, np.minimum(lo, cx - half), lo)
+            hi = np.where(h2 >= 0, np.maximum(hi, cx + half), hi)
+
+        # 線分に沿った帯. 線分からの距離がr以下で, 垂線の足が線分上にある点.
+        dx, dy = x1 - x0, y1 - y0
+        length2 = dx * dx + dy * dy
+        reach = r * np.sqrt(length2)
+        l1, h1 = _linear_range(-dy, dx * (y - y0) + dy * x0, -reach, reach)
+        l2, h2 = _linear_range(dx, dy * (y - y0) - dx * x0, 0.0, length2)
+        band_lo, band_hi = np.maximum(l1, l2), np.minimum(h1, h2)
+        band = (band_lo <= band_hi) & (length2 > 0)
+        lo = np.where(band, np.minimum(lo, band_lo), lo)
+        hi = np.where(band, np.maximum(hi, band_hi), hi)
+        return lo, hi
+
+    def pixel_range(self, size: tuple) -> tuple:
+        """
+        塗る可能性のある画素の範囲.
+        :param size: 画像のサイズ(width, height).
+        :return: (列の開始, 行の開始, 列の終了, 行の終了). 終了は含まない.
+        """
+        min_x, min_y, max_x, max_y = self.bounds
+        min_x, min_y, max_x, max_y = min_x - _EPSILON, min_y - _EPSILON, max_x + _EPSILON, max_y + _EPSILON
+        return (max(0, math.ceil(min_x - 0.5)), max(0, math.ceil(min_y - 0.5)),
+                min(size[0], math.floor(max_x - 0.5) + 1), min(size[1], math.floor(max_y - 0.5) + 1))
+
+    def fill(self, row_start: int, row_stop: int, column_start: int, column_stop: int) -> np.ndarray:
+        """
+        指定した範囲の画素のうち, 中心が領域に含まれるものを塗ったマスクを返す.
+        各行の区間の両端に+1/-1を置いて累積和を取るので, 線分が重なっていても1回ずつ数えるだけで済む.
+        :return: (row_stop - row_start, column_stop - column_start)のbool配列.
+        """
+        rows, width = row_stop - row_start, column_stop - column_start
+        lo, hi = self.intervals(np.arange(row_start, row_stop) + 0.5)
+        start = np.clip(np.ceil(lo - 0.5), column_start, column_stop)
+        end = np.clip(np.floor(hi - 0.5) + 1, column_start, column_stop)
+        valid = start < end
+        row = np.broadcast_to(np.arange(rows)[:, None], lo.shape)[valid]
+        start = row * (width + 1) + (start[valid] - column_start).astype(np.int64)
+        end = row * (width + 1) + (end[valid] - column_start).astype(np.int64)
+        length = rows * (width + 1)
+        edges = np.bincount(start, minlength=length) - np.bincount(end, minlength=length)
+        return np.cumsum(edges.reshape(rows, width + 1), axis=1)[:, :width] > 0
+
+
+def object_shape(_obj: Annotation, size: tuple, thickness: float = None, fill_rectangles: bool = True,
+                 transpose: bool = False) -> Shape:
+    """
+    オブジェクトを画像のピクセル単位の領域に変換する.
+    :param _obj: Annotationクラスの変数.
+    :param size: 画像のサイズ(width, height).
+    :param thickness: 線の太さ（画像のピクセル単位）. Noneならオブジェクトのline_thickness.
+    :param fill_rectangles: Trueなら矩形の内側を塗る. Falseなら線と同じく枠だけを塗る.
+    :param transpose: Trueならxとyを入れ替える（列ごとに処理する場合）.
+    :return: Shape. 座標が無ければNone.
+    """
+    if _obj.coordinate_count == 0:
+        return None
+    points = _obj.points * np.array(size, dtype=np.float64)
+    if transpose:
+        points = points[:, ::-1]
+    radius = (_obj.line_thickness if thickness is None else thickness) / 2
+
+    if _obj.object_type == "Rectangle" and len(points) >= 2:
+        (min_x, min_y), (max_x, max_y) = np.minimum(points[0], points[1]), np.maximum(points[0], points[1])
+        if fill_rectangles:
+            return Shape(box=(min_x, min_y, max_x, max_y))
+        corners = np.array([(min_x, min_y), (max_x, min_y), (max_x, max_y), (min_x, max_y), (min_x, min_y)])
+        return Shape(np.hstack([corners[:-1], corners[1:]]), radius)
+    if _obj.object_type == "Line":
+        points = points[:2]
+    if len(points) == 1:
+        return Shape(np.hstack([points, points]), radius)
+    return Shape(np.hstack([points[:-1], points[1:]]), radius)
+
+
+def label_map_strips(objects, size: tuple, strip_rows: int = STRIP_ROWS, thickness: float = None,
+                     fill_rectangles: bool = True):
+    """
+    ラベルマップをstrip_rows行ずつ返すジェネレータ. 重なった画素は後のオブジェクトのラベルになる.
+    :param objects: Annotationのiterable.
+    :param size: 画像のサイズ(width, height).
+    :return: (先頭の行, (行数, width)のuint8配列)を順に返す.
+    """
+    width, height = size
+    shapes, labels = [], []
+    for _obj in objects:
+        shape = object_shape(_obj, size, thickness, fill_rectangles)
+        if shape is not None:
+            shapes.append(shape)
+            labels.append(CATEGORIES[_obj.object_type])
+    ranges = np.array([shape.pixel_range(size) for shape in shapes], dtype=np.int64).reshape(-1, 4)
+
+    for row_start in range(0, height, strip_rows):
+        row_stop = min(height, row_start + strip_rows)
+        strip = np.zeros((row_stop - row_start, width), dtype=np.uint8)
+        # この範囲の行に掛かるオブジェクトだけを, 元の順番で塗る.
+        hits = np.flatnonzero((ranges[:, 1] < row_stop) & (ranges[:, 3] > row_start) & (ranges[:, 0] < ranges[:, 2]))
+        for i in hits.tolist():
+            column_start, first, column_stop, last = ranges[i].tolist()
+            first, last = max(first, row_start), min(last, row_stop)
+            mask = shapes[i].fill(first, last, column_start, column_stop)
+            strip[first - row_start:last - row_start, column_start:column_stop][mask] = labels[i]
+        yield row_start, strip
+
+
+def write_label_map(path: str, objects, size: tuple, strip_rows: int = STRIP_ROWS, thickness: float = None,
+                    fill_rectangles: bool = True) -> None:
+    """
+    ラベルマップを.npy形式で書き出す. ファイルをメモリマップしてstrip_rows行ずつ書き込むので,
+    メモリに置くのは1回に塗る行の分だけ.
+    """
+    width, height = size
+    labels = np.lib.format.open_memmap(path, mode="w+", dtype=np.uint8, shape=(height, width))
+    for row_start, strip in label_map_strips(objects, size, strip_rows, thickness, fill_rectangles):
+        labels[row_start:row_start + len(strip)] = strip
+    labels.flush()
+    del labels
+
+
+def encode_rle(_obj: Annotation, size: tuple, strip_rows: int = STRIP_ROWS, thickness: float = None,
+               fill_rectangles: bool = True) -> dict:
+    """
+    オブジェクトのマスクをCOCO形式の非圧縮RLEにする.
+    COCOのRLEは列優先（x方向に1列ずつ, 各列は上から下）の連長なので, xとyを入れ替えた領域を
+    strip_rows列ずつ塗り, 列ごとのランを画像全体での位置に直してつなげる.
+    :return: {"segmentation": {"size": [height, width], "counts": [...]}, "area": 画素数, "bbox": [x, y, w, h]}.
+             1画素も塗らない場合はNone.
+    """
+    width, height = size
+    shape = object_shape(_obj, size, thickness, fill_rectangles, transpose=True)
+    if shape is None:
+        return None
+    # 入れ替えているので, 行が元の画像の列, 列が元の画像の行.
+    row_start, column_start, row_stop, column_stop = shape.pixel_range((height, width))
+    if row_start >= row_stop or column_start >= column_stop:
+        return None
+
+    starts, ends = [], []
+    for first in range(column_start, column_stop, strip_rows):
+        last = min(column_stop, first + strip_rows)
+        mask = shape.fill(first, last, row_start, row_stop)
+        padded = np.zeros((last - first, row_stop - row_start + 2), dtype=np.int8)
+        padded[:, 1:-1] = mask
+        edges = np.diff(padded, axis=1)
+        column, start = np.nonzero(edges == 1)
+        _, end = np.nonzero(edges == -1)
+        offset = (first + column) * height + row_start
+        starts.append(offset + start)
+        ends.append(offset + end)
+    starts = np.concatenate(starts) if starts else np.empty(0, dtype=np.int64)
+    ends = np.concatenate(ends) if ends else np.empty(0, dtype=np.int64)
+    if len(starts) == 0:
+        return None
+
+    # 外接矩形は列に分かれたままのランから求める.
+    columns = starts // height
+    x, y = int(columns.min()), int((starts % height).min())
+    bbox = [x, y, int(columns.max()) - x + 1, int(((ends - 1) % height).max()) - y + 1]
+
+    # 列の最後の画素と次の列の先頭の画素が続いている場合は1つのランにする.
+    joined = starts[1:] == ends[:-1]
+    starts, ends = starts[np.r_[True, ~joined]], ends[np.r_[~joined, True]]
+    counts = np.empty(2 * len(starts), dtype=np.int64)
+    counts[0::2] = starts - np.r_[0, ends[:-1]]
+    counts[1::2] = ends - starts
+    counts = counts.tolist()
+    if ends[-1] < width * height:
+        counts.append(int(width * height - ends[-1]))
+    return {"segmentation": {"size": [height, width], "counts": counts},
+            "area": int(np.sum(ends - starts)),
+            "bbox": bbox,
+            }
+
+
+def export_image(task: dict) -> dict:
+    """
+    1枚の画像のラベルマップとRLEを作成する. プロセスプールのワーカーで呼ばれる.
+    :param task: export_datasetが作成する辞書（index, file_name, size, objects, label_map, coco, options）.
+    :return: {"index", "image", "annotations", "label_map"}. annotationsのidは呼び出し側で振る.
+    """
+    size = tuple(task["size"])
+    options = task["options"]
+    if task["label_map"] is not None:
+        write_label_map(task["label_map"], task["objects"], size, **options)
+
+    annotations = []
+    if task["coco"]:
+        for _obj in task["objects"]:
+            rle = encode_rle(_obj, size, **options)
+            if rle is not None:
+                annotations.append({"category_id": CATEGORIES[_obj.object_type], "iscrowd": 1, **rle})
+    return {"index": task["index"],
+            "image": {"file_name": task["file_name"], "width": size[0], "height": size[1]},
+            "annotations": annotations,
+            "label_map": task["label_map"],
+            }
+
+
+def export_dataset(items, output_dir: str, workers: int = WORKERS, label_maps: bool = True, coco: bool = True,
+                   strip_rows: int = STRIP_ROWS, thickness: float = None, fill_rectangles: bool = True,
+                   progress=None) -> dict:
+    """
+    複数の画像の注釈をマスクに書き出す. 画像ごとにプロセスプールのワーカーに振り分ける.
+    itemsは依頼した分が終わるのを待ちながら少しずつ読むので, 全ての画像の注釈を一度に読み込まない.
+    :param items: (画像のパス, 画像のサイズ(width, height), Annotationのリスト)のiterable.
+    :param output_dir: 書き出すフォルダ. ラベルマップは"{番号:06d}_{画像の名前}.npy",
+                       COCO形式のJSONは"annotations.json".
+    :param workers: プロセスの数. 1以下なら呼び出したプロセスで順に書き出す.
+    :param label_maps: ラベルマップを書き出すかどうか.
+    :param coco: COCO形式のJSONを書き出すかどうか.
+    :param strip_rows: 一度に塗る行数（RLEでは列数）.
+    :param thickness: 線の太さ（画像のピクセル単位）. Noneならオブジェクトのline_thickness.
+    :param fill_rectangles: Trueなら矩形の内側を塗る.
+    :param progress: 1枚終わるごとに(終わった枚数)で呼ばれる関数.
+    :return: {"images": 画像の枚数, "annotations": RLEの数, "coco": JSONのパス（書き出さなければNone）}.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    options = {"strip_rows": strip_rows, "thickness": thickness, "fill_rectangles": fill_rectangles}
+
+    def tasks():
+        for index, (file_name, size, objects) in enumerate(items):
+            name = os.path.splitext(os.path.basename(file_name))[0]
+            yield {"index": index,
+                   "file_name": file_name,
+                   "size": size,
+                   "objects": objects,
+                   "label_map": os.path.join(output_dir, f"{index:06d}_{name}.npy") if label_maps else None,
+                   "coco": coco,
+                   "options": options,
+                   }
+
+    results = []
+    if workers <= 1:
+        for task in tasks():
+            results.append(export_image(task))
+            if progress is not None:
+                progress(len(results))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # 実行中と待ちの画像をworkersの数倍までに抑え, 終わった分だけ次の画像を読む.
+            pending = set()
+            for task in tasks():
+                pending.add(executor.submit(export_image, task))
+                if len(pending) >= 4 * workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        results.append(future.result())
+                        if progress is not None:
+                            progress(len(results))
+            for future in pending:
+                results.append(future.result())
+                if progress is not None:
+                    progress(len(results))
+
+    results.sort(key=lambda result: result["index"])
+    annotation_count = sum(len(result["annotations"]) for result in results)
+    coco_path = None
+    if coco:
+        images, annotations = [], []
+        for result in results:
+            image_id = result["index"] + 1
+            images.append({"id": image_id, **result["image"]})
+            for annotation in result["annotations"]:
+                annotations.append({"id": len(annotations) + 1, "image_id": image_id, **annotation})
+        coco_path = os.path.join(output_dir, "annotations.json")
+        with open(coco_path, "w", encoding="utf-8") as file:
+            json.dump({"images": images,
+                       "annotations": annotations,
+                       "categories": [{"id": i, "name": name} for name, i in CATEGORIES.items()],
+                       }, file)
+    return {"images": len(results), "annotations": annotation_count, "coco": coco_path}
+
+
+def project_items(project_path: str, skipped: list = None):
+    """
+    プロジェクトの画像ごとに(画像のパス, サイズ, Annotationのリスト)を返すジェネレータ.
+    サイズを記録していない（一度も表示していない）画像は飛ばす.
+    :param skipped: 指定した場合, 飛ばした画像のパスを追加する.
+    """
+    from core.ProjectStore import ProjectStore
+
+    store = ProjectStore()
+    store.open(project_path)
+    try:
+        for path in store.image_paths():
+            size = store.image_size(path)
+            if size is None:
+                if skipped is not None:
+                    skipped.append(path)
+                continue
+            yield path, size, store.load_objects(path)
+    finally:
+        store.close()
+
+
+def file_items(paths: list, skipped: list = None):
+    """
+    注釈ファイル(JSON・バイナリ)ごとに(ファイルのパス, サイズ, Annotationのリスト)を返すジェネレータ.
+    画像のサイズを記録していないファイルは飛ばす.
+    """
+    from core import AnnotationFile
+
+    for path in paths:
+        # 旧形式のファイルは画像のサイズを記録していない.
+        if os.path.splitext(path)[1].lower() in AnnotationFile.LEGACY_EXTENSIONS:
+            objects, size = [], None
+        else:
+            objects, size = AnnotationFile.load(path)
+        if size is None:
+            if skipped is not None:
+                skipped.append(path)
+            continue
+        yield path, size, objects
+
+
+def main():
+    parser = argparse.ArgumentParser(description="注釈をラベルマップとCOCO形式のRLEに書き出す.")
+    parser.add_argument("inputs", nargs="+", help="プロジェクト(.drwproj)か, 注釈ファイル(.json/.drwb)")
+    parser.add_argument("output", help="書き出すフォルダ")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--no-label-maps", action="store_true", help="ラベルマップを書き出さない")
+    parser.add_argument("--no-coco", action="store_true", help="COCO形式のJSONを書き出さない")
+    parser.add_argument("--strip-rows", type=int, default=STRIP_ROWS)
+    parser.add_argument("--thickness", type=float, help="線の太さ（画像のピクセル単位）. 省略時は注釈の太さ")
+    parser.add_argument("--outline-rectangles", action="store_true", help="矩形の内側を塗らず, 枠だけを塗る")
+    args = parser.parse_args()
+
+    skipped = []
+    if len(args.inputs) == 1 and args.inputs[0].endswith(".drwproj"):
+        items = project_items(args.inputs[0], skipped)
+    else:
+        items = file_items(args.inputs, skipped)
+    result = export_dataset(items, args.output,
+                            workers=args.workers,
+                            label_maps=not args.no_label_maps,
+                            coco=not args.no_coco,
+                            strip_rows=args.strip_rows,
+                            thickness=args.thickness,
+                            fill_rectangles=not args.outline_rectangles,
+                            progress=lambda done: print(f"\r{done} images", end="", flush=True),
+                            )
+    print(f"\r{result['images']} images, {result['annotations']} annotations -> {args.output}")
+    for path in skipped:
+        print(f"skipped (image size unknown): {path}")
+
+
+if __name__ == "__main__":
+    main()
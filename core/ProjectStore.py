@@ -0,0 +1,374 @@
+import os
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+from core.Annotation import Annotation
+from core.AnnotationFile import rgba_to_argb, rgba_from_argb
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    id     INTEGER PRIMARY KEY,
+    path   TEXT NOT NULL UNIQUE,
+    width  INTEGER,
+    height INTEGER
+);
+CREATE TABLE IF NOT EXISTS objects (
+    image_id    INTEGER NOT NULL REFERENCES images(id) ON DELETE CASCADE,
+    type        TEXT NOT NULL,
+    object_id   INTEGER NOT NULL,
+    color       INTEGER,
+    thickness   INTEGER NOT NULL,
+    min_x       REAL NOT NULL,
+    min_y       REAL NOT NULL,
+    max_x       REAL NOT NULL,
+    max_y       REAL NOT NULL,
+    point_count INTEGER NOT NULL,
+    points      BLOB NOT NULL,
+    UNIQUE (image_id, type, object_id)
+);
+CREATE INDEX IF NOT EXISTS objects_type ON objects (type, image_id);
+CREATE INDEX IF NOT EXISTS objects_bounds ON objects (image_id, min_x, max_x, min_y, max_y);
+"""
+
+_INSERT = ("INSERT OR REPLACE INTO objects (image_id, type, object_id, color, thickness, "
+           "min_x, min_y, max_x, max_y, point_count, points) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)")
+
+
+class ProjectStore:
+    """
+    多数の画像とそのオブジェクトを1つのSQLiteファイル（プロジェクト）に保存するクラス.
+
+    オブジェクトは画像ごとに必要になった時(open_image)だけ読み込む.
+    変更はEditJournalと同じくrecord/removeで受け取って溜めておき、
+    batch_size件に達するかcommit_interval秒経ったら1つのトランザクションでまとめて書き込む.
+
+    objectsテーブルには画像, 種類, 外接矩形(相対座標)の索引があるので,
+    「矩形の無い画像」や「種類ごとの数」といったプロジェクト全体の集計を、オブジェクトを読み込まずに行える.
+    画像のパスはプロジェクトファイルのあるフォルダからの相対パスで保存する.
+    作成したスレッドからだけ使う.
+    """
+
+    # この件数の変更が溜まったら書き込む.
+    BATCH_SIZE = 1000
+
+    # 最初の変更からこの秒数が経ったら書き込む.
+    COMMIT_INTERVAL = 2.0
+
+    def __init__(self, batch_size: int = BATCH_SIZE, commit_interval: float = COMMIT_INTERVAL, factory=Annotation):
+        """
+        :param batch_size: この件数の変更が溜まったら書き込む.
+        :param commit_interval: 最初の変更からこの秒数が経ったら書き込む.
+        :param factory: 読み込んだオブジェクトを作る関数. AnnotationFile.object_from_recordを参照.
+        """
+        self.batch_size = batch_size
+        self.commit_interval = commit_interval
+        self.factory = factory
+
+        self.path = None  # プロジェクトファイルのパス. Noneなら記録しない.
+        self.image_path = None  # オブジェクトを読み込んでいる画像のパス.
+        self.is_paused = False
+
+        self._connection = None
+        self._image_id = None
+        self._recorded = {}  # key: オブジェクトのkey, value: (記録したオブジェクト, version)
+        self._pending = {}  # key: オブジェクトのkey, value: 書き込むオブジェクト. 削除ならNone.
+        self._pending_since = None
+
+        # 効果測定用のカウンタ.
+        self.commits = 0  # 書き込んだトランザクションの数
+        self.written = 0  # 書き込んだ（削除を含む）オブジェクトの数
+
+    @property
+    def is_active(self) -> bool:
+        return self._connection is not None
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    # ------------------------------------------------------------------
+    # プロジェクト・画像
+
+    def open(self, path: str) -> None:
+        """
+        プロジェクトファイルを開く. 無ければ作成する.
+        :param path: プロジェクトファイルのパス.
+        :return:
+        """
+        import sqlite3
+
+        self.close()
+        connection = sqlite3.connect(path)
+        try:
+            # WALにすると書き込み中も読み込みを妨げず, コミットごとのfsyncも少なくて済む.
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("PRAGMA foreign_keys=ON")
+            connection.executescript(_SCHEMA)
+        except sqlite3.DatabaseError:
+            connection.close()
+            raise
+        self._connection = connection
+        self.path = path
+
+    def close(self) -> None:
+        """
+        書き込み待ちの変更を書き込んでからプロジェクトを閉じる.
+        :return:
+        """
+        if self._connection is None:
+            return
+        self.commit()
+        self._connection.close()
+        self._connection = None
+        self.path = None
+        self.image_path = None
+        self._image_id = None
+        self._recorded.clear()
+
+    def _relative(self, image_path: str) -> str:
+        """
+        画像のパスをプロジェクトのフォルダからの相対パスにする. ドライブが違う場合は絶対パスのまま.
+        """
+        image_path = os.path.abspath(image_path)
+        try:
+            relative = os.path.relpath(image_path, os.path.dirname(os.path.abspath(self.path)))
+        except ValueError:
+            return image_path
+        return relative.replace(os.sep, "/")
+
+    def _absolute(self, stored: str) -> str:
+        return os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(self.path)), stored))
+
+    def add_images(self, image_paths) -> int:
+        """
+        画像をプロジェクトに登録する. 登録済みの画像は無視する.
+        :param image_paths: 画像のパスのiterable.
+        :return: 新しく登録した画像の数.
+        """
+        before = self._connection.total_changes
+        with self._connection:
+            self._connection.executemany("INSERT OR IGNORE INTO images (path) VALUES (?)",
+                                         ((self._relative(p),) for p in image_paths))
+        return self._connection.total_changes - before
+
+    def image_paths(self) -> list:
+        """
+        登録されている画像のパスをパス順に返す.
+        """
+        rows = self._connection.execute("SELECT path FROM images ORDER BY path")
+        return [self._absolute(path) for path, in rows]
+
+    def set_image_size(self, image_path: str, size: tuple) -> None:
+        """
+        画像の元のサイズ(width, height)を記録する. マスクの書き出しなど, 画像を開かずにサイズが必要な場合に使う.
+        """
+        with self._connection:
+            self._connection.execute("UPDATE images SET width = ?, height = ? WHERE path = ?",
+                                     (*size, self._relative(image_path)))
+
+    def image_size(self, image_path: str) -> tuple:
+        """
+        :return: 記録した画像のサイズ(width, height). 記録していなければNone.
+        """
+        row = self._connection.execute("SELECT width, height FROM images WHERE path = ?",
+                                       (self._relative(image_path),)).fetchone()
+        return None if row is None or row[0] is None else tuple(row)
+
+    def _image_id_of(self, image_path: str, create: bool) -> int:
+        stored = self._relative(image_path)
+        row = self._connection.execute("SELECT id FROM images WHERE path = ?", (stored,)).fetchone()
+        if row is not None:
+            return row[0]
+        if not create:
+            return None
+        with self._connection:
+            return self._connection.execute("INSERT INTO images (path) VALUES (?)", (stored,)).lastrowid
+
+    def open_image(self, image_path: str) -> list:
+        """
+        前の画像の変更を書き込み, 画像のオブジェクトを読み込む. 以降のrecord/removeはこの画像への変更になる.
+        登録されていない画像は登録する.
+        :param image_path: 画像のパス.
+        :return: オブジェクトのリスト（線, 矩形, ポリラインの順）.
+        """
+        self.commit()
+        self._image_id = self._image_id_of(image_path, create=True)
+        self.image_path = image_path
+        objects = self.load_objects(image_path)
+        self._recorded = {_obj.key: (_obj, _obj.version) for _obj in objects}
+        return objects
+
+    def load_objects(self, image_path: str) -> list:
+        """
+        画像のオブジェクトを読み込む. 書き込み待ちの変更は含まない.
+        :return: オブジェクトのリスト（線, 矩形, ポリラインの順）.
+        """
+        image_id = self._image_id_of(image_path, create=False)
+        if image_id is None:
+            return []
+        rows = self._connection.execute(
+            "SELECT type, object_id, color, thickness, points FROM objects WHERE image_id = ?", (image_id,))
+        objects = [self.factory(object_id,
+                                object_type,
+                                np.frombuffer(points, dtype='<f8').reshape(-1, 2),
+                                None if color is None else rgba_from_argb(color),
+                                thickness,
+                                )
+                   for object_type, object_id, color, thickness, points in rows]
+        objects.sort(key=lambda o: (Annotation.TYPES.index(o.object_type), o.id))
+        return objects
+
+    # ------------------------------------------------------------------
+    # 変更の記録
+
+    @contextmanager
+    def paused(self):
+        """
+        withブロックの中の変更を記録しない. 後でreplaceでまとめて書き込む場合に使う.
+        """
+        self.is_paused = True
+        try:
+            yield self
+        finally:
+            self.is_paused = False
+
+    def _mark(self, key: tuple, _obj: Annotation) -> None:
+        if self._pending_since is None:
+            self._pending_since = time.monotonic()
+        self._pending[key] = _obj
+        if (len(self._pending) >= self.batch_size or
+                time.monotonic() - self._pending_since >= self.commit_interval):
+            self.commit()
+
+    def record(self, _obj: Annotation) -> None:
+        """
+        オブジェクトの追加・座標の変更を記録する. 前回記録した時から座標が変わっていなければ何もしない.
+        :param _obj: 確定済みのAnnotation.
+        :return:
+        """
+        entry = self._recorded.get(_obj.key)
+        if entry is not None and entry[0] is _obj and entry[1] == _obj.version:
+            return
+        self._recorded[_obj.key] = (_obj, _obj.version)
+        if self.is_active and self._image_id is not None and not self.is_paused:
+            self._mark(_obj.key, _obj)
+
+    def remove(self, key: tuple) -> None:
+        """
+        オブジェクトの削除を記録する.
+        :param key: 削除したオブジェクトのkey.
+        :return:
+        """
+        self._recorded.pop(key, None)
+        if self.is_active and self._image_id is not None and not self.is_paused:
+            self._mark(key, None)
+
+    def replace(self, objects) -> None:
+        """
+        画像のオブジェクトを全て置き換える. ファイルから読み込んだ場合など.
+        :param objects: 確定済みの全Annotationのiterable.
+        :return:
+        """
+        objects = list(objects)
+        self._recorded = {_obj.key: (_obj, _obj.version) for _obj in objects}
+        self._pending.clear()
+        self._pending_since = None
+        if not self.is_active or self._image_id is None:
+            return
+        with self._connection:
+            self._connection.execute("DELETE FROM objects WHERE image_id = ?", (self._image_id,))
+            self._connection.executemany(_INSERT, (self._row(_obj) for _obj in objects))
+        self.commits += 1
+        self.written += len(objects)
+
+    def _row(self, _obj: Annotation) -> tuple:
+        min_x, min_y, max_x, max_y = _obj.relative_bounds() or (0.0, 0.0, 0.0, 0.0)
+        return (self._image_id, _obj.object_type, _obj.id,
+                None if _obj.custom_rgba is None else rgba_to_argb(_obj.custom_rgba),
+                _obj.line_thickness, min_x, min_y, max_x, max_y, _obj.coordinate_count,
+                np.ascontiguousarray(_obj.points, dtype='<f8').tobytes())
+
+    def commit(self) -> None:
+        """
+        書き込み待ちの変更を1つのトランザクションで書き込む.
+        :return:
+        """
+        if not self._pending or self._connection is None:
+            return
+        deleted = [(self._image_id, key[0], key[1]) for key, _obj in self._pending.items() if _obj is None]
+        written = [self._row(_obj) for _obj in self._pending.values() if _obj is not None]
+        with self._connection:
+            self._connection.executemany(
+                "DELETE FROM objects WHERE image_id = ? AND type = ? AND object_id = ?", deleted)
+            self._connection.executemany(_INSERT, written)
+        self.commits += 1
+        self.written += len(self._pending)
+        self._pending.clear()
+        self._pending_since = None
+
+    # ------------------------------------------------------------------
+    # プロジェクト全体の集計. 書き込み待ちの変更は含まないので, 必要ならcommitしてから呼ぶ.
+
+    def count_by_type(self, image_path: str = None) -> dict:
+        """
+        種類ごとのオブジェクト数.
+        :param image_path: 画像のパス. 省略するとプロジェクト全体.
+        :return: key: 種類, value: 数. 全ての種類を含む.
+        """
+        counts = dict.fromkeys(Annotation.TYPES, 0)
+        if image_path is None:
+            rows = self._connection.execute("SELECT type, COUNT(*) FROM objects GROUP BY type")
+        else:
+            image_id = self._image_id_of(image_path, create=False)
+            rows = self._connection.execute(
+                "SELECT type, COUNT(*) FROM objects WHERE image_id = ? GROUP BY type", (image_id,))
+        counts.update(rows)
+        return counts
+
+    def images_without(self, object_type: str) -> list:
+        """
+        指定した種類のオブジェクトが1つも無い画像のパスをパス順に返す. 例: images_without("Rectangle").
+        """
+        rows = self._connection.execute(
+            "SELECT path FROM images WHERE NOT EXISTS "
+            "(SELECT 1 FROM objects WHERE objects.image_id = images.id AND objects.type = ?) ORDER BY path",
+            (object_type,))
+        return [self._absolute(path) for path, in rows]
+
+    def images_with(self, object_type: str) -> list:
+        """
+        指定した種類のオブジェクトがある画像のパスと, その数の組のリストをパス順に返す.
+        """
+        rows = self._connection.execute(
+            "SELECT images.path, COUNT(*) FROM objects JOIN images ON images.id = objects.image_id "
+            "WHERE objects.type = ? GROUP BY objects.image_id ORDER BY images.path", (object_type,))
+        return [(self._absolute(path), count) for path, count in rows]
+
+    def find_objects(self, image_path: str, bounds: tuple) -> list:
+        """
+        画像のオブジェクトのうち, 外接矩形が範囲と重なるもののkeyを返す.
+        :param image_path: 画像のパス.
+        :param bounds: 相対座標の(min_x, min_y, max_x, max_y).
+        :return: (種類, id)のリスト.
+        """
+        image_id = self._image_id_of(image_path, create=False)
+        min_x, min_y, max_x, max_y = bounds
+        rows = self._connection.execute(
+            "SELECT type, object_id FROM objects WHERE image_id = ? "
+            "AND min_x <= ? AND max_x >= ? AND min_y <= ? AND max_y >= ?",
+            (image_id, max_x, min_x, max_y, min_y))
+        return [tuple(row) for row in rows]
+
+    def stats(self) -> dict:
+        images, = self._connection.execute("SELECT COUNT(*) FROM images").fetchone()
+        objects, = self._connection.execute("SELECT COUNT(*) FROM objects").fetchone()
+        return {"images": images,
+                "objects": objects,
+                "pending": len(self._pending),
+                "commits": self.commits,
+                "written": self.written,
+                }
@@ -0,0 +1,96 @@
+from collections import defaultdict
+
+
+class SpatialIndex:
+    """
+    オブジェクトの外接矩形を、相対座標系(0.0〜1.0)の一様グリッドに登録する空間インデックス.
+
+    オブジェクトの作成・修正・削除のたびにupdate/removeで差分だけ更新する.
+    相対座標で保持するので、ウィンドウサイズが変わっても作り直す必要はない.
+    """
+
+    # グリッドの一辺の分割数.
+    CELLS = 128
+
+    def __init__(self, cells: int = CELLS):
+        self.cells = cells
+        self._grid = defaultdict(set)  # key: (cx, cy), value: セルに掛かるオブジェクトのkeyの集合
+        self._bounds = {}  # key: オブジェクトのkey, value: (min_x, min_y, max_x, max_y)
+
+    def __len__(self):
+        return len(self._bounds)
+
+    def __contains__(self, key):
+        return key in self._bounds
+
+    def _cell(self, value: float) -> int:
+        # 画面外の座標は端のセルにまとめる.
+        return min(max(int(value * self.cells), 0), self.cells - 1)
+
+    def _cells_of(self, bounds: tuple):
+        min_x, min_y, max_x, max_y = bounds
+        for cy in range(self._cell(min_y), self._cell(max_y) + 1):
+            for cx in range(self._cell(min_x), self._cell(max_x) + 1):
+                yield cx, cy
+
+    def update(self, key, bounds: tuple) -> None:
+        """
+        オブジェクトを登録する. 既に登録されている場合は外接矩形を更新する.
+        :param key: オブジェクトを識別するkey.
+        :param bounds: 相対座標の外接矩形 (min_x, min_y, max_x, max_y).
+        :return:
+        """
+        old_bounds = self._bounds.get(key)
+        if old_bounds == bounds:
+            return
+        if old_bounds is not None:
+            self.remove(key)
+
+        self._bounds[key] = bounds
+        for cell in self._cells_of(bounds):
+            self._grid[cell].add(key)
+
+    def remove(self, key) -> None:
+        """
+        オブジェクトをインデックスから削除する.
+        :param key: オブジェクトを識別するkey.
+        :return:
+        """
+        bounds = self._bounds.pop(key, None)
+        if bounds is None:
+            return
+        for cell in self._cells_of(bounds):
+            keys = self._grid[cell]
+            keys.discard(key)
+            if not keys:
+                del self._grid[cell]
+
+    def clear(self) -> None:
+        self._grid.clear()
+        self._bounds.clear()
+
+    def query_rect(self, min_x: float, min_y: float, max_x: float, max_y: float) -> set:
+        """
+        外接矩形が指定した領域と重なるオブジェクトのkeyを返す.
+        :return: keyの集合.
+        """
+        candidates = set()
+        for cell in self._cells_of((min_x, min_y, max_x, max_y)):
+            keys = self._grid.get(cell)
+            if keys:
+                candidates.update(keys)
+
+        # セル単位では粗いので外接矩形同士でも絞り込む.
+        result = set()
+        for key in candidates:
+            b = self._bounds[key]
+            if b[0] <= max_x and min_x <= b[2] and b[1] <= max_y and min_y <= b[3]:
+                result.add(key)
+        return result
+
+    def query_point(self, x: float, y: float, margin_x: float = 0.0, margin_y: float = 0.0) -> set:
+        """
+        指定した点(とその周囲のmargin)に外接矩形が掛かるオブジェクトのkeyを返す.
+        :return: keyの集合.
+        """
+        return self.query_rect(x - margin_x, y - margin_y, x + margin_x, y + margin_y)
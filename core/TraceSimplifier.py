@@ -0,0 +1,103 @@
+import numpy as np
+
+
+class TraceSimplifier:
+    """
+    ドラッグでなぞったマウスの軌跡を, 点を受け取るたびに簡略化するクラス.
+
+    最後に確定した頂点(anchor)から最新の点(tip)までの線分に対し, その間に受け取った点が全てtolerance以内にある間は
+    tipを動かすだけにする. 1点でも超えたら直前のtipを頂点として確定し, 新しい点を次のtipにする
+    （Douglas–Peucker法を, 軌跡の先頭から逐次的に行うもの）.
+    さらに, 直前に受け付けた点からtolerance未満しか動いていない点はtipにしない（radial distance）.
+    ただしその点も区間に入れておき, 後でtipを動かす時の距離の確認に使う.
+    確認せずに捨てる点は, 確定した頂点からtolerance未満の点だけなので,
+    受け取った全ての点について, 頂点を結ぶ折れ線との距離はtolerance以下になる.
+
+    区間の点はmax_window個までしか保持せず, 超えたら頂点を確定するので,
+    1点あたりの処理と記憶域は軌跡の長さに依存しない. 座標の単位はtoleranceと同じであればよい.
+    """
+
+    # pushの戻り値.
+    SKIPPED = 0  # 点を頂点にしなかった. 頂点は変わらない.
+    MOVED = 1  # 末尾の頂点(tip)を新しい点で置き換える.
+    APPENDED = 2  # 末尾の頂点を確定し, 新しい点を末尾に追加する.
+
+    # 確定せずに保持する区間の点の最大数.
+    MAX_WINDOW = 256
+
+    def __init__(self, tolerance: float, max_window: int = MAX_WINDOW):
+        """
+        :param tolerance: 簡略化で許容する誤差（頂点を結ぶ折れ線と軌跡の距離）.
+        :param max_window: 確定せずに保持する区間の点の最大数.
+        """
+        self.tolerance = tolerance
+        self.anchor = None  # 最後に確定した頂点の(x, y)
+        self._window = np.empty((max_window, 2), dtype=np.float64)  # anchorより後に受け取った点.
+        self._count = 0
+        self._tip = -1  # _windowの中のtipのindex. tipが無ければ-1.
+
+        # 効果測定用のカウンタ.
+        self.received = 0  # 受け取った点の数
+        self.vertices = 0  # 確定・追加した頂点の数（始点を含む）
+
+    def start(self, x: float, y: float) -> None:
+        """
+        軌跡の始点を設定する. 始点は頂点として確定済みとする.
+        """
+        self.anchor = (x, y)
+        self._count = 0
+        self._tip = -1
+        self.received = 1
+        self.vertices = 1
+
+    def push(self, x: float, y: float) -> int:
+        """
+        軌跡の点を受け取る.
+        :return: SKIPPED, MOVED, APPENDEDのどれか. 呼び出し側は戻り値に従って頂点の配列を更新する.
+        """
+        self.received += 1
+        count = self._count
+        tip = self._tip
+        last = self._window[tip] if tip >= 0 else self.anchor
+        if (x - last[0]) ** 2 + (y - last[1]) ** 2 < self.tolerance ** 2:
+            # tipが無ければanchorの近くの点なので, 確認しなくてよい.
+            if tip >= 0:
+                if count < len(self._window):
+                    self._window[count] = (x, y)
+                    self._count += 1
+                else:
+                    # 区間が一杯なら今のtipを確定する. 区間の残りの点はtipの近くの点なので, 確認しなくてよい.
+                    self.anchor = tuple(self._window[tip].tolist())
+                    self._count = 0
+                    self._tip = -1
+            return self.SKIPPED
+
+        # anchorから最初の点まではtipを作るだけ.
+        if tip < 0:
+            return self._append(x, y)
+
+        # anchorから新しい点までの線分と, 区間の点（今のtipと, tipにしなかった点を含む）との距離(の2乗).
+        ax, ay = self.anchor
+        points = self._window[:count] - (ax, ay)
+        dx, dy = x - ax, y - ay
+        length2 = dx * dx + dy * dy
+        t = np.clip((points[:, 0] * dx + points[:, 1] * dy) / length2, 0.0, 1.0) if length2 > 0 else 0.0
+        distances = (points[:, 0] - t * dx) ** 2 + (points[:, 1] - t * dy) ** 2
+
+        if count < len(self._window) and distances.max() <= self.tolerance ** 2:
+            self._window[count] = (x, y)
+            self._count += 1
+            self._tip = count
+            return self.MOVED
+
+        # 今のtipを頂点として確定し, 新しい点から次の区間を始める.
+        # tipより後の点はtipからtolerance未満なので, 区間から外してよい.
+        self.anchor = tuple(self._window[tip].tolist())
+        return self._append(x, y)
+
+    def _append(self, x: float, y: float) -> int:
+        self._window[0] = (x, y)
+        self._count = 1
+        self._tip = 0
+        self.vertices += 1
+        return self.APPENDED
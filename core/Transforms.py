@@ -0,0 +1,36 @@
+"""
+相対座標（画像に対する0〜1の割合）と絶対座標（キャンバス上のピクセル）を変換する関数.
+サイズはQSizeではなく(width, height)のタプルで受け取る.
+"""
+import numpy as np
+
+
+def to_relative(x: float, y: float, size: tuple) -> tuple:
+    """
+    絶対座標の点を相対座標にする.
+    :param x: 絶対座標のx.
+    :param y: 絶対座標のy.
+    :param size: キャンバスのサイズ(width, height).
+    :return: 相対座標の(x, y).
+    """
+    width, height = size
+    return x / width, y / height
+
+
+def to_absolute_point(x: float, y: float, size: tuple) -> tuple:
+    """
+    相対座標の点を絶対座標にする. 整数への丸めは呼び出し側で行う.
+    :return: 絶対座標の(x, y).
+    """
+    width, height = size
+    return x * width, y * height
+
+
+def to_absolute(points: np.ndarray, size: tuple) -> np.ndarray:
+    """
+    相対座標の(n, 2)配列を絶対座標(整数)に変換する. 小数点以下は切り捨てる.
+    :param points: 相対座標の(n, 2)配列.
+    :param size: キャンバスのサイズ(width, height).
+    :return: int64の(n, 2)配列.
+    """
+    return (points * size).astype(np.int64)
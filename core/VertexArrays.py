@@ -0,0 +1,135 @@
+import numpy as np
+
+from core.Annotation import Annotation
+
+
+class VertexArrays:
+    """
+    全オブジェクトの頂点（相対座標）を1つのNumPy配列にまとめて保持するクラス.
+
+    xy[offsets[i]:offsets[i+1]] がi番目のオブジェクト(keys[i])の頂点となる.
+    矩形は四隅+始点の5点で保持する.
+    オブジェクトの座標が変わった時は「要再構築」とし、次に検索した時にまとめて作り直す.
+    Shapelyはintersectsで範囲選択する時に初めてimportする.
+    """
+
+    # 範囲選択の方法.
+    # vertex    : 頂点が1つでも範囲内にあるオブジェクトを選択する.
+    # intersects: 線分が範囲と交差するオブジェクトを選択する.
+    MODES = ("vertex", "intersects")
+
+    def __init__(self):
+        self.keys = []  # オブジェクトのkeyのリスト
+        self.xy = np.empty((0, 2), dtype=np.float64)  # 全頂点の相対座標
+        self.offsets = np.zeros(1, dtype=np.intp)  # 各オブジェクトの頂点の開始位置（末尾に総頂点数）
+        self.object_index = np.empty(0, dtype=np.intp)  # 頂点ごとのオブジェクト番号
+
+        self._versions = {}  # key: オブジェクトのkey, value: 登録時のversion
+        self._geometries = None  # intersects用のLineStringの配列
+        self._dirty = False
+
+    def update(self, _obj: Annotation) -> None:
+        """
+        オブジェクトの追加・座標の変更を記録する. 色だけが変わった場合は何もしない.
+        :param _obj: Annotationクラスの変数.
+        :return:
+        """
+        if self._versions.get(_obj.key) != _obj.version:
+            self._versions[_obj.key] = _obj.version
+            self._dirty = True
+
+    def remove(self, key) -> None:
+        if self._versions.pop(key, None) is not None:
+            self._dirty = True
+
+    def clear(self) -> None:
+        self._versions.clear()
+        self._dirty = True
+
+    @staticmethod
+    def _vertices(_obj: Annotation) -> np.ndarray:
+        points = _obj.points
+        if _obj.object_type == "Rectangle" and len(points) == 2:
+            (x1, y1), (x2, y2) = points.tolist()
+            points = np.array([(x1, y1), (x2, y1), (x2, y2), (x1, y2), (x1, y1)], dtype=np.float64)
+        if len(points) == 1:
+            # LineStringは2点以上必要なので同じ点を重ねる.
+            points = np.repeat(points, 2, axis=0)
+        return points
+
+    def rebuild(self, objects) -> None:
+        """
+        配列を作り直す.
+        :param objects: 登録されている全Annotation（DrawingObject）のiterable.
+        :return:
+        """
+        keys = []
+        chunks = []
+        for _obj in objects:
+            if _obj.coordinate_count == 0:
+                continue
+            keys.append(_obj.key)
+            chunks.append(self._vertices(_obj))
+
+        lengths = np.fromiter((len(c) for c in chunks), dtype=np.intp, count=len(chunks))
+        self.keys = keys
+        self.xy = np.concatenate(chunks) if chunks else np.empty((0, 2), dtype=np.float64)
+        self.offsets = np.zeros(len(chunks) + 1, dtype=np.intp)
+        np.cumsum(lengths, out=self.offsets[1:])
+        self.object_index = np.repeat(np.arange(len(chunks), dtype=np.intp), lengths)
+        self._geometries = None
+        self._dirty = False
+
+    def ensure(self, objects) -> None:
+        """
+        再構築が必要な場合だけ配列を作り直す.
+        """
+        if self._dirty:
+            self.rebuild(objects)
+
+    def geometries(self) -> np.ndarray:
+        """
+        オブジェクトごとのLineStringの配列（相対座標）. 1回の呼び出しでまとめて作成する.
+        """
+        import shapely
+
+        if self._geometries is None:
+            self._geometries = shapely.linestrings(self.xy, indices=self.object_index)
+        return self._geometries
+
+    def select_in_rect(self, rect: tuple, window_size: tuple, mode: str = "vertex") -> list:
+        """
+        範囲選択した矩形に含まれるオブジェクトのkeyを返す.
+        :param rect: 範囲選択した矩形 (x1, y1, x2, y2). 絶対座標系, 境界を含む.
+        :param window_size: (width, height).
+        :param mode: MODESのどれか.
+        :return: オブジェクトのkeyのリスト.
+        """
+        if not self.keys:
+            return []
+
+        width, height = window_size
+        min_x, max_x = sorted((rect[0], rect[2]))
+        min_y, max_y = sorted((rect[1], rect[3]))
+
+        if mode == "vertex":
+            # 頂点を絶対座標(整数)に変換し、まとめて矩形と比較する.
+            abs_xy = np.floor(self.xy * (width, height))
+            inside = ((abs_xy[:, 0] >= min_x) & (abs_xy[:, 0] <= max_x) &
+                      (abs_xy[:, 1] >= min_y) & (abs_xy[:, 1] <= max_y))
+
+            # オブジェクトごとに範囲内の頂点数を数える.
+            counts = np.add.reduceat(inside.astype(np.intp), self.offsets[:-1])
+            selected = np.flatnonzero(counts)
+
+        elif mode == "intersects":
+            import shapely
+
+            # 絶対座標のピクセルmax_x, max_yも範囲に含める.
+            box = shapely.box(min_x / width, min_y / height, (max_x + 1) / width, (max_y + 1) / height)
+            selected = np.flatnonzero(shapely.intersects(self.geometries(), box))
+
+        else:
+            raise ValueError(f"Invalid selection mode. Allowed modes are: {self.MODES}")
+
+        return [self.keys[i] for i in selected]
@@ -0,0 +1,162 @@
+import numpy as np
+
+from core.Annotation import Annotation
+from core.HitTest import rectangle_corners
+
+
+class VertexIndex:
+    """
+    全オブジェクトの頂点（相対座標）を、相対座標系(0.0〜1.0)の一様グリッドに登録する空間インデックス.
+    頂点へのスナップと, 修正する頂点の検索に使う.
+
+    SpatialIndexが外接矩形をセルに登録するのに対し, こちらは頂点ごとにセルに振り分けるので,
+    長いポリラインでも検索する点の周囲の頂点だけを調べる.
+    オブジェクトの作成・修正・削除のたびにupdate/removeで差分だけ登録し直す.
+    座標が変わったオブジェクトは次に検索した時に登録し直すので, 連続した変更ではまとめて1回になる.
+    矩形は四隅（HitTest.rectangle_corners の順）を頂点とする.
+    """
+
+    # グリッドの一辺の分割数.
+    CELLS = 128
+
+    def __init__(self, cells: int = CELLS):
+        self.cells = cells
+        self._grid = {}  # key: セルの番号(cy * cells + cx), value: {オブジェクトのkey: セル内の頂点のindexの配列}
+        self._vertices = {}  # key: オブジェクトのkey, value: 登録した頂点の(n, 2)配列
+        self._cells_of = {}  # key: オブジェクトのkey, value: 頂点が登録されているセルの番号の配列
+        self._versions = {}  # key: オブジェクトのkey, value: 登録時（登録待ちを含む）のversion
+        self._pending = {}  # key: オブジェクトのkey, value: 登録し直すAnnotation
+
+    def __len__(self):
+        return len(self._versions)
+
+    def __contains__(self, key):
+        return key in self._versions
+
+    @staticmethod
+    def _vertex_array(_obj: Annotation) -> np.ndarray:
+        if _obj.object_type == "Rectangle":
+            return rectangle_corners(_obj.relative_bounds())
+        # 修正時に元の配列が書き換えられるのでコピーして保持する.
+        return np.array(_obj.points, dtype=np.float64)
+
+    def _cell(self, value: float) -> int:
+        # 画面外の座標は端のセルにまとめる.
+        return min(max(int(value * self.cells), 0), self.cells - 1)
+
+    def update(self, _obj: Annotation) -> None:
+        """
+        オブジェクトの追加・座標の変更を記録する. 色だけが変わった場合は何もしない.
+        :param _obj: Annotationクラスの変数.
+        :return:
+        """
+        if self._versions.get(_obj.key) != _obj.version:
+            self._versions[_obj.key] = _obj.version
+            self._pending[_obj.key] = _obj
+
+    def remove(self, key) -> None:
+        """
+        オブジェクトの頂点をインデックスから削除する.
+        :param key: オブジェクトを識別するkey.
+        :return:
+        """
+        self._versions.pop(key, None)
+        self._pending.pop(key, None)
+        self._unregister(key)
+
+    def clear(self) -> None:
+        self._grid.clear()
+        self._vertices.clear()
+        self._cells_of.clear()
+        self._versions.clear()
+        self._pending.clear()
+
+    def _unregister(self, key) -> None:
+        cells = self._cells_of.pop(key, None)
+        if cells is None:
+            return
+        del self._vertices[key]
+        for cell in cells.tolist():
+            members = self._grid[cell]
+            del members[key]
+            if not members:
+                del self._grid[cell]
+
+    def _register(self, _obj: Annotation) -> None:
+        key = _obj.key
+        self._unregister(key)
+        if _obj.coordinate_count == 0:
+            return
+        vertices = self._vertex_array(_obj)
+        cx = np.clip((vertices[:, 0] * self.cells).astype(np.intp), 0, self.cells - 1)
+        cy = np.clip((vertices[:, 1] * self.cells).astype(np.intp), 0, self.cells - 1)
+        cell = cy * self.cells + cx
+
+        # 頂点をセルごとにまとめる. 連続する頂点は同じセルに入ることが多い.
+        order = np.argsort(cell, kind="stable")
+        cells, starts = np.unique(cell[order], return_index=True)
+        for c, indices in zip(cells.tolist(), np.split(order, starts[1:])):
+            self._grid.setdefault(c, {})[key] = indices
+        self._vertices[key] = vertices
+        self._cells_of[key] = cells
+
+    def _flush(self, key=None, exclude=None) -> None:
+        """
+        登録待ちのオブジェクトを登録する. keyを指定した場合はそのオブジェクトだけ,
+        excludeを指定した場合はそのオブジェクト（修正中で毎回変わるものなど）を除いて登録する.
+        """
+        if key is not None:
+            _obj = self._pending.pop(key, None)
+            if _obj is not None:
+                self._register(_obj)
+            return
+        for k in [k for k in self._pending if k != exclude]:
+            self._register(self._pending.pop(k))
+
+    def nearest(self, x: float, y: float, size: tuple, radius: float, key=None, exclude=None):
+        """
+        点(x, y)から半径radiusピクセル以内で最も近い頂点を探す. 距離はキャンバス上のピクセルで測る.
+        :param x: 相対座標のx.
+        :param y: 相対座標のy.
+        :param size: キャンバスのサイズ(width, height).
+        :param radius: 探す範囲の半径（ピクセル）.
+        :param key: 指定した場合は, このオブジェクトの頂点だけから探す.
+        :param exclude: 指定した場合は, このオブジェクトの頂点を除いて探す.
+        :return: (オブジェクトのkey, 頂点のindex, 頂点の相対座標の(2,)配列). 範囲内に頂点が無ければNone.
+        """
+        self._flush(key, exclude)
+        width, height = size
+        rx, ry = radius / width, radius / height
+
+        keys, chunks = [], []
+        for cy in range(self._cell(y - ry), self._cell(y + ry) + 1):
+            row = cy * self.cells
+            for cx in range(self._cell(x - rx), self._cell(x + rx) + 1):
+                members = self._grid.get(row + cx)
+                if not members:
+                    continue
+                if key is not None:
+                    indices = members.get(key)
+                    if indices is not None:
+                        keys.append(key)
+                        chunks.append(indices)
+                    continue
+                for k, indices in members.items():
+                    if k != exclude:
+                        keys.append(k)
+                        chunks.append(indices)
+        if not chunks:
+            return None
+
+        # 候補の頂点との距離(の2乗)をまとめて計算する.
+        points = np.concatenate([self._vertices[k][indices] for k, indices in zip(keys, chunks)])
+        distances = ((points[:, 0] - x) * width) ** 2 + ((points[:, 1] - y) * height) ** 2
+        best = int(np.argmin(distances))
+        if distances[best] > radius ** 2:
+            return None
+
+        # 何番目の候補の頂点か.
+        lengths = np.fromiter((len(indices) for indices in chunks), dtype=np.intp, count=len(chunks))
+        chunk = int(np.searchsorted(np.cumsum(lengths), best, side="right"))
+        index = int(chunks[chunk][best - int(lengths[:chunk].sum())])
+        return keys[chunk], index, points[best]
@@ -0,0 +1,21 @@
+"""
+Qtに依存しない注釈データの処理をまとめたパッケージ.
+スクリプトやワーカープロセスから, QApplicationを作らずに注釈の読み書き・座標変換・当たり判定を行える.
+
+- Annotation    : オブジェクト1つ分のデータ（相対座標のNumPy配列, 色はRGBAのタプル）.
+- Transforms    : 相対座標と絶対座標の変換.
+- HitTest       : 最も近い頂点の検索, 当たり判定に使う外形の作成.
+- GeometryCache : 当たり判定用のShapelyのジオメトリのキャッシュ.
+- SpatialIndex  : 外接矩形のグリッドによる空間インデックス.
+- VertexArrays  : 全オブジェクトの頂点をまとめた配列による範囲選択.
+- VertexIndex   : 全オブジェクトの頂点のグリッドによる, 半径内で最も近い頂点の検索（頂点スナップ）.
+- TraceSimplifier: なぞり描きの軌跡を, 点を受け取るたびに簡略化する.
+- AnnotationFile: JSON・バイナリ・旧形式のファイルの読み書き.
+- ProjectStore  : 多数の画像の注釈をまとめたSQLiteのプロジェクト（sqlite3はプロジェクトを開く時にimportする）.
+- MaskExport    : 画像の元の解像度のラベルマップとCOCO形式のRLEの書き出し（データセットはプロセスプールで並列に処理する）.
+
+このパッケージのモジュールはPySide6をimportしない.
+Shapelyなど重いモジュールは使う時に初めてimportするので, 必要なモジュールだけを個別にimportすること.
+    from core.Annotation import Annotation
+    from core import AnnotationFile
+"""
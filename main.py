@@ -1,21 +1,86 @@
+import os
 import sys
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
 from PySide6.QtWidgets import QApplication, QMainWindow, QPushButton, QComboBox, QFileDialog, QMessageBox, \
-    QCheckBox, QHBoxLayout, QVBoxLayout  # , QListWidget
-from PySide6.QtGui import QPainter, QMouseEvent, QImage, QPen, QColor
-from PySide6.QtCore import Qt, QRect, QSize, QPointF, QPoint
-from shapely import LineString
-from shapely.geometry import Point
+    QCheckBox, QHBoxLayout, QVBoxLayout, QProgressBar  # , QListWidget
+from PySide6.QtGui import QPainter, QMouseEvent, QImage, QPen, QColor, QKeySequence, QImageReader
+from PySide6.QtCore import Qt, QRect, QRectF, QSize, QPointF, QPoint, QTimer, Signal
 
 from DrawingObject import DrawingObject
+from core import AnnotationFile, HitTest
+from core.Transforms import to_relative, to_absolute_point
+from core.SpatialIndex import SpatialIndex
+from core.GeometryCache import GeometryCache
+from core.VertexArrays import VertexArrays
+from core.VertexIndex import VertexIndex
+from core.TraceSimplifier import TraceSimplifier
+from core.ProjectStore import ProjectStore
+from OverlayCompositor import OverlayCompositor
+from MouseMoveCoalescer import MouseMoveCoalescer
+from Profiler import profiler
+from ProfilerHud import ProfilerHud
+from EditJournal import EditJournal
+from EditHistory import EditHistory, ObjectData
+from ImagePyramid import ImagePyramid
+from DatasetNavigator import DatasetNavigator
 
 
 # CONSTANT VALUE
 MARGIN = 5
+PREVIEW_MARGIN = 4  # プレビュー（点線）の再描画領域に加える余白. 線の太さ+アンチエイリアス分.
+PYRAMID_MIN_PIXELS = 8192 * 8192  # この画素数以上の画像は全体をデコードせず, ImagePyramidで表示する.
+MIN_ZOOM = 1.0  # 表示倍率の範囲. 1.0でウィンドウ全体に画像全体を表示する.
+MAX_ZOOM = 32.0
+ZOOM_STEP = 1.25  # マウスホイール1段あたりの拡大率.
+PROJECT_IDLE_COMMIT_MS = 1000  # 編集が止まってからプロジェクトに書き込むまでの時間(ミリ秒).
+RESIZE_SETTLE_MS = 150  # リサイズが止まってからオーバーレイを新しいサイズで作り直すまでの時間(ミリ秒).
+SELECTION_RGBA = (0, 255, 0, 127)  # 選択中のオブジェクトを強調表示する色.
+SNAP_RADIUS = 10  # 頂点スナップで, この距離(ピクセル)以内にある頂点にスナップする.
+SNAP_MARKER_RADIUS = 3  # スナップ先の頂点に描画する印の半径. PREVIEW_MARGIN以内に収める.
+VERTEX_SEARCH_RADIUS = 64  # 修正する頂点をVertexIndexで探す範囲(ピクセル). 見つからなければ全頂点から探す.
+TRACE_TOLERANCE = 1.5  # なぞり描きの軌跡を簡略化する時に許容する誤差(キャンバス上のピクセル).
+
+
+def isPyramidImage(fileName: str) -> bool:
+    """
+    画像をImagePyramidで表示するかどうか. ヘッダーから大きさを読むだけでデコードはしない.
+    :param fileName: 画像ファイルのパス.
+    :return:
+    """
+    size = QImageReader(fileName).size()
+    return size.isValid() and size.width() * size.height() >= PYRAMID_MIN_PIXELS
+
+
+def decodeImage(fileName: str, progress=None):
+    """
+    画像を表示できる形に読み込む. DatasetNavigatorの先読みではワーカースレッドで呼ばれる.
+    PYRAMID_MIN_PIXELS以上の画像は全体をデコードせず, ImagePyramidを作成（キャッシュ）して返す.
+    :param fileName: 画像ファイルのパス.
+    :param progress: ImagePyramidを作成する場合に, 進み具合(0〜1)を受け取る関数.
+    :return: QImageかImagePyramid.
+    """
+    if isPyramidImage(fileName):
+        return ImagePyramid.open(fileName, progress=progress)
+    image = QImage(fileName)
+    if image.isNull():
+        raise ValueError(f"Cannot load image: {fileName}")
+    return image
 
 
 class DrawingApp(QMainWindow):
+    # ワーカースレッドでImagePyramidを作成した結果をGUIスレッドに渡すためのシグナル.
+    # (パス, ImagePyramid. 作成できなかった場合は原因のメッセージ)
+    _imageDecoded = Signal(str, object)
+
+    # ImagePyramidの作成の進み具合. (パス, 0〜1)
+    _imageProgress = Signal(str, float)
+
+    # 編集ジャーナルがファイルに書けなくなった原因. 書き込みスレッドからGUIスレッドに渡す.
+    _journalFailed = Signal(str)
+
     def __init__(self):
         super().__init__()
 
@@ -36,15 +101,27 @@ class DrawingApp(QMainWindow):
         # Drawing settings
         self.image = QImage(self.size(), QImage.Format_RGB32)
         self.image.fill(Qt.white)
+        self.pyramid = None  # 巨大な画像を読み込んだ場合のImagePyramid. この場合self.imageは使わない.
         self.shape = 'Line'  # default shape
 
         # 現在編集中であるオブジェクトを格納する中間変数
         self.editingDrawingObject = None
         self.modifyingDrawingObject = None  # 修正対象のオブジェクトを一時的に格納する変数.
         self.currentMousePosition = None  # 現在のマウスの位置を格納する変数.
+        self.previewRect = QRect()  # 直前にプレビュー（点線）を描画した領域. 絶対座標系.
 
-        # 複数選択した際、選択されたオブジェクトを一時的に格納する配列
-        self.selected_object = []
+        # 表示倍率と表示位置. オブジェクトはウィンドウサイズ x 表示倍率のキャンバスに描画し,
+        # キャンバスのうちviewOffsetを左上とするウィンドウサイズの範囲を表示する.
+        # 以降, 「絶対座標」はキャンバス上の座標を指す. マウスの位置はtoCanvasで変換してから使う.
+        self.viewZoom = 1.0
+        self.viewOffset = QPoint(0, 0)
+        self.panAnchor = None  # 中ボタンでドラッグ中の場合, (ドラッグ開始時のマウスの位置, viewOffset).
+
+        # マウス移動イベントを画面の更新間隔ごとにまとめて処理させる.
+        self.mouseMoveCoalescer = MouseMoveCoalescer(self.processMouseMove, self.getDisplayFrameRate(), self)
+
+        # 選択中のオブジェクトのkey((object_type, id))の集合. 同じオブジェクトを重ねて選択しても1つになる.
+        self.selection = set()
         self.range_coordinates = []  # 範囲選択の座標を格納する配列.
 
         # 直線を引くために必要な初期化処理
@@ -70,6 +147,78 @@ class DrawingApp(QMainWindow):
                            "PolyLine": self.polyLinesDict,
                            }
 
+        # クリックした位置の近くにあるオブジェクトだけを探す為の空間インデックス（相対座標系）.
+        self.spatialIndex = SpatialIndex()
+
+        # 確定済みのオブジェクトをまとめて描画するオーバーレイ. 表示する範囲のタイルだけを空間インデックスから作成する.
+        # リサイズ中は変更前のタイルを拡大・縮小して表示し, リサイズが止まったらresizeSettleTimerで
+        # 新しいサイズのタイルをワーカースレッドで作成する. ファイルの読み込みなど多数のオブジェクトを
+        # まとめて変更した場合も同様にワーカースレッドで作成する. できたタイルから再描画し, 進み具合を下端に表示する.
+        self.compositor = OverlayCompositor(self.canvasSize(), self.fontMetrics(), self.spatialIndex, parent=self)
+        self.compositor.tilesReady.connect(self.updateCanvas)
+        self.compositor.progress.connect(self.onRenderProgress)
+
+        # 選択中のオブジェクトだけを登録し, オーバーレイの上に強調表示の色で重ねるオーバーレイ.
+        # 選択・解除ではオブジェクトの色を変えないので, 通常のオーバーレイのタイルは作り直さない.
+        self.highlight = OverlayCompositor(self.canvasSize(), self.fontMetrics(), self.spatialIndex,
+                                           color=QColor(*SELECTION_RGBA), parent=self)
+        self.highlight.tilesReady.connect(self.updateCanvas)
+        self.renderProgressBar = QProgressBar(self)
+        self.renderProgressBar.setTextVisible(False)
+        self.renderProgressBar.hide()
+        self.resizeSettleTimer = QTimer(self)
+        self.resizeSettleTimer.setSingleShot(True)
+        self.resizeSettleTimer.setInterval(RESIZE_SETTLE_MS)
+        self.resizeSettleTimer.timeout.connect(self.onResizeSettled)
+
+        # 当たり判定用のShapelyのジオメトリのキャッシュ. 座標かウィンドウサイズが変わった時だけ作り直す.
+        self.geometryCache = GeometryCache(MARGIN)
+
+        # 範囲選択用に全オブジェクトの頂点をまとめたNumPy配列.
+        self.vertexArrays = VertexArrays()
+
+        # 頂点スナップと修正する頂点の検索用に, 全オブジェクトの頂点をグリッドに振り分けた空間インデックス.
+        self.vertexIndex = VertexIndex()
+        self.snapTarget = None  # スナップしている場合, スナップ先の頂点の位置（絶対座標）.
+
+        # 処理時間の計測結果を表示するHUD. hキーで表示/非表示（計測の有効/無効）を切り替える.
+        self.profilerHud = ProfilerHud(profiler, self.getHudExtraLines, self)
+
+        # 追加・修正・削除を画像の隣のファイルに追記する編集ジャーナル. 画像を読み込むと記録を開始する.
+        # 書けなくなったら記録を止め, 自動保存が止まったことを知らせる.
+        self.journal = EditJournal(factory=DrawingObject, on_error=lambda error: self._journalFailed.emit(str(error)))
+        self._journalFailed.connect(self.onJournalFailed)
+
+        # 元に戻す(Ctrl+Z)・やり直す(Ctrl+Shift+Z)ための編集履歴.
+        self.history = EditHistory(self.restoreDrawingObject,
+                                   lambda key: self.deleteDrawingObject(self.getDrawingObject(key)),
+                                   self.setDrawingObjectPoints,
+                                   )
+
+        # フォルダ内の画像を前後に移動するモード. 前後の画像はワーカースレッドで先読みする.
+        self.dataset = DatasetNavigator(decodeImage, parent=self)
+        self.dataset.imageLoaded.connect(self.onDatasetImageLoaded)
+        self.pendingDatasetPath = None  # デコードが終わったら表示する画像のパス.
+
+        # 読み込んだ巨大な画像のImagePyramidを作成するワーカースレッド. 作成中も前の画像を表示・編集できる.
+        # 進み具合はウィンドウの下端に表示し, 作成が終わったら(onImageDecoded)表示を切り替える.
+        self.imageLoader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ImageLoad")
+        self.pendingImagePath = None  # ImagePyramidの作成が終わったら表示する画像のパス.
+        self._imageDecoded.connect(self.onImageDecoded)
+        self._imageProgress.connect(self.onImageProgress)
+        self.imageProgressBar = QProgressBar(self)
+        self.imageProgressBar.setTextVisible(False)
+        self.imageProgressBar.setRange(0, 1000)
+        self.imageProgressBar.hide()
+
+        # 多数の画像のオブジェクトをまとめて保存するプロジェクト(SQLite). 開いている間はジャーナルの代わりに使う.
+        # 変更はまとめて書き込み, 編集が止まったらprojectCommitTimerで残りを書き込む.
+        self.project = ProjectStore(factory=DrawingObject)
+        self.projectCommitTimer = QTimer(self)
+        self.projectCommitTimer.setSingleShot(True)
+        self.projectCommitTimer.setInterval(PROJECT_IDLE_COMMIT_MS)
+        self.projectCommitTimer.timeout.connect(self.project.commit)
+
         # 描画用のプルダウンに関する設定
         self.shapeComboBox = QComboBox(self)
         self.shapeComboBox.addItem("Line")
@@ -83,6 +232,19 @@ class DrawingApp(QMainWindow):
         self.checkbox.move(150, 10)
         self.checkbox.stateChanged.connect(self.switchRangeSelectionState)
         self.allow_range_selection = False  # 範囲選択ができる状態かどうかを保存する変数.
+        self.rangeSelectionMode = "vertex"  # 範囲選択の方法. VertexArrays.MODESのどれか.
+
+        # PolyLineをShiftを押しながらドラッグした場合は, 軌跡をなぞって頂点を追加する（なぞり描き）.
+        # 軌跡は点を受け取るたびにTraceSimplifierで簡略化し, 頂点の数を抑える.
+        self.traceTolerance = TRACE_TOLERANCE  # 簡略化で許容する誤差(キャンバス上のピクセル).
+        self.tracer = None  # なぞり描き中のTraceSimplifier.
+        self.tracedVersion = None  # なぞり描き中に, 最後にレイヤーを描画した時の編集中のオブジェクトのversion.
+
+        # 描画・修正中に, 新しい頂点を近くにある他のオブジェクトの頂点に合わせる（スナップする）チェックボックス.
+        self.snapCheckbox = QCheckBox("頂点スナップ", self)
+        self.snapCheckbox.move(150, 35)
+        self.snapCheckbox.stateChanged.connect(self.switchSnappingState)
+        self.snapping = False  # 頂点スナップが有効かどうか.
 
         # Button to import image
         self.importButton = QPushButton("Import Image", self)
@@ -108,6 +270,30 @@ class DrawingApp(QMainWindow):
         self.exportButton.move(410, 10)
         self.exportButton.clicked.connect(self.exportDrawing)
 
+        # Button to load drawing
+        self.loadButton = QPushButton("Load Drawing", self)
+        self.loadButton.setStyleSheet(
+            "QPushButton {"
+            "border: 2px solid black;"
+            "background-color: gray;"
+            "color: white;"
+            "}"
+        )
+        self.loadButton.move(540, 10)
+        self.loadButton.clicked.connect(self.importDrawing)
+
+        # Button to open image folder
+        self.folderButton = QPushButton("Open Folder", self)
+        self.folderButton.setStyleSheet(
+            "QPushButton {"
+            "border: 2px solid black;"
+            "background-color: gray;"
+            "color: white;"
+            "}"
+        )
+        self.folderButton.move(670, 10)
+        self.folderButton.clicked.connect(self.openFolder)
+
         # # レイアウト
         # self.main_layout = QHBoxLayout()
         #
@@ -135,51 +321,116 @@ class DrawingApp(QMainWindow):
         self.shape = self.shapeComboBox.itemText(index)
         # todo: self.editingDrawingObject or self.modifyingDrawingObject がNoneでなければリセットする処理を入れたい.
 
+    @profiler.measure("setDrawLayer")
     def setDrawLayer(self, _obj: DrawingObject) -> DrawingObject:
         """
-        格納された座標情報をもとに、新たなレイヤーを作成し描画し、
-        レイヤー情報を格納したDrawingObjectクラスの変数を返す関数.
+        格納された座標情報をもとに、オブジェクトの描画内容を更新し、
+        DrawingObjectクラスの変数を返す関数.
+        確定済みのオブジェクトはオーバーレイ(self.compositor)に反映し、
+        描画中のオブジェクトだけは個別のレイヤーを作成して描画する.
 
         :param _obj: DrawingObjectクラスの変数.
         :return:
         """
 
-        window_size = self.size()
+        # 確定済みのオブジェクトの場合, オーバーレイ側で影響のあるタイルだけを再描画させる.
+        if not _obj.is_currently_drawing:
+            self.updateCanvas(self.compositor.updateObject(_obj))
+            if _obj.key in self.selection:
+                self.updateCanvas(self.highlight.updateObject(_obj))
+            self.spatialIndex.update(_obj.key, _obj.relative_bounds())
+            self.vertexArrays.update(_obj)
+            self.vertexIndex.update(_obj)
+            self.journal.record(_obj)  # 座標が変わった時だけ記録される.
+            self.journal.maybe_compact(self.iterDrawingObjects)
+            self.project.record(_obj)
+            self.scheduleProjectCommit()
+            return _obj
+
+        # 描画中のPolyLineは, 既存のレイヤーに追加された線分だけを描き足す. 最後の線分はpaintEventで描く.
+        if _obj.object_type == "PolyLine":
+            self.updateCanvas(_obj.update_layer(self.canvasSize(), self.fontMetrics(), self.visibleCanvasRect()))
+            return _obj
+
+        # 変更前のレイヤーの領域.
+        old_rect = QRect() if _obj.layerImage is None else QRect(_obj.layerOffset, _obj.layerImage.size())
+
+        # オブジェクトの描画領域のうち表示されている範囲だけの背景透明なレイヤーに描画する.
+        layer, offset = _obj.render_layer(self.canvasSize(), self.fontMetrics(), self.visibleCanvasRect())
+        self.updateCanvas(old_rect.united(QRect() if layer is None else QRect(offset, layer.size())))
 
-        # 背景透明のレイヤーを用意する.
-        layer = QImage(window_size, QImage.Format.Format_ARGB32)
-        layer.fill(Qt.transparent)
+        # レイヤーをセット
+        _obj.set_layer(layer, offset)
+        return _obj
+
+    def commitDrawingObject(self, _obj: DrawingObject) -> DrawingObject:
+        """
+        描画中のオブジェクトを確定し、種類ごとの辞書型変数とオーバーレイに登録する関数.
+
+        :param _obj: DrawingObjectクラスの変数.
+        :return:
+        """
+        _obj.stop_drawing()
+        _obj.compact()  # 座標追加用に確保していた余分な配列を解放する.
+        _obj.set_layer(None)  # 確定後はオーバーレイに描画されるので個別のレイヤーは不要.
+        self.objectDict[_obj.object_type][_obj.id] = _obj
+        self.history.created(_obj)
+        return self.setDrawLayer(_obj)
+
+    def deleteDrawingObject(self, _obj: DrawingObject) -> None:
+        """
+        オブジェクトを辞書型変数とオーバーレイから削除する関数.
 
-        # レイヤーに描画する.
-        pen = QPen(_obj.color, _obj.line_thickness)
-        painter = QPainter(layer)
-        painter.setPen(pen)
-        if _obj.object_type == "Line":
-            painter.drawLine(self.get_actual_coordinate(_obj.coordinates[0], window_size),
-                             self.get_actual_coordinate(_obj.coordinates[1], window_size),
+        :param _obj: DrawingObjectクラスの変数.
+        :return:
+        """
+        del self.objectDict[_obj.object_type][_obj.id]
+        self.updateCanvas(self.compositor.removeObject(_obj))
+        if _obj.key in self.selection:
+            self.selection.discard(_obj.key)
+            self.updateCanvas(self.highlight.removeObject(_obj))
+        self.spatialIndex.remove(_obj.key)
+        self.geometryCache.discard(_obj)
+        self.vertexArrays.remove(_obj.key)
+        self.vertexIndex.remove(_obj.key)
+        self.journal.remove(_obj.key)
+        self.project.remove(_obj.key)
+        self.scheduleProjectCommit()
+        self.history.deleted(_obj)
+
+    def getDrawingObject(self, key: tuple) -> DrawingObject:
+        """
+        keyからオブジェクトを取得する.
+        :param key: (object_type, id).
+        :return:
+        """
+        object_type, object_id = key
+        return self.objectDict[object_type][object_id]
+
+    def restoreDrawingObject(self, data: ObjectData) -> DrawingObject:
+        """
+        編集履歴に記録した情報からオブジェクトを作り直して登録する. undo/redoで使う.
+        :param data: EditHistory.ObjectData.
+        :return:
+        """
+        _obj = DrawingObject(id=data.id,
+                             object_type=data.object_type,
+                             coordinates=data.points,
+                             color=data.custom_rgba,
+                             line_thickness=data.line_thickness,
                              )
-        elif _obj.object_type == "Rectangle":
-            rect = QRect(self.get_actual_coordinate(_obj.coordinates[0], window_size),
-                         self.get_actual_coordinate(_obj.coordinates[1], window_size),
-                         )
-            painter.drawRect(rect)
-        elif _obj.object_type == "PolyLine":
-            for i in range(1, len(_obj.coordinates)):
-                painter.drawLine(self.get_actual_coordinate(_obj.coordinates[i-1], window_size),
-                                 self.get_actual_coordinate(_obj.coordinates[i], window_size),
-                                 )
-
-        # 各オブジェクトの名前を表示.
-        painter.drawText(self.get_actual_coordinate(_obj.coordinates[0], window_size),
-                         _obj.object_name,
-                         )
-        # 後処理
-        painter.end()
-        self.update()
+        return self.commitDrawingObject(_obj)
 
-        # レイヤーをセット
-        _obj.set_layer(layer)
-        return _obj
+    def setDrawingObjectPoints(self, key: tuple, points: np.ndarray) -> None:
+        """
+        オブジェクトの座標を置き換えて再描画する. undo/redoで使う.
+        :param key: (object_type, id).
+        :param points: 相対座標の(n, 2)配列.
+        :return:
+        """
+        _obj = self.getDrawingObject(key)
+        _obj.coordinates = points
+        self.setDrawLayer(_obj)
 
     def importImage(self):
         """
@@ -188,25 +439,508 @@ class DrawingApp(QMainWindow):
         """
         fileName, _ = QFileDialog.getOpenFileName(self, "Open File", "", "Images (*.png *.xpm *.jpg)")
         if fileName:
-            self.image = QImage(fileName)
-            if self.image.isNull():
+            if not self.loadImage(fileName):
                 QMessageBox.information(self, "Image Viewer", "Cannot load %s." % fileName)
-                return
+
+    @profiler.measure("importImage")
+    def loadImage(self, fileName: str) -> bool:
+        """
+        画像を読み込み、キャンバスとウィンドウのサイズを画像に合わせる処理.
+        PYRAMID_MIN_PIXELS以上の画像は全体をデコードせず, タイル化したピラミッドを作成（キャッシュ）して表示する.
+        ピラミッドを作成する必要がある場合はワーカースレッドで作成し, 表示は作成が終わった時(onImageDecoded)に切り替える.
+        :param fileName: 画像ファイルのパス.
+        :return: 読み込めたかどうか. ピラミッドを作成する場合は作成を始めたかどうか.
+        """
+        self.pendingImagePath = None
+        if isPyramidImage(fileName) and not ImagePyramid.is_cached(fileName):
+            self.pendingImagePath = fileName
+            self.imageLoader.submit(self._decodeTask, fileName)
+            self.onImageProgress(fileName, 0.0)
+            return True
+
+        QApplication.setOverrideCursor(Qt.WaitCursor)
+        try:
+            image = decodeImage(fileName)
+        except (OSError, ValueError):
+            return False
+        finally:
+            QApplication.restoreOverrideCursor()
+        self.showImage(fileName, image)
+        return True
+
+    def _decodeTask(self, fileName: str) -> None:
+        """
+        ワーカースレッドでImagePyramidを作成し, 結果をGUIスレッドに渡す.
+        """
+        try:
+            image = decodeImage(fileName, lambda value: self._imageProgress.emit(fileName, value))
+        except (OSError, ValueError) as error:
+            image = str(error)
+        self._imageDecoded.emit(fileName, image)
+
+    def onImageProgress(self, fileName: str, value: float) -> None:
+        """
+        ImagePyramidを作成している間, 進み具合をウィンドウの下端に表示する.
+        :param fileName: 作成している画像のパス.
+        :param value: 進み具合(0〜1).
+        """
+        if fileName != self.pendingImagePath:
+            return
+        self.imageProgressBar.setValue(int(value * self.imageProgressBar.maximum()))
+        self.imageProgressBar.show()
+
+    def onImageDecoded(self, fileName: str, image) -> None:
+        """
+        ワーカースレッドでのImagePyramidの作成が終わった時の処理. 表示待ちの画像であれば切り替える.
+        :param fileName: 画像のパス.
+        :param image: ImagePyramid. 作成できなかった場合は原因のメッセージ（大きさの上限を超えた場合など）.
+        """
+        if fileName != self.pendingImagePath:
+            return
+        self.pendingImagePath = None
+        self.imageProgressBar.hide()
+        if isinstance(image, str):
+            QMessageBox.information(self, "Image Viewer", "Cannot load %s.\n%s" % (fileName, image))
+            return
+        self.showImage(fileName, image)
+
+    def showImage(self, fileName: str, image) -> None:
+        """
+        デコード済みの画像を表示し, 画像の隣のジャーナルに記録を始める処理.
+        :param fileName: 画像ファイルのパス.
+        :param image: decodeImageの戻り値（QImageかImagePyramid）.
+        :return:
+        """
+        # 前の画像の編集結果はジャーナルに書き出してから消し, 画像ごとに別々に保持する.
+        self.finishEditingForHistory()
+        self.journal.close()
+        self.clearDrawingObjects()
+        self.history.clear()
+
+        if isinstance(image, ImagePyramid):
+            size = image.size
+            self.pyramid = image
+            self.image = QImage()
+
+            # ウィンドウは画面に収まる大きさにし, 縦横比を画像に合わせる.
+            available = self.screen().availableGeometry().size()
+            scale = min(1.0, available.width() / size.width(), available.height() / size.height())
+            self.resize(max(1, int(size.width() * scale)), max(1, int(size.height() * scale)))
+        else:
+            self.pyramid = None
+            self.image = image
 
             # キャンバスとウィンドウのサイズを画像のサイズに合わせる
             self.resize(self.image.size())
-            self.update()
+
+        # 新しい画像は全体を表示する.
+        self.resetViewport()
+
+        # プロジェクトを開いていればプロジェクトから, そうでなければ画像の隣のジャーナルから前回の編集結果を読み込む.
+        if self.project.is_active:
+            self.openProjectImage(fileName)
+        else:
+            self.openJournal(fileName)
+
+    def openFolder(self):
+        """
+        画像のフォルダを開くダイアログを表示する処理.
+        :return:
+        """
+        directory = QFileDialog.getExistingDirectory(self, "Open Folder")
+        if directory:
+            if not self.openDataset(directory):
+                QMessageBox.information(self, "Image Viewer", "No images in %s." % directory)
+
+    def openDataset(self, directory: str) -> bool:
+        """
+        フォルダ内の画像を順番に表示するモードを開始し, 先頭の画像を表示する.
+        n/→キーで次, p/←キーで前の画像に移動する.
+        プロジェクトを開いている場合はフォルダの画像をプロジェクトに登録し, プロジェクトの全画像の間を移動する.
+        :param directory: 画像のあるフォルダ.
+        :return: 画像があったかどうか.
+        """
+        if not self.project.is_active:
+            if self.dataset.open(directory) == 0:
+                return False
+            self.showDatasetImage(0)
+            return True
+
+        paths = DatasetNavigator.image_paths(directory)
+        if not paths:
+            return False
+        self.project.add_images(paths)
+        self.dataset.open_paths(self.project.image_paths())
+        first = os.path.normpath(os.path.abspath(paths[0]))
+        self.showDatasetImage(self.dataset.paths.index(first) if first in self.dataset.paths else 0)
+        return True
+
+    def openProjectDialog(self):
+        """
+        プロジェクトファイルを開く（無ければ作成する）ダイアログを表示する処理.
+        画像が登録されていないプロジェクトの場合は, 続けて画像のフォルダを選ばせる.
+        :return:
+        """
+        filePath, _ = QFileDialog.getSaveFileName(self, "Open Project", "", "Drawing Project (*.drwproj)",
+                                                  options=QFileDialog.DontConfirmOverwrite)
+        if not filePath:
+            return
+        if not self.openProject(filePath):
+            QMessageBox.information(self, "Image Viewer", "Cannot open %s." % filePath)
+            return
+        if self.dataset.count == 0:
+            self.openFolder()
+
+    def openProject(self, filePath: str) -> bool:
+        """
+        プロジェクトを開き, 登録されている画像の先頭を表示する.
+        以降, オブジェクトは画像を表示する時にプロジェクトから読み込み, 変更はプロジェクトに書き込む.
+        :param filePath: プロジェクトファイルのパス. 無ければ作成する.
+        :return: 開けたかどうか.
+        """
+        import sqlite3
+
+        self.finishEditingForHistory()
+        self.journal.close()
+        try:
+            self.project.open(filePath)
+        except sqlite3.DatabaseError:
+            return False
+
+        if self.dataset.open_paths(self.project.image_paths()) > 0:
+            self.showDatasetImage(0)
+        return True
+
+    def openProjectImage(self, fileName: str) -> None:
+        """
+        表示した画像のオブジェクトをプロジェクトから読み込む処理. 前の画像の変更は書き込んでから切り替える.
+        :param fileName: 画像ファイルのパス.
+        :return:
+        """
+        objects = self.project.open_image(fileName)
+        self.project.set_image_size(fileName, self.imageSize().toTuple())
+        self.replaceDrawingObjects(objects)
+
+    def scheduleProjectCommit(self) -> None:
+        """
+        プロジェクトに書き込み待ちの変更があれば, 編集が止まってから書き込むようにタイマーを掛け直す.
+        :return:
+        """
+        if self.project.pending_count > 0:
+            self.projectCommitTimer.start()
+
+    def showDatasetImage(self, index: int) -> None:
+        """
+        フォルダ内のindex番目の画像に切り替える.
+        先読み済みならすぐに切り替え, デコード中なら終わった時(onDatasetImageLoaded)に切り替える.
+        :param index: 画像のindex.
+        :return:
+        """
+        path = self.dataset.go(index)
+        if path is None:
+            return
+        self.pendingDatasetPath = path
+        self.pendingImagePath = None
+        self.imageProgressBar.hide()
+        self.setWindowTitle(f"Drawing Application - {os.path.basename(path)} "
+                            f"({self.dataset.index + 1}/{self.dataset.count})")
+        if self.dataset.image(path) is not None or self.dataset.is_failed(path):
+            self.onDatasetImageLoaded(path)
+
+    def stepDataset(self, delta: int) -> None:
+        """
+        フォルダ内の次(delta=1)・前(delta=-1)の画像に移動する.
+        :param delta: 移動する枚数.
+        :return:
+        """
+        if self.dataset.count > 0:
+            index = self.dataset.index + delta
+            if 0 <= index < self.dataset.count:
+                self.showDatasetImage(index)
+
+    def onDatasetImageLoaded(self, path: str) -> None:
+        """
+        先読みしていた画像のデコードが終わった時の処理. 表示待ちの画像であれば切り替える.
+        :param path: デコードが終わった画像のパス.
+        :return:
+        """
+        if path != self.pendingDatasetPath:
+            return
+        self.pendingDatasetPath = None
+        image = self.dataset.image(path)
+        if image is None:
+            QMessageBox.information(self, "Image Viewer", "Cannot load %s." % path)
+            return
+
+        self.showImage(path, image)
+
+    def openJournal(self, fileName: str) -> None:
+        """
+        画像に対応する編集ジャーナルを開く処理. 前回の編集結果があれば現在のオブジェクトと置き換える.
+        ジャーナルのファイルは最初に編集した時に作成される.
+        :param fileName: 画像ファイルのパス.
+        :return:
+        """
+        recovered = self.journal.open(fileName)
+        if recovered is None:
+            return
+
+        with self.journal.paused():
+            self.replaceDrawingObjects(recovered)
+
+    def onJournalFailed(self, message: str) -> None:
+        """
+        編集ジャーナルがファイルに書けなくなって記録を止めた時の処理.
+        以降の編集は自動保存されないので, Export Drawingで保存するように知らせる.
+        :param message: 原因のエラーメッセージ.
+        :return:
+        """
+        QMessageBox.warning(self, "Autosave",
+                            "Autosave is off: the edit journal could not be written.\n"
+                            f"{message}\n\nUse Export Drawing to save your drawing.")
 
     def exportDrawing(self):
         """
-        描画結果をエクスポートする処理.
+        描画結果をファイルに書き出すダイアログを表示する処理.
+        :return:
+        """
+        filePath, _ = QFileDialog.getSaveFileName(self, "Save File", "",
+                                                  "Annotation JSON (*.json);;Annotation Binary (*.drwb)")
+        if filePath:
+            self.saveDrawing(filePath)
+
+    @profiler.measure("exportDrawing")
+    def saveDrawing(self, filePath: str) -> int:
+        """
+        描画結果をファイルに書き出す処理. 拡張子が.drwbならバイナリ形式, それ以外はJSON形式.
+        :param filePath: 書き出すファイルのパス.
+        :return: 書き出したオブジェクト数.
+        """
+        return AnnotationFile.save(filePath, self.iterDrawingObjects(), self.imageSize().toTuple())
+
+    def imageSize(self) -> QSize:
+        """
+        読み込んだ画像の元のサイズ（ピクセル）. ウィンドウやキャンバスのサイズとは関係ない.
+        画像を読み込む前は, 起動時に作成した白紙の画像のサイズ.
+        """
+        return self.pyramid.size if self.pyramid is not None else self.image.size()
+
+    def importDrawing(self):
+        """
+        保存した描画結果を読み込むダイアログを表示する処理.
+        以前のExport Drawingで書き出したテキストファイルも読み込める.
+        :return:
+        """
+        filePath, _ = QFileDialog.getOpenFileName(self, "Open File", "",
+                                                  "Annotations (*.json *.drwb);;Legacy Export (*.txt)")
+        if filePath:
+            if not self.loadDrawing(filePath):
+                QMessageBox.information(self, "Image Viewer", "Cannot load %s." % filePath)
+
+    @profiler.measure("importDrawing")
+    def loadDrawing(self, filePath: str) -> bool:
+        """
+        保存した描画結果を読み込み, 現在のオブジェクトと置き換える処理.
+        :param filePath: 読み込むファイルのパス.
+        :return: 読み込めたかどうか.
+        """
+        try:
+            objects, _ = AnnotationFile.load(filePath, self.imageSize().toTuple(), DrawingObject)
+        except (OSError, ValueError, KeyError, IndexError):
+            return False
+
+        # 1件ずつジャーナル・プロジェクトに記録せず, 読み込んだ結果をまとめてスナップショットにする.
+        with self.journal.paused(), self.project.paused():
+            self.replaceDrawingObjects(objects)
+        self.journal.compact(self.iterDrawingObjects())
+        self.project.replace(self.iterDrawingObjects())
+        return True
+
+    def replaceDrawingObjects(self, objects: list) -> None:
+        """
+        現在のオブジェクトを全て消し, 指定したオブジェクトに置き換える.
+        :param objects: 確定済みとして登録するDrawingObjectのリスト.
         :return:
         """
-        filePath, _ = QFileDialog.getSaveFileName(self, "Save File", "", "Text Files (*.txt)")
+        self.clearDrawingObjects()
+        with self.history.paused(), self.compositor.batch(self.visibleCanvasRect()):
+            for _obj in objects:
+                self.commitDrawingObject(_obj)
+        self.history.clear()
+
+        # 登録したオブジェクトの続きの番号から新しいオブジェクトを作成する.
+        self.lineID = max(self.linesDict, default=-1) + 1
+        self.rectAngleID = max(self.rectAngleDict, default=-1) + 1
+        self.polyLineID = max(self.polyLinesDict, default=-1) + 1
+        self.update()
+
+    def iterDrawingObjects(self):
+        """
+        確定済みの全オブジェクトを, 線, 矩形, ポリラインの順に返すジェネレータ.
+        """
+        for object_type in DrawingObject.TYPES:
+            yield from self.objectDict[object_type].values()
+
+    def clearDrawingObjects(self) -> None:
+        """
+        全てのオブジェクトと, 描画中・修正中・選択中の状態を消す.
+        :return:
+        """
+        for d in self.objectDict.values():
+            d.clear()
+        self.compositor.clear()
+        self.highlight.clear()
+        self.spatialIndex.clear()
+        self.geometryCache.clear()
+        self.vertexArrays.clear()
+        self.vertexIndex.clear()
+
+        self.editingDrawingObject = None
+        self.modifyingDrawingObject = None
+        self.currentMousePosition = None
+        self.tracer = None
+        self.selection.clear()
+        self.range_coordinates = []
+        self.drawingLine = False
+        self.drawingRect = False
+        self.lineID = self.rectAngleID = self.polyLineID = 0
+        self.update()
+
+    def exportTimings(self) -> None:
+        """
+        計測したフレームごとの処理時間をCSVに書き出す処理.
+        :return:
+        """
+        filePath, _ = QFileDialog.getSaveFileName(self, "Save Timings", "", "CSV Files (*.csv)")
         if filePath:
-            with open(filePath, 'w') as file:
-                file.write(f"{self.rectAngleDict}¥n")  # Add more details as needed
-                file.write(f"{self.polyLinesDict}¥n")
+            profiler.export_csv(filePath)
+
+    def getHudExtraLines(self) -> list:
+        """
+        HUDに計測時間と合わせて表示する、キャッシュなどのカウンタ情報.
+        :return: 表示する文字列のリスト.
+        """
+        cache = self.geometryCache.stats()
+        lod = self.compositor.lod
+        coalescer = self.mouseMoveCoalescer
+        objects = sum(len(d) for d in self.objectDict.values())
+        lines = [f"objects {objects}  selected {len(self.selection)}  tiles {self.compositor.tile_count}  "
+                 f"rasterized {self.compositor.rasterized_tiles}  pending {self.compositor.pending_count}",
+                 f"zoom {self.viewZoom:.2f}  lod skipped {self.compositor.skipped_objects}  "
+                 f"simplified hit {lod.hits} miss {lod.misses}",
+                 f"geometry cache hit {cache['hits']} miss {cache['misses']} ({cache['hit_rate']:.0%})",
+                 f"mouse move events {coalescer.events_received} moves processed {coalescer.moves_processed}",
+                 f"journal records {self.journal.records} ({self.journal.journal_bytes / 1024:.0f} KB)  "
+                 f"compactions {self.journal.compactions}{'  FAILED' if self.journal.error is not None else ''}",
+                 f"history undo {self.history.stats()['undo']} redo {self.history.stats()['redo']} "
+                 f"({self.history.memory_bytes / 1024:.0f} KB)",
+                 ]
+        if self.tracer is not None:
+            lines.append(f"trace points {self.tracer.received}  vertices {self.tracer.vertices}")
+        if self.pyramid is not None:
+            lines.append(f"pyramid levels {self.pyramid.level_count}  tiles drawn {self.pyramid.tiles_drawn}")
+        if self.project.is_active:
+            lines.append(f"project {os.path.basename(self.project.path)}  pending {self.project.pending_count}  "
+                         f"commits {self.project.commits} ({self.project.written} objects)")
+        if self.dataset.count > 0:
+            images = self.dataset.cache.stats()
+            lines.append(f"dataset {self.dataset.index + 1}/{self.dataset.count}  cached {images['images']} "
+                         f"({images['memory_bytes'] / 1024 ** 2:.0f} MB)  pending {self.dataset.pending_count}  "
+                         f"hit {images['hits']} miss {images['misses']}")
+        return lines
+
+    def canvasSize(self) -> QSize:
+        """
+        オブジェクトを描画するキャンバスのサイズ. ウィンドウサイズ x 表示倍率.
+        相対座標と絶対座標の変換にはこのサイズを使う.
+        """
+        return QSize(max(1, round(self.width() * self.viewZoom)), max(1, round(self.height() * self.viewZoom)))
+
+    def visibleCanvasRect(self) -> QRect:
+        """
+        ウィンドウに表示されているキャンバス上の範囲.
+        """
+        return QRect(self.viewOffset, self.size())
+
+    def toCanvas(self, position: QPoint) -> QPoint:
+        """
+        ウィンドウ上の座標（マウスの位置など）をキャンバス上の絶対座標に変換する.
+        """
+        return position + self.viewOffset
+
+    def updateCanvas(self, rect: QRect) -> None:
+        """
+        キャンバス上の絶対座標で指定した領域を再描画させる. 表示されていない部分は無視される.
+        """
+        if not rect.isEmpty():
+            self.update(rect.translated(-self.viewOffset))
+
+    def setViewport(self, zoom: float, offset: QPoint, preview: bool = False) -> None:
+        """
+        表示倍率と表示位置を変更する. 表示位置はキャンバスからはみ出さないように調整する.
+        :param zoom: 表示倍率. MIN_ZOOM〜MAX_ZOOMに丸める.
+        :param offset: ウィンドウの左上に表示するキャンバス上の座標.
+        :param preview: Trueなら, オーバーレイを作り直さずに変更前のタイルを拡大・縮小して表示する（リサイズ中）.
+        :return:
+        """
+        old_size = self.canvasSize()
+        old_offset = self.viewOffset
+        self.viewZoom = min(max(zoom, MIN_ZOOM), MAX_ZOOM)
+        size = self.canvasSize()
+        self.viewOffset = QPoint(min(max(offset.x(), 0), size.width() - self.width()),
+                                 min(max(offset.y(), 0), size.height() - self.height()))
+
+        # 絶対座標で保持しているマウスの位置を新しいキャンバスに合わせる.
+        # マウスはウィンドウ上で動いていないので, ウィンドウ上の位置が同じになるようにする.
+        if self.currentMousePosition is not None:
+            self.currentMousePosition = self.currentMousePosition - old_offset + self.viewOffset
+        scale_x = size.width() / old_size.width()
+        scale_y = size.height() / old_size.height()
+        self.range_coordinates = [QPoint(round(p.x() * scale_x), round(p.y() * scale_y))
+                                  for p in self.range_coordinates]
+
+        # オーバーレイのタイルはキャンバスのサイズが変わった時だけ作り直す.
+        self.compositor.resize(size, preview)
+        self.highlight.resize(size, preview)
+
+        # 描画中のオブジェクトのレイヤーは表示されている範囲だけなので作り直す.
+        if self.editingDrawingObject is not None:
+            self.setDrawLayer(self.editingDrawingObject)
+        self.previewRect = self.getPreviewRect()
+        self.update()
+
+    def zoomAt(self, position: QPoint, zoom: float) -> None:
+        """
+        ウィンドウ上の位置を中心に拡大・縮小する. その位置に表示されているキャンバス上の点は動かない.
+        :param position: ウィンドウ上の座標.
+        :param zoom: 新しい表示倍率.
+        :return:
+        """
+        size = self.canvasSize()
+        anchor = self.toCanvas(position)
+        relative_x, relative_y = anchor.x() / size.width(), anchor.y() / size.height()
+
+        zoom = min(max(zoom, MIN_ZOOM), MAX_ZOOM)
+        width, height = self.width() * zoom, self.height() * zoom
+        self.setViewport(zoom, QPoint(round(relative_x * width) - position.x(),
+                                      round(relative_y * height) - position.y()))
+
+    def resetViewport(self) -> None:
+        """
+        表示倍率を1倍に戻し, 画像全体を表示する.
+        """
+        self.setViewport(1.0, QPoint(0, 0))
+
+    def wheelEvent(self, event) -> None:
+        """
+        マウスホイールでマウスの位置を中心に拡大・縮小する.
+        :param event:
+        :return:
+        """
+        steps = event.angleDelta().y() / 120
+        if steps == 0:
+            return
+        self.zoomAt(event.position().toPoint(), self.viewZoom * ZOOM_STEP ** steps)
 
     def mousePressEvent(self, event):
         """
@@ -216,22 +950,28 @@ class DrawingApp(QMainWindow):
         :return:
         """
 
+        # 中ボタンのドラッグで表示位置を動かす.
+        if event.button() == Qt.MiddleButton:
+            self.panAnchor = (event.position().toPoint(), self.viewOffset)
+            return
+
+        # まだ処理していないマウス移動を反映してから、
+        # クリックで状態が変わるので、直前のプレビューを消す.
+        self.mouseMoveCoalescer.flush()
+        self.updateCanvas(self.previewRect)
+
         # Ctrl押しながらクリックしている場合,
         if event.button() == Qt.LeftButton and event.modifiers() & Qt.ControlModifier:
-            print("Ctrl + Click detected.")
-
             # クリックした座標を取得し
-            ctrl_point = event.position().toPoint()  # type: QPoint
+            ctrl_point = self.toCanvas(event.position().toPoint())  # type: QPoint
 
             # 最も近い場所にあるオブジェクトを探し
             nearest_object = self.findClosestObject(ctrl_point)  # 絶対座標系を前提とする.
+            if nearest_object is None:
+                return
 
-            # 選択中と分かるように、一時的に色を変える.
-            nearest_object.color = QColor(0, 255, 0, 127)
-            nearest_object = self.setDrawLayer(nearest_object)  # 戻り値は、色が変わってレイヤーが再描画されたDrawingObject.
-
-            # 複数選択用の配列にappendする. 参照渡しのため、各種辞書変数のvalue側も変更されることに注意.
-            self.selected_object.append(nearest_object)
+            # 選択に加え, 強調表示する. 選択済みのオブジェクトなら何もしない.
+            self.selectObjects([nearest_object])
 
             # 普通の左クリックが検知されないようにreturnし、この関数の処理を終了する.
             return
@@ -240,22 +980,15 @@ class DrawingApp(QMainWindow):
         if event.button() == Qt.LeftButton:
 
             # 複数選択中の場合, 複数選択を解除する.
-            if len(self.selected_object) > 0:
-
-                # 選択中のオブジェクトの色を全てリセットする.
-                # 参照渡しなので、Dictのほうも変更されるはず
-                for _obj in self.selected_object:
-                    _obj.set_color()
-                    self.setDrawLayer(_obj=_obj)
-
-                self.selected_object = []
+            if self.selection:
+                self.clearSelection()
                 return
 
             # 範囲選択が可能な状態の場合.
             if self.allow_range_selection:
 
                 # マウスの位置を取得
-                clickedMousePosition = event.position().toPoint()  # type: QPoint
+                clickedMousePosition = self.toCanvas(event.position().toPoint())  # type: QPoint
 
                 # 矩形選択中じゃない場合. = 矩形の1点目がない場合.
                 if len(self.range_coordinates) == 0:
@@ -278,8 +1011,8 @@ class DrawingApp(QMainWindow):
                     # トラッキングを停止
                     self.setMouseTracking(False)
 
-                    # 描画した矩形の中にあるオブジェクトを特定し,
-                    self.selected_object = self.isInsideOfRect(self.range_coordinates)  # DrawingObject型変数のリスト.
+                    # 描画した矩形の中にあるオブジェクトを特定し, 選択する.
+                    self.selectObjects(self.isInsideOfRect(self.range_coordinates))
 
                     # 各種リセット
                     self.currentMousePosition = None
@@ -294,7 +1027,7 @@ class DrawingApp(QMainWindow):
                 if self.modifyingDrawingObject is not None:
 
                     # マウスの位置を取得
-                    currentMousePosition = event.position().toPoint()  # type: QPoint
+                    currentMousePosition = self.toCanvas(event.position().toPoint())  # type: QPoint
 
                     # まだマウストラッキングを行っていない場合,
                     if self.currentMousePosition is None:
@@ -312,12 +1045,13 @@ class DrawingApp(QMainWindow):
                     else:
 
                         # クリックしたマウス座標を相対位置に変換のうえ置き換える.
-                        self.modifyingDrawingObject.coordinates[self.modifyingDrawingObject.modifying_coordinate_index] = self.get_relative_coordinate(currentMousePosition)
+                        self.modifyingDrawingObject.replace_coordinate(self.modifyingDrawingObject.modifying_coordinate_index,
+                                                                       self.snapCoordinate(currentMousePosition))
                         self.currentMousePosition = None
                         self.modifyingDrawingObject.modifying_coordinate_index = None
 
-                        # レイヤーを新しい座標で再描画し、辞書型変数に戻す.
-                        self.linesDict[self.modifyingDrawingObject.id] = self.setDrawLayer(self.modifyingDrawingObject)
+                        # レイヤーを新しい座標で再描画する(辞書型変数と同じインスタンス).
+                        self.setDrawLayer(self.modifyingDrawingObject)
                         self.update()
 
                         # マウストラッキングを停止.
@@ -330,24 +1064,25 @@ class DrawingApp(QMainWindow):
                     if self.editingDrawingObject is None:
 
                         self.editingDrawingObject = DrawingObject(id=self.lineID, object_type="Line")
-                        self.editingDrawingObject.coordinates.append(self.get_relative_coordinate(abs_coord=event.position().toPoint()))
+                        self.editingDrawingObject.start_drawing()
+                        self.editingDrawingObject.append_coordinate(self.snapCoordinate(self.toCanvas(event.position().toPoint())))
 
                         self.lineID += 1
                         self.setMouseTracking(True)  # 点線の描画の為に、マウストラッキングを開始する
 
                     # 描画中の線がある場合. 直線なのでlen()==1という条件にする.
-                    elif len(self.editingDrawingObject.coordinates) == 1:
+                    elif self.editingDrawingObject.coordinate_count == 1:
 
                         self.setMouseTracking(False)  # 始点終点がセットされたのでマウストラッキングを終了する
 
                         # 座標の取得・格納
-                        self.editingDrawingObject.coordinates.append(self.get_relative_coordinate(abs_coord=event.position().toPoint()))
+                        self.editingDrawingObject.append_coordinate(self.snapCoordinate(self.toCanvas(event.position().toPoint())))
 
                         # self.image に直線を描画
                         self.drawingLine = True
 
                         # 中間変数から、lineDictへ格上げ
-                        self.linesDict[self.editingDrawingObject.id] = self.setDrawLayer(self.editingDrawingObject)
+                        self.commitDrawingObject(self.editingDrawingObject)
                         self.editingDrawingObject = None  # reset object.
 
                         # クリックポイントをリセット
@@ -361,7 +1096,7 @@ class DrawingApp(QMainWindow):
                 if self.modifyingDrawingObject is not None:
 
                     # マウスの位置を取得
-                    currentMousePosition = event.position().toPoint()
+                    currentMousePosition = self.toCanvas(event.position().toPoint())
 
                     # まだマウストラッキングを行っていない場合,
                     if self.currentMousePosition is None:
@@ -380,12 +1115,13 @@ class DrawingApp(QMainWindow):
                     else:
 
                         # クリックしたマウス座標で置き換える.
-                        self.modifyingDrawingObject.coordinates[self.modifyingDrawingObject.modifying_coordinate_index] = self.get_relative_coordinate(currentMousePosition)
+                        self.modifyingDrawingObject.replace_coordinate(self.modifyingDrawingObject.modifying_coordinate_index,
+                                                                       self.snapCoordinate(currentMousePosition))
                         self.currentMousePosition = None
                         self.modifyingDrawingObject.modifying_coordinate_index = None
 
-                        # レイヤーを新しい座標で再描画し、辞書型変数に戻す.
-                        self.linesDict[self.modifyingDrawingObject.id] = self.setDrawLayer(self.modifyingDrawingObject)
+                        # レイヤーを新しい座標で再描画する(辞書型変数と同じインスタンス).
+                        self.setDrawLayer(self.modifyingDrawingObject)
                         self.update()
 
                         # マウストラッキングを停止.
@@ -399,19 +1135,20 @@ class DrawingApp(QMainWindow):
 
                         # 新規作成
                         self.editingDrawingObject = DrawingObject(id=self.rectAngleID, object_type="Rectangle")
-                        self.editingDrawingObject.coordinates.append(self.get_relative_coordinate(event.position().toPoint()))
+                        self.editingDrawingObject.start_drawing()
+                        self.editingDrawingObject.append_coordinate(self.snapCoordinate(self.toCanvas(event.position().toPoint())))
 
                         self.rectAngleID += 1
                         self.setMouseTracking(True)
 
                     # 現在編集中の矩形がある場合.
-                    elif len(self.editingDrawingObject.coordinates) == 1:
+                    elif self.editingDrawingObject.coordinate_count == 1:
                         # 座標の取得・格納
-                        self.editingDrawingObject.coordinates.append(self.get_relative_coordinate(event.position().toPoint()))
+                        self.editingDrawingObject.append_coordinate(self.snapCoordinate(self.toCanvas(event.position().toPoint())))
                         self.setMouseTracking(False)
 
                         # 中間変数から、rectAngleDictへ格上げ
-                        self.rectAngleDict[self.editingDrawingObject.id] = self.setDrawLayer(self.editingDrawingObject)
+                        self.commitDrawingObject(self.editingDrawingObject)
                         self.editingDrawingObject = None  # reset object
 
                         # クリックポイントをリセット
@@ -425,7 +1162,7 @@ class DrawingApp(QMainWindow):
                 if self.modifyingDrawingObject is not None:
 
                     # マウスの位置を取得
-                    currentMousePosition = event.position().toPoint()
+                    currentMousePosition = self.toCanvas(event.position().toPoint())
 
                     # まだマウストラッキングを行っていない場合,
                     if self.currentMousePosition is None:
@@ -444,12 +1181,13 @@ class DrawingApp(QMainWindow):
                     else:
 
                         # クリックしたマウス座標で置き換える.
-                        self.modifyingDrawingObject.coordinates[self.modifyingDrawingObject.modifying_coordinate_index] = self.get_relative_coordinate(currentMousePosition)
+                        self.modifyingDrawingObject.replace_coordinate(self.modifyingDrawingObject.modifying_coordinate_index,
+                                                                       self.snapCoordinate(currentMousePosition))
                         self.currentMousePosition = None
                         self.modifyingDrawingObject.modifying_coordinate_index = None
 
-                        # レイヤーを新しい座標で再描画し、辞書型変数に戻す.
-                        self.linesDict[self.modifyingDrawingObject.id] = self.setDrawLayer(self.modifyingDrawingObject)
+                        # レイヤーを新しい座標で再描画する(辞書型変数と同じインスタンス).
+                        self.setDrawLayer(self.modifyingDrawingObject)
                         self.update()
 
                         # マウストラッキングを停止.
@@ -463,7 +1201,8 @@ class DrawingApp(QMainWindow):
 
                         # 新しいオブジェクトを作成
                         self.editingDrawingObject = DrawingObject(id=self.polyLineID, object_type="PolyLine")
-                        self.editingDrawingObject.coordinates.append(self.get_relative_coordinate(event.position().toPoint()))
+                        self.editingDrawingObject.start_drawing()
+                        self.editingDrawingObject.append_coordinate(self.snapCoordinate(self.toCanvas(event.position().toPoint())))
 
                         # IDをインクリメントする.
                         self.polyLineID += 1
@@ -472,13 +1211,17 @@ class DrawingApp(QMainWindow):
                         self.setMouseTracking(True)
 
                     # 現在編集中のpolylineがある場合,
-                    elif len(self.editingDrawingObject.coordinates) >= 1:
+                    elif self.editingDrawingObject.coordinate_count >= 1:
                         # 編集中のpolylineのIDを持つ配列に、現在の座標を追加する.
                         # appendすることでlen()>=2になるので後続処理でout of indexにはならない.
-                        self.editingDrawingObject.coordinates.append(self.get_relative_coordinate(event.position().toPoint()))
+                        self.editingDrawingObject.append_coordinate(self.snapCoordinate(self.toCanvas(event.position().toPoint())))
                         # レイヤーを取得.
                         self.editingDrawingObject = self.setDrawLayer(self.editingDrawingObject)
 
+                    # Shiftを押しながらの場合, ボタンを離すまでマウスの軌跡をなぞって頂点を追加する.
+                    if event.modifiers() & Qt.ShiftModifier:
+                        self.startTrace()
+
         # 普通の右クリック（オブジェクトの修正）の場合,
         elif event.button() == Qt.RightButton:
 
@@ -487,6 +1230,7 @@ class DrawingApp(QMainWindow):
 
                 # 修正を終了し、
                 self.modifyingDrawingObject.stop_modifying()
+                self.history.end_modify(self.modifyingDrawingObject)
                 self.setDrawLayer(_obj=self.modifyingDrawingObject)
 
                 # 修正した結果を辞書型変数に戻す.
@@ -506,106 +1250,199 @@ class DrawingApp(QMainWindow):
             # この処理はmarginを持たせることから、相対座標ではなく絶対座標での計算をさせたい.
             else:
 
-                # 画面サイズを取得.
-                window_size = self.size()
-
-                # マウスポインタの座標を取得し、ShapelyのPoint型（相対座標）に変換する.
-                mouseCoord = event.position().toPoint()  # type: QPoint
-                # mouseCoordPoint = Point(mouseCoord.x()/window_size.width(), mouseCoord.y()/window_size.height())  # type: Point
-                mouseCoordPoint = Point(mouseCoord.x(), mouseCoord.y())  # type: Point
-
-                # クリックした近くのオブジェクトの特定.
-                for d in [self.linesDict, self.rectAngleDict, self.polyLinesDict]:
-
-                    # マウスポインタの座標が既に描画された線や矩形の近くである場合
-                    for k, v in d.items():
-                        # key  : object's id
-                        # value: DrawingObject class instance.
-
-                        # ShapelyのLineStringに変換(絶対座標に変換もしている)
-                        each_linestring = self.point2linestring(_obj=v, window_size=window_size)
-
-                        # marginを追加
-                        each_linestring_margin = each_linestring.buffer(MARGIN)
+                # マウスポインタの座標を取得し、クリックした近くのオブジェクトを特定する.
+                mouseCoord = self.toCanvas(event.position().toPoint())  # type: QPoint
+                nearest_object = self.findClosestObject(mouseCoord)
 
-                        # 右クリックした時のマウス座標が、marginの中で,
-                        if each_linestring_margin.contains(Point(mouseCoordPoint.x, mouseCoordPoint.y)):
+                # 修正フラグが立っていなければ,
+                if nearest_object is not None and not nearest_object.is_being_modified:
 
-                            # 修正フラグが立っていなければ,
-                            if not d[k].is_being_modified:
+                    # 修正フラグを立て,
+                    nearest_object.start_modifying()
+                    self.history.begin_modify(nearest_object)
 
-                                # 修正フラグを立て,
-                                d[k].start_modifying()
+                    # 修正対象のオブジェクトを格納する変数に入れる.
+                    self.modifyingDrawingObject = nearest_object
 
-                                # 修正対象のオブジェクトを格納する変数に入れる.
-                                self.modifyingDrawingObject = d[k]
-
-                                # 変えた色で再描画する
-                                self.setDrawLayer(_obj=self.modifyingDrawingObject)
+                    # 変えた色で再描画する
+                    self.setDrawLayer(_obj=self.modifyingDrawingObject)
 
     def mouseDoubleClickEvent(self, event: QMouseEvent):
-        if self.shape == "PolyLine":
+        self.mouseMoveCoalescer.flush()
+        if self.shape == "PolyLine" and self.editingDrawingObject is not None:
+            self.tracer = None  # Shiftを押しながらのダブルクリックでは, なぞり描きを始めずに確定する.
             self.setMouseTracking(False)  # マウストラッキングを終了
+            self.updateCanvas(self.previewRect)  # 直前のプレビューを消す.
 
             # 直前まで編集していたPolylineを格納する.
-            self.polyLinesDict[self.editingDrawingObject.id] = self.editingDrawingObject
+            self.commitDrawingObject(self.editingDrawingObject)
 
             # 初期化する
             self.editingDrawingObject = None
             self.currentMousePosition = None
 
     def mouseMoveEvent(self, event: QMouseEvent):
+        """
+        マウスが移動した時のイベントハンドラ.
+        イベントごとには処理せず、最新の位置だけを保持してフレームごとにprocessMouseMoveで処理させる.
+
+        :param event:
+        :return:
+        """
+        if self.panAnchor is not None:
+            position, offset = self.panAnchor
+            self.setViewport(self.viewZoom, offset - (event.position().toPoint() - position))
+            return
+
+        # なぞり描き中は, 軌跡の点を間引かずに全て簡略化に渡す. 再描画はフレームごとにまとめる.
+        if self.tracer is not None:
+            self.traceTo(self.toCanvas(event.position().toPoint()))
+
+        self.mouseMoveCoalescer.push(self.toCanvas(event.position().toPoint()))
+
+    def processMouseMove(self, position: QPoint) -> None:
         """
         DrawingObjectを描画中や修正中の場合に、マウスの位置を取得する関数.
         計算量が膨大になることから、絶対座標で保持する.
+        再描画はプレビュー（点線）の直前の領域と新しい領域だけに限定する.
 
-        :param event:
+        :param position: 最新のマウスの位置. 絶対座標系.
         :return:
         """
 
+        # 描画中・修正中は, 近くの頂点にスナップした位置をプレビューに使う.
+        if self.editingDrawingObject is not None or self.modifyingDrawingObject is not None:
+            vertex = self.findSnapVertex(position)
+            if vertex is not None:
+                position = self.get_actual_coordinate(vertex)
+            self.snapTarget = None if vertex is None else position
+
         # 範囲選択中の場合,
         if self.allow_range_selection:
-            self.currentMousePosition = event.position().toPoint()
-            self.update()
+            self.currentMousePosition = position
+            self.updatePreview()
 
         # 描画中の場合
         if self.editingDrawingObject is not None:
 
             # 線を描画するモード.
-            if self.shape == "Line" and len(self.editingDrawingObject.coordinates) == 1:
-                self.currentMousePosition = event.position().toPoint()
-                self.update()
+            if self.shape == "Line" and self.editingDrawingObject.coordinate_count == 1:
+                self.currentMousePosition = position
+                self.updatePreview()
 
             # 矩形を描画するモード.
             elif self.shape == "Rectangle":
-                self.currentMousePosition = event.position().toPoint()
-                self.update()
+                self.currentMousePosition = position
+                self.updatePreview()
 
             # PolyLineを描画するモード.
             elif self.shape == "PolyLine":
-                self.currentMousePosition = event.position().toPoint()
-                self.update()
+                self.currentMousePosition = position
+                self.updatePreview()
+
+                # なぞり描きで頂点が変わっていれば, レイヤーをフレームごとに1回だけ描画し直す.
+                if self.tracer is not None and self.tracedVersion != self.editingDrawingObject.version:
+                    self.tracedVersion = self.editingDrawingObject.version
+                    self.setDrawLayer(self.editingDrawingObject)
 
         # 修正中の場合,
         if self.modifyingDrawingObject is not None:
 
             # 線なら
             if self.modifyingDrawingObject.object_type == "Line":
-                self.currentMousePosition = event.position().toPoint()
-                self.update()  # 描画
+                self.currentMousePosition = position
+                self.updatePreview()  # 描画
 
             # 矩形なら
             elif self.modifyingDrawingObject.object_type == "Rectangle":
-                self.currentMousePosition = event.position().toPoint()
-                self.update()  # 描画
+                self.currentMousePosition = position
+                self.updatePreview()  # 描画
 
             elif self.modifyingDrawingObject.object_type == "PolyLine":
-                self.currentMousePosition = event.position().toPoint()
-                self.update()  # 描画
+                self.currentMousePosition = position
+                self.updatePreview()  # 描画
+
+    def getDisplayFrameRate(self) -> float:
+        """
+        ウィンドウが表示されている画面のリフレッシュレートを返す関数.
+        :return: 取得できない場合はMouseMoveCoalescer.DEFAULT_FRAME_RATE.
+        """
+        screen = self.screen()
+        if screen is not None and screen.refreshRate() > 0:
+            return screen.refreshRate()
+        return MouseMoveCoalescer.DEFAULT_FRAME_RATE
+
+    def setTargetFrameRate(self, frame_rate: float) -> None:
+        """
+        マウス移動によるプレビューの再描画を、1秒あたり最大何回行うかを設定する関数.
+        :param frame_rate: 0以下なら間引かずにイベントごとに処理する.
+        :return:
+        """
+        self.mouseMoveCoalescer.setFrameRate(frame_rate)
+
+    def getPreviewRect(self) -> QRect:
+        """
+        現在の状態でプレビュー（点線）が描画される領域を返す関数.
+        プレビューの起点とマウスの位置を囲む矩形に、線の太さ分の余白を加えたもの.
+
+        :return: 絶対座標系のQRect. プレビューが無い場合は空のQRect.
+        """
+        if self.currentMousePosition is None:
+            return QRect()
+
+        # プレビューの起点（絶対座標）.
+        anchors = []
+
+        # 範囲選択中の場合,
+        if self.allow_range_selection and len(self.range_coordinates) == 1:
+            anchors = [self.range_coordinates[0]]
+
+        # 描画中の場合, PolyLineは最後の点, 線と矩形は始点が起点.
+        elif self.editingDrawingObject is not None and self.editingDrawingObject.coordinate_count > 0:
+            index = -1 if self.editingDrawingObject.object_type == "PolyLine" else 0
+            anchors = [self.get_actual_coordinate(self.editingDrawingObject.point(index))]
+
+        # 修正中の場合, 線と矩形は固定点, PolyLineは前後の点が起点.
+        elif (self.modifyingDrawingObject is not None and
+              self.modifyingDrawingObject.modifying_coordinate_index is not None):
+            _obj = self.modifyingDrawingObject
+            index = _obj.modifying_coordinate_index
+            if _obj.object_type in ("Line", "Rectangle"):
+                indices = [0 if index == 1 else 1]
+            else:
+                indices = [i for i in (index - 1, index + 1) if 0 <= i < _obj.coordinate_count]
+            anchors = [self.get_actual_coordinate(_obj.point(i)) for i in indices]
+
+        if not anchors:
+            return QRect()
+
+        rect = QRect(self.currentMousePosition, self.currentMousePosition)
+        for anchor in anchors:
+            rect = rect.united(QRect(anchor, anchor))
+        return rect.adjusted(-PREVIEW_MARGIN, -PREVIEW_MARGIN, PREVIEW_MARGIN, PREVIEW_MARGIN)
+
+    def updatePreview(self) -> None:
+        """
+        プレビュー（点線）の直前の領域と新しい領域だけを再描画させる関数.
+        :return:
+        """
+        newRect = self.getPreviewRect()
+        dirtyRect = self.previewRect.united(newRect)
+        self.previewRect = newRect
+        if not dirtyRect.isEmpty():
+            self.updateCanvas(dirtyRect)
 
     def mouseReleaseEvent(self, event: QMouseEvent):
+        if event.button() == Qt.MiddleButton:
+            self.panAnchor = None
+            return
+
         if event.button() == Qt.LeftButton:
 
+            # なぞり描き中の場合, 軌跡の終点まで頂点を追加して終了する. PolyLineはダブルクリックまで編集を続ける.
+            if self.tracer is not None:
+                self.finishTrace(self.toCanvas(event.position().toPoint()))
+
             # 線を描画中の場合.
             if self.drawingLine:
                 # ライン描画後にポイントをリセット
@@ -621,31 +1458,106 @@ class DrawingApp(QMainWindow):
         キーボードのキーが押された時のイベントハンドラ.
         ---
         d: 選択中のオブジェクトを消す.
+        h: 処理時間の計測とHUDの表示を切り替える.
+        t: 計測したフレームごとの処理時間をCSVに書き出す.
+        0: 表示倍率を1倍に戻す.
+        n, →: フォルダ内の次の画像. p, ←: 前の画像.
+        Ctrl+O: プロジェクトを開く.
+        Ctrl+Z: 元に戻す. Ctrl+Shift+Z (Ctrl+Y): やり直す.
 
         :param event:
         :return:
         """
-        print("keypress is triggered.")
+        if event.matches(QKeySequence.Undo):
+            self.undo()
+            return
+
+        if event.matches(QKeySequence.Redo):
+            self.redo()
+            return
+
+        if event.matches(QKeySequence.Open):
+            self.openProjectDialog()
+            return
+
+        # "h"キー
+        if event.key() == Qt.Key_H:
+            profiler.setEnabled(not profiler.enabled)
+            self.profilerHud.setVisible(profiler.enabled)
+            return
+
+        # "t"キー
+        if event.key() == Qt.Key_T:
+            self.exportTimings()
+            return
+
+        # "0"キー
+        if event.key() == Qt.Key_0:
+            self.resetViewport()
+            return
+
+        # "n"キー, "p"キー
+        if event.key() in (Qt.Key_N, Qt.Key_Right):
+            self.stepDataset(1)
+            return
+        if event.key() in (Qt.Key_P, Qt.Key_Left):
+            self.stepDataset(-1)
+            return
+
         # "d"キー
         if event.key() == Qt.Key_D:
 
             # 複数選択した状態であれば,
-            if len(self.selected_object) > 0:
-
-                # 複数選択しているオブジェクトごとに,
-                for each_obj in self.selected_object:
+            if self.selection:
 
-                    # objectの辞書型から消す.
-                    del self.objectDict[each_obj.object_type][each_obj.id]
+                # 複数選択しているオブジェクトごとに, (まとめて1回のundoで戻せるようにする)
+                # 削除したオブジェクトは選択からも外れる.
+                with self.history.group(), self.compositor.batch(self.visibleCanvasRect()):
+                    for each_obj in self.selectedObjects():
 
-                # 複数選択状態をリセット.
-                self.selected_object = []
+                        # objectの辞書型とオーバーレイから消す.
+                        self.deleteDrawingObject(each_obj)
 
                 # 再描画(削除したオブジェクトを消す)
                 self.update()
 
             return
 
+    def undo(self) -> None:
+        """
+        直前の編集を元に戻す. 影響のあるオブジェクトだけが再描画される.
+        :return:
+        """
+        self.finishEditingForHistory()
+        self.history.undo()
+
+    def redo(self) -> None:
+        """
+        元に戻した編集をやり直す.
+        :return:
+        """
+        self.finishEditingForHistory()
+        self.history.redo()
+
+    def finishEditingForHistory(self) -> None:
+        """
+        undo/redoの前に, 修正中のオブジェクトを確定し, 選択を解除する.
+        選択中のオブジェクトがundoで消えることがあるため.
+        :return:
+        """
+        if self.modifyingDrawingObject is not None:
+            self.modifyingDrawingObject.stop_modifying()
+            self.modifyingDrawingObject.modifying_coordinate_index = None
+            self.history.end_modify(self.modifyingDrawingObject)
+            self.setDrawLayer(self.modifyingDrawingObject)
+            self.modifyingDrawingObject = None
+            self.currentMousePosition = None
+            self.setMouseTracking(False)
+            self.updateCanvas(self.previewRect)
+
+        self.clearSelection()
+
+    @profiler.measure("paintEvent", frame=True)
     def paintEvent(self, event) -> None:
         """
         以下のタイミングでcallされる処理.
@@ -657,28 +1569,54 @@ class DrawingApp(QMainWindow):
         :param event:
         :return:
         """
-        window_size = self.size()
+        window_size = self.canvasSize()
         canvasPainter = QPainter(self)
+
+        # 再描画が必要な領域（ウィンドウ上の座標）. 以降の描画は全てこの領域に限定する.
+        dirtyRect = event.rect()
+        canvasPainter.setClipRect(dirtyRect)
+
+        # HUDの表示更新に伴うだけの再描画はフレームとして数えない.
+        if self.profilerHud.isVisible() and self.profilerHud.geometry().contains(dirtyRect):
+            profiler.skip_frame()
+
         # 以下で実施していること
-        # drawImage の呼び出しは self.image の全体を DrawingApp ウィンドウの全体に描画することを意味する。
-        # 引数：self.rect() -> 描画先の領域を示す
+        # drawImage の呼び出しは self.image のうち dirtyRect に対応する部分だけを描画することを意味する。
+        # 引数：dirtyRect -> 描画先の領域を示す
         # 引数：self.image -> 描画する画像自体
-        # 引数：self.image.rect() -> 描画する画像の中で、どの部分を描画するかを指定する
-        canvasPainter.drawImage(self.rect(), self.image, self.image.rect())
-
-        # 各レイヤーを重ねる処理
-        for d in [self.linesDict, self.rectAngleDict, self.polyLinesDict]:
-            for _obj in d.values():
-                canvasPainter.drawImage(self.rect(),
-                                        _obj.layerImage,
-                                        _obj.layerImage.rect(),
-                                        )
+        # 引数：sourceRect -> 描画する画像の中で、どの部分を描画するかを指定する（キャンバスと画像の比率で変換）
+        # 巨大な画像の場合は, 表示倍率に合ったレベルのうちdirtyRectに掛かるタイルだけを描画する.
+        if self.pyramid is not None:
+            self.pyramid.draw(canvasPainter, QRect(-self.viewOffset, window_size), dirtyRect)
+        else:
+            scale_x = self.image.width() / window_size.width()
+            scale_y = self.image.height() / window_size.height()
+            sourceRect = QRectF((dirtyRect.x() + self.viewOffset.x()) * scale_x,
+                                (dirtyRect.y() + self.viewOffset.y()) * scale_y,
+                                dirtyRect.width() * scale_x, dirtyRect.height() * scale_y)
+            canvasPainter.drawImage(QRectF(dirtyRect), self.image, sourceRect)
+
+        # 以降はキャンバス上の絶対座標で描画する. 表示されている範囲外のオブジェクトには触れない.
+        canvasPainter.translate(-self.viewOffset)
+        dirtyRect = dirtyRect.translated(self.viewOffset)
+
+        # 確定済みのオブジェクトが描画されたオーバーレイを重ねる処理.
+        # dirtyRectに掛かるタイルのうち、変更があったものだけが再描画される.
+        self.compositor.draw(canvasPainter, dirtyRect)
+
+        # 選択中のオブジェクトを強調表示する. 選択中のオブジェクトだけのタイルを1回重ねる.
+        if self.selection:
+            self.highlight.draw(canvasPainter, dirtyRect)
+
+        # 描画中のオブジェクトのレイヤーを重ねる処理.
+        # レイヤーは表示されている範囲全体の大きさのことがあるので, dirtyRectに掛かる部分だけを描画する.
         if self.editingDrawingObject is not None:
             if self.editingDrawingObject.layerImage is not None:
-                canvasPainter.drawImage(self.rect(),
-                                        self.editingDrawingObject.layerImage,
-                                        self.editingDrawingObject.layerImage.rect(),
-                                        )
+                layerOffset = self.editingDrawingObject.layerOffset
+                area = dirtyRect.intersected(QRect(layerOffset, self.editingDrawingObject.layerImage.size()))
+                if not area.isEmpty():
+                    canvasPainter.drawImage(area, self.editingDrawingObject.layerImage, area.translated(-layerOffset))
+            self.editingDrawingObject.paint_tip(canvasPainter, window_size)
 
         # もし範囲選択中の場合,
         if self.allow_range_selection and len(self.range_coordinates) == 1:
@@ -694,17 +1632,22 @@ class DrawingApp(QMainWindow):
                 canvasPainter.end()
                 return
 
+        # 頂点にスナップしている場合, スナップ先の頂点に印を描画する.
+        if self.snapTarget is not None and self.snapTarget == self.currentMousePosition:
+            canvasPainter.setPen(QPen(QColor(255, 255, 0, 200), 1))
+            canvasPainter.drawEllipse(self.snapTarget, SNAP_MARKER_RADIUS, SNAP_MARKER_RADIUS)
+
         # もし描画中の場合、
         if self.editingDrawingObject is not None:
 
             # マウスの動きに合わせて線を描画する処理
             if (self.shape == "Line" and self.currentMousePosition is not None and
                     self.editingDrawingObject.object_type == "Line" and
-                    len(self.editingDrawingObject.coordinates) == 1):
+                    self.editingDrawingObject.coordinate_count == 1):
                 # 点線のスタイルを設定
                 pen = QPen(QColor(255, 0, 0, 127), 2, Qt.DotLine)
                 canvasPainter.setPen(pen)
-                canvasPainter.drawLine(self.get_actual_coordinate(self.editingDrawingObject.coordinates[0]),
+                canvasPainter.drawLine(self.get_actual_coordinate(self.editingDrawingObject.point(0)),
                                        self.currentMousePosition,
                                        )
                 canvasPainter.end()
@@ -713,12 +1656,12 @@ class DrawingApp(QMainWindow):
             # 矩形を描画中の場合、マウスの動きに合わせて矩形を描画する処理
             if (self.shape == "Rectangle" and
                 self.currentMousePosition is not None and  # マウストラッキング中のマウスポジションが格納されており,
-                    len(self.editingDrawingObject.coordinates) == 1):  # 矩形の右下が選択されていない場合,
+                    self.editingDrawingObject.coordinate_count == 1):  # 矩形の右下が選択されていない場合,
 
                 # 点線のスタイルを設定して矩形を描画する
                 pen = QPen(QColor(255, 0, 0, 127), 2, Qt.DotLine)
                 canvasPainter.setPen(pen)
-                canvasPainter.drawRect(QRect(self.get_actual_coordinate(self.editingDrawingObject.coordinates[0],
+                canvasPainter.drawRect(QRect(self.get_actual_coordinate(self.editingDrawingObject.point(0),
                                                                         window_size,
                                                                         ),
                                              self.currentMousePosition,
@@ -732,7 +1675,7 @@ class DrawingApp(QMainWindow):
                     self.currentMousePosition is not None):
                 pen = QPen(QColor(255, 0, 0, 127), 2, Qt.DotLine)
                 canvasPainter.setPen(pen)
-                canvasPainter.drawLine(self.get_actual_coordinate(self.editingDrawingObject.coordinates[-1],
+                canvasPainter.drawLine(self.get_actual_coordinate(self.editingDrawingObject.point(-1),
                                                                   window_size,
                                                                   ),
                                        self.currentMousePosition,
@@ -746,14 +1689,15 @@ class DrawingApp(QMainWindow):
             # 線の場合,
             # (備忘：２つめの条件は、オブジェクトを右クリックした直後のself.updateでこの条件分岐に入らないようにするための対策)
             if (self.modifyingDrawingObject.object_type == "Line" and
-                    self.modifyingDrawingObject.modifying_coordinate_index is not None):
+                    self.modifyingDrawingObject.modifying_coordinate_index is not None and
+                    self.currentMousePosition is not None):
 
                 # 固定点を設定
                 fixed_point_index = 0 if self.modifyingDrawingObject.modifying_coordinate_index == 1 else 1
 
                 pen = QPen(QColor(255, 0, 0, 127), 2, Qt.DotLine)
                 canvasPainter.setPen(pen)
-                canvasPainter.drawLine(self.get_actual_coordinate(self.modifyingDrawingObject.coordinates[fixed_point_index],
+                canvasPainter.drawLine(self.get_actual_coordinate(self.modifyingDrawingObject.point(fixed_point_index),
                                                                   window_size,
                                                                   ),
                                        self.currentMousePosition,
@@ -769,7 +1713,7 @@ class DrawingApp(QMainWindow):
 
                 pen = QPen(QColor(255, 0, 0, 127), 2, Qt.DotLine)
                 canvasPainter.setPen(pen)
-                canvasPainter.drawRect(QRect(self.get_actual_coordinate(self.modifyingDrawingObject.coordinates[fixed_point_index],
+                canvasPainter.drawRect(QRect(self.get_actual_coordinate(self.modifyingDrawingObject.point(fixed_point_index),
                                                                         window_size,
                                                                         ),
                                              self.currentMousePosition),
@@ -778,45 +1722,55 @@ class DrawingApp(QMainWindow):
 
             # ポリラインの場合
             elif (self.modifyingDrawingObject.object_type == "PolyLine" and
-                  self.modifyingDrawingObject.modifying_coordinate_index is not None):
+                  self.modifyingDrawingObject.modifying_coordinate_index is not None and
+                  self.currentMousePosition is not None):
 
                 pen = QPen(QColor(255, 0, 0, 127), 2, Qt.DotLine)
                 canvasPainter.setPen(pen)
 
                 # 線を１本だけ引く場合
                 if self.modifyingDrawingObject.modifying_coordinate_index > 0:
-                    canvasPainter.drawLine(self.get_actual_coordinate(self.modifyingDrawingObject.coordinates[self.modifyingDrawingObject.modifying_coordinate_index-1],
+                    canvasPainter.drawLine(self.get_actual_coordinate(self.modifyingDrawingObject.point(self.modifyingDrawingObject.modifying_coordinate_index-1),
                                                                       window_size,
                                                                       ),
                                            self.currentMousePosition,
                                            )
                 # 線を２本だけ引く場合
-                if self.modifyingDrawingObject.modifying_coordinate_index < len(self.modifyingDrawingObject.coordinates)-1:
-                    canvasPainter.drawLine(self.get_actual_coordinate(self.modifyingDrawingObject.coordinates[self.modifyingDrawingObject.modifying_coordinate_index+1],
+                if self.modifyingDrawingObject.modifying_coordinate_index < self.modifyingDrawingObject.coordinate_count-1:
+                    canvasPainter.drawLine(self.get_actual_coordinate(self.modifyingDrawingObject.point(self.modifyingDrawingObject.modifying_coordinate_index+1),
                                                                       window_size,
                                                                       ),
                                            self.currentMousePosition,
                                            )
                 canvasPainter.end()
 
+    def closeEvent(self, event) -> None:
+        """
+        ウィンドウを閉じる時に呼ばれるイベント. 書き込み待ちのジャーナル・プロジェクトを書き出してから閉じる.
+        :param event:
+        :return:
+        """
+        self.dataset.shutdown()
+        self.imageLoader.shutdown(wait=True, cancel_futures=True)
+        self.compositor.shutdown()
+        self.highlight.shutdown()
+        self.journal.close()
+        self.project.close()
+        super().closeEvent(event)
+
+    @profiler.measure("resizeEvent")
     def resizeEvent(self, event) -> None:
         """
         画面がリサイズされた時に呼ばれるイベント.
         :param event:
         :return:
         """
-        # 新しいサイズを取得
-        newSize = self.size()
-
-        # 新しいサイズで新しいイメージを作成し、元のイメージの内容をコピーする.
-        newImage = QImage(newSize, QImage.Format_RGB32)
-        newImage.fill(Qt.white)
-        painter = QPainter(newImage)
-        painter.drawImage(QPointF(0, 0), self.image)
-        painter.end()
-
-        # イメージを更新
-        self.image = newImage
+        # 背景の画像はpaintEventでキャンバスのサイズに拡大・縮小して描画するので, 作り直さない.
+        # 表示位置をキャンバスに収め, オーバーレイはリサイズが止まるまで変更前のタイルを拡大・縮小して表示する.
+        self.setViewport(self.viewZoom, self.viewOffset, preview=True)
+        self.resizeSettleTimer.start()
+        self.renderProgressBar.setGeometry(0, self.height() - 4, self.width(), 4)
+        self.imageProgressBar.setGeometry(0, self.height() - 4, self.width(), 4)
 
         # # ListWidgetの位置を更新する.
         # self.updateListWidgetGeometry()
@@ -824,6 +1778,26 @@ class DrawingApp(QMainWindow):
         # 親クラス側のメソッドも実行する.
         super().resizeEvent(event)
 
+    def onResizeSettled(self) -> None:
+        """
+        リサイズが止まった時に呼ばれる. 表示されている範囲のオーバーレイのタイルをワーカースレッドで作成させる.
+        """
+        self.compositor.rasterizeAsync(self.visibleCanvasRect())
+        self.highlight.rasterizeAsync(self.visibleCanvasRect())
+
+    def onRenderProgress(self, done: int, total: int) -> None:
+        """
+        オーバーレイのタイルをワーカースレッドで作成している間, 進み具合をウィンドウの下端に表示する.
+        :param done: 作成済みのタイルの枚数.
+        :param total: 作成を依頼したタイルの枚数. 全て揃うか取り消されたら表示を消す.
+        """
+        if done >= total:
+            self.renderProgressBar.hide()
+            return
+        self.renderProgressBar.setRange(0, total)
+        self.renderProgressBar.setValue(done)
+        self.renderProgressBar.show()
+
     def findClosestPointAndIndex(self,
                                  _point: QPointF,
                                  _obj: DrawingObject,
@@ -836,66 +1810,30 @@ class DrawingApp(QMainWindow):
         :param _obj: DrawingObjectクラスのインスタンス.
         :return: (coordinatesリストの中で最もmousePointに近い点, その点のインデックス) (QPoint オブジェクト, int).
         """
-        if not _obj.coordinates:
-            return None, -1  # coordinatesリストが空の場合、Noneと-1を返す.
-
-        closestPoint = None
-        closestIndex = -1
-        minDistance = float('inf')
-
-        # マウスクリックの座標を相対座標に変換する.
-        window_size = self.size()
-        _point = QPointF(_point.x() / window_size.width(), _point.y() / window_size.height())
-
-        # 矩形の場合
-        if _obj.object_type == "Rectangle":
-
-            # DrawingObjectの座標なのでここは相対座標.
-            p1 = _obj.coordinates[0]
-            p2 = _obj.coordinates[1]
-
-            # x座標とy座標の最小値と最大値を計算
-            min_x = min(p1.x(), p2.x())
-            max_x = max(p1.x(), p2.x())
-            min_y = min(p1.y(), p2.y())
-            max_y = max(p1.y(), p2.y())
-
-            # 矩形の四隅の座標を計算
-            bottom_left = QPointF(min_x, min_y)  # type: QPointF
-            bottom_right = QPointF(max_x, min_y)
-            top_left = QPointF(min_x, max_y)
-            top_right = QPointF(max_x, max_y)
-
-            _coordinates = [bottom_left, bottom_right, top_right, top_left]
-
+        # マウスクリックの座標を相対座標に変換し, 最も近い頂点を探す. 矩形の場合は四隅から探す.
+        # 長いポリラインでも周囲の頂点だけを調べるよう, まずVertexIndexで近くを探し, 無ければ全頂点から探す.
+        size = self.canvasSize().toTuple()
+        x, y = to_relative(_point.x(), _point.y(), size)
+        hit = None
+        if _obj.key in self.vertexIndex:
+            hit = self.vertexIndex.nearest(x, y, size, VERTEX_SEARCH_RADIUS, key=_obj.key)
+        if hit is not None:
+            _, closestIndex, closestPoint = hit
         else:
-            _coordinates = _obj.coordinates
-
-        for index, point in enumerate(_coordinates):
-            distance = (_point.x() - point.x()) ** 2 + (_point.y() - point.y()) ** 2
-            if distance < minDistance:
-                minDistance = distance
-                closestPoint = point
-                closestIndex = index
+            closestIndex, closestPoint = HitTest.closest_vertex(_obj, x, y)
+        if closestIndex < 0:
+            return None, -1  # coordinatesリストが空の場合、Noneと-1を返す.
 
         if _obj.object_type == "Rectangle":
 
-            if closestIndex == 0:  # bottom_left
-                modified_coordinate = [bottom_left, top_right]
-            elif closestIndex == 1:  # bottom_right
-                modified_coordinate = [bottom_right, top_left]
-            elif closestIndex == 2:  # top_right
-                modified_coordinate = [top_right, bottom_left]
-            elif closestIndex == 3:  # top_left
-                modified_coordinate = [top_left, bottom_right]
-            else:
-                modified_coordinate = None
-
-            self.modifyingDrawingObject.coordinates = modified_coordinate
-            return modified_coordinate[0], 0
+            # ドラッグする角を先頭, その対角を2番目の座標にする.
+            self.modifyingDrawingObject.coordinates = HitTest.rectangle_drag_points(_obj.relative_bounds(),
+                                                                                    closestIndex)
+            return self.modifyingDrawingObject.point(0), 0
 
-        return closestPoint, closestIndex
+        return QPointF(*closestPoint.tolist()), closestIndex
 
+    @profiler.measure("hitTest")
     def findClosestObject(self, _point: QPointF) -> DrawingObject:
         """
         マウスポイントから最も近い位置にあるDrawingObjectクラスのインスタンスを返す.
@@ -905,99 +1843,87 @@ class DrawingApp(QMainWindow):
         :return: _pointに最も近いDrawingObjectクラスのインスタンス.
         """
 
-        window_size = self.size()
-
-        # 検索対象のオブジェクトの辞書型を指定できるようにしても良い.
-        for d in [self.linesDict, self.rectAngleDict, self.polyLinesDict]:
-
-            # マウスポインタの座標が既に描画された線や矩形の近くである場合
-            for k, v in d.items():
-                # key  : object's id
-                # value: DrawingObject class instance.
+        window_size = self.canvasSize()
 
-                # ShapelyのLineStringに変換
-                each_linestring = self.point2linestring(_obj=v, window_size=window_size)
+        # 空間インデックスから、外接矩形がマウスポインタ周辺(MARGIN)に掛かるオブジェクトだけを候補にする.
+        # marginは絶対座標なので相対座標に変換して渡す.
+        candidates = self.spatialIndex.query_point(_point.x() / window_size.width(),
+                                                   _point.y() / window_size.height(),
+                                                   MARGIN / window_size.width(),
+                                                   MARGIN / window_size.height(),
+                                                   )
 
-                # marginを追加
-                each_linestring_margin = each_linestring.buffer(MARGIN)
+        # 線, 矩形, ポリラインの順に, 作成された順で調べる.
+        for object_type, object_id in sorted(candidates, key=lambda k: (DrawingObject.TYPES.index(k[0]), k[1])):
+            v = self.objectDict[object_type][object_id]
 
-                # 右クリックした時のマウス座標が、marginの中なら,
-                if each_linestring_margin.contains(Point(_point.x(), _point.y())):
-                    return v
+            # marginを追加したLineString（キャッシュ済み）の中にマウス座標があれば,
+            if self.geometryCache.contains(v, window_size.toTuple(), _point.x(), _point.y()):
+                return v
 
         # 見つからなければNoneを返す
         return None
 
-    def isInsideOfRect(self, point_list: list) -> list:
+    @profiler.measure("isInsideOfRect")
+    def isInsideOfRect(self, point_list: list, mode: str = None) -> list:
         """
         QPoint型の2点から成る矩形の中に含まれるDrawingObject型変数を探す.
+        全オブジェクトの頂点をまとめたNumPy配列(self.vertexArrays)に対して一括で判定する.
 
         :param point_list: 矩形を定義する2点のQPoint型変数. 絶対座標系.
-        :return: 描画した矩形の領域内に含まれるDrawingObjectクラスを要素とした配列.
+        :param mode: 範囲選択の方法. 指定しない場合はself.rangeSelectionMode.
+        :return: 描画した矩形の領域内に含まれるDrawingObjectクラスを要素とした配列. 選択はselectObjectsで行う.
         """
-        # 範囲選択した矩形をQRect型で定義.
-        rect = QRect(point_list[0], point_list[1])
+        mode = self.rangeSelectionMode if mode is None else mode
 
-        # 矩形内に含まれるDrawingObject型変数を格納するリスト
-        inside_list = []
+        # 現在のキャンバスのサイズ.
+        window_size = self.canvasSize()
 
-        # 現在の画面のサイズ.
-        window_size = self.size()
+        # 座標が変わったオブジェクトがあれば配列を作り直し,
+        self.vertexArrays.ensure(_obj for d in self.objectDict.values() for _obj in d.values())
 
-        # 線やポリラインの場合,
-        for d in [self.linesDict, self.polyLinesDict]:
+        # 範囲選択した矩形に含まれるオブジェクトを一括で特定する.
+        selected_keys = self.vertexArrays.select_in_rect((point_list[0].x(), point_list[0].y(),
+                                                          point_list[1].x(), point_list[1].y()),
+                                                         (window_size.width(), window_size.height()),
+                                                         mode,
+                                                         )
 
-            # 各オブジェクトごとの,
-            for each_object in d.values():
+        # 矩形内に含まれるDrawingObject型変数のリスト
+        return [self.objectDict[object_type][object_id] for object_type, object_id in selected_keys]
 
-                isinsideflag = False
-
-                # 各相対座標点ごとに,
-                for relative_p in each_object.coordinates:
-
-                    # QRect.contains()はintしかダメなので, QPointを使う.
-                    abs_p = QPoint(int(relative_p.x()*window_size.width()),
-                                   int(relative_p.y()*window_size.height()),
-                                   )
-
-                    # 点が矩形に含まれれば
-                    if rect.contains(abs_p):
-
-                        # フラグを立てる.
-                        isinsideflag = True
-
-                # 1つでも含まれている点があれば,
-                if isinsideflag:
-
-                    # リストに加える.
-                    inside_list.append(each_object)
-
-        # 矩形の場合,
-        for each_object in self.rectAngleDict.values():
-
-            # QRectを作り,
-            target_rect = QRect(self.get_actual_coordinate(each_object.coordinates[0], window_size),
-                                self.get_actual_coordinate(each_object.coordinates[1], window_size),
-                                )
-
-            # 範囲選択した領域に矩形の各頂点が含まれるか確認し,
-            check_tr = rect.contains(target_rect.topRight())
-            check_tl = rect.contains(target_rect.topLeft())
-            check_br = rect.contains(target_rect.bottomRight())
-            check_bl = rect.contains(target_rect.bottomLeft())
-
-            # 四隅のどれかが含まれる場合,
-            if check_tr or check_tl or check_br or check_bl:
+    def selectObjects(self, objects) -> None:
+        """
+        オブジェクトを選択に加え, 強調表示用のオーバーレイ(self.highlight)に登録する.
+        オブジェクトの色は変えないので, 通常のオーバーレイのタイルは作り直さない.
+        多数のオブジェクトを選択した場合, 強調表示のタイルはワーカースレッドで作成される.
 
-                # リストに加える.
-                inside_list.append(each_object)
+        :param objects: DrawingObjectクラスの変数のiterable. 選択済みのオブジェクトは無視する.
+        :return:
+        """
+        with self.highlight.batch(self.visibleCanvasRect()):
+            for _obj in objects:
+                if _obj.key not in self.selection:
+                    self.selection.add(_obj.key)
+                    self.updateCanvas(self.highlight.updateObject(_obj))
 
-        # 最後に一気に色を変える.
-        for each_object in inside_list:
-            each_object.color = QColor(0, 255, 0, 127)
-        inside_list = [self.setDrawLayer(x) for x in inside_list]
+    def clearSelection(self) -> None:
+        """
+        選択を全て解除する. 強調表示用のオーバーレイを空にするだけで, オブジェクトは再描画しない.
+        :return:
+        """
+        if not self.selection:
+            return
+        self.selection.clear()
+        self.highlight.clear()
+        self.update()
 
-        return inside_list
+    def selectedObjects(self) -> list:
+        """
+        選択中のオブジェクトを返す.
+        :return: DrawingObjectクラスの変数のリスト（keyの順）.
+        """
+        return [self.objectDict[object_type][object_id] for object_type, object_id in sorted(self.selection)]
 
     def switchRangeSelectionState(self, state):
         """
@@ -1007,32 +1933,20 @@ class DrawingApp(QMainWindow):
         :param state:  チェックされたかどうかを示すint型. チェックされたら2.
         :return:
         """
-        def resetColor():
-            """
-            現在選択されているオブジェクトの色をリセットする内部関数.
-            :return:
-            """
-            for each_selected_object in self.selected_object:
-                # 何かしら選択状態であるオブジェクトの色を元に戻す処理を入れる.
-                each_selected_object.set_color()
-                _ = self.setDrawLayer(each_selected_object)
-
         # チェックが入った時.
         # PySide6.QtCore.Qt.CheckState型に合わせ、両者を比較する.
         if Qt.CheckState(state) == Qt.Checked:
 
             # 既に選択済みのオブジェクトがあれば、一度リセットする
             # Todo: UXを検証すること. もしかしたらいらないかも.
-            resetColor()
-            self.selected_object = []
+            self.clearSelection()
             self.allow_range_selection = True
 
         # チェックが解除された時.
         else:
             self.allow_range_selection = False
-            resetColor()
             # 選択したオブジェクトを解除する.
-            self.selected_object = []
+            self.clearSelection()
             self.range_coordinates = []
             self.update()
 
@@ -1047,6 +1961,80 @@ class DrawingApp(QMainWindow):
     #     y = 0  # ウィンドウの上端から始める
     #     self.objectListWidget.setGeometry(x, y, width, height)
 
+    def findSnapVertex(self, position: QPoint):
+        """
+        頂点スナップが有効な場合, positionからSNAP_RADIUSピクセル以内で最も近い確定済みのオブジェクトの頂点を探す.
+        修正中のオブジェクト自身の頂点にはスナップしない.
+
+        :param position: マウスの位置. 絶対座標系.
+        :return: 頂点の相対座標のQPointF. 無効な場合や近くに頂点が無い場合はNone.
+        """
+        if not self.snapping:
+            return None
+        size = self.canvasSize().toTuple()
+        exclude = None if self.modifyingDrawingObject is None else self.modifyingDrawingObject.key
+        hit = self.vertexIndex.nearest(*to_relative(position.x(), position.y(), size), size, SNAP_RADIUS,
+                                       exclude=exclude)
+        return None if hit is None else QPointF(*hit[2].tolist())
+
+    def snapCoordinate(self, position: QPoint) -> QPointF:
+        """
+        クリックした位置を新しい頂点の相対座標に変換する.
+        近くにスナップできる頂点があれば, その頂点と全く同じ相対座標にする（隣接する領域で境界を共有できる）.
+
+        :param position: クリックした位置. 絶対座標系.
+        :return: 相対座標のQPointF.
+        """
+        vertex = self.findSnapVertex(position)
+        return self.get_relative_coordinate(position) if vertex is None else vertex
+
+    def startTrace(self) -> None:
+        """
+        編集中のPolyLineの末尾の頂点から, なぞり描きを開始する.
+        :return:
+        """
+        x, y = to_absolute_point(*self.editingDrawingObject.points[-1].tolist(), self.canvasSize().toTuple())
+        self.tracer = TraceSimplifier(self.traceTolerance)
+        self.tracer.start(x, y)
+        self.tracedVersion = self.editingDrawingObject.version
+
+    def traceTo(self, position: QPoint) -> None:
+        """
+        なぞり描きの軌跡の点を簡略化に渡し, 結果に従って編集中のPolyLineの末尾の頂点を追加・置き換える.
+        :param position: マウスの位置. 絶対座標系.
+        :return:
+        """
+        result = self.tracer.push(position.x(), position.y())
+        if result == TraceSimplifier.APPENDED:
+            self.editingDrawingObject.append_coordinate(self.get_relative_coordinate(position))
+        elif result == TraceSimplifier.MOVED:
+            self.editingDrawingObject.replace_coordinate(self.editingDrawingObject.coordinate_count - 1,
+                                                         self.get_relative_coordinate(position))
+
+    def finishTrace(self, position: QPoint) -> None:
+        """
+        なぞり描きを終了する. 終点は近くの頂点にスナップする.
+        :param position: ボタンを離した位置. 絶対座標系.
+        :return:
+        """
+        self.traceTo(position)
+        vertex = self.findSnapVertex(position)
+        if vertex is not None and self.editingDrawingObject.coordinate_count >= 2:
+            self.editingDrawingObject.replace_coordinate(self.editingDrawingObject.coordinate_count - 1, vertex)
+        self.tracer = None
+        self.tracedVersion = None
+        self.setDrawLayer(self.editingDrawingObject)
+
+    def switchSnappingState(self, state) -> None:
+        """
+        頂点スナップの有効・無効を切り替える. 「頂点スナップ」チェックボックスのイベントハンドラ.
+        :param state: チェックされたかどうかを示すint型. チェックされたら2.
+        :return:
+        """
+        self.snapping = Qt.CheckState(state) == Qt.Checked
+        self.snapTarget = None
+        self.updateCanvas(self.previewRect)
+
     def get_relative_coordinate(self, abs_coord: QPointF):
         """
         インポートした画面サイズに対する座標の相対座標を算出する関数.
@@ -1054,9 +2042,7 @@ class DrawingApp(QMainWindow):
         :param abs_coord:
         :return:
         """
-        relative_coord_width = abs_coord.x() / self.size().width()
-        relative_coord_height = abs_coord.y() / self.size().height()
-        return QPointF(relative_coord_width, relative_coord_height)
+        return QPointF(*to_relative(abs_coord.x(), abs_coord.y(), self.canvasSize().toTuple()))
 
     def get_actual_coordinate(self, relative_coord: QPointF,
                               window_size: QSize = None,
@@ -1070,67 +2056,12 @@ class DrawingApp(QMainWindow):
         :param isReturnInt: QPoint型で返すかどうか.
         :return:
         """
-        window_size = self.size() if window_size is None else window_size
-        actual_coord_width = relative_coord.x() * window_size.width()
-        actual_coord_height = relative_coord.y() * window_size.height()
-        print(f"width: {actual_coord_width}")
-        print(f"height: {actual_coord_height}")
+        window_size = self.canvasSize() if window_size is None else window_size
+        x, y = to_absolute_point(relative_coord.x(), relative_coord.y(), window_size.toTuple())
         if isReturnInt:
-            return QPoint(int(actual_coord_width), int(actual_coord_height))
+            return QPoint(int(x), int(y))
         else:
-            return QPointF(actual_coord_width, actual_coord_height)
-
-    def point2linestring(self, _obj: DrawingObject,
-                         window_size: QSize = None) -> LineString:
-        """
-        QPoint型のPoint情報を使って、LineString型変数を返す関数.
-        :param _obj: DrawingObjectクラス変数
-        :param window_size: 絶対座標に戻すために必要なwindow_size.
-        :return:
-        """
-
-        # 矩形の場合
-        if _obj.object_type == "Rectangle":
-
-            p1 = _obj.coordinates[0]
-            p2 = _obj.coordinates[1]
-
-            p1 = self.get_actual_coordinate(p1, window_size)
-            p2 = self.get_actual_coordinate(p2, window_size)
-
-            # x座標とy座標の最小値と最大値を計算
-            min_x = min(p1.x(), p2.x())
-            max_x = max(p1.x(), p2.x())
-            min_y = min(p1.y(), p2.y())
-            max_y = max(p1.y(), p2.y())
-
-            # 矩形の四隅の座標を計算
-            bottom_left = (min_x, min_y)
-            bottom_right = (max_x, min_y)
-            top_left = (min_x, max_y)
-            top_right = (max_x, max_y)
-
-            # LineString用の座標が格納された配列.
-            linestring_ary = [bottom_left, bottom_right, top_right, top_left, bottom_left]
-
-        elif _obj.object_type == "Line":
-            linestring_ary = []
-            for x in _obj.coordinates:
-                act_coordinate = self.get_actual_coordinate(x, window_size)
-                linestring_ary.append((act_coordinate.x(), act_coordinate.y()))
-
-        elif _obj.object_type == "PolyLine":
-            linestring_ary = []
-            for x in _obj.coordinates:
-                act_coordinate = self.get_actual_coordinate(x, window_size)
-                linestring_ary.append((act_coordinate.x(), act_coordinate.y()))
-
-        else:
-            assert f"invalid object_type: {_obj.object_type}"
-            return
-
-        # Polygon オブジェクトを作成して矩形を定義
-        return LineString(linestring_ary)  # type: LineString
+            return QPointF(x, y)
 
 
 def main():
@@ -0,0 +1,57 @@
+import os
+
+import numpy as np
+import pytest
+
+from core import AnnotationFile
+from core.Annotation import Annotation
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def sample_objects() -> list:
+    return [Annotation(0, "Line", [(0.1, 0.2), (0.3, 0.4)]),
+            Annotation(3, "Rectangle", [(0.5, 0.5), (0.75, 0.9)], rgba=(1, 2, 3, 4), line_thickness=5),
+            Annotation(1, "PolyLine", np.linspace(0.0, 1.0, 200).reshape(-1, 2)),
+            ]
+
+
+def summary(objects) -> list:
+    return [(_obj.key, _obj.points.tolist(), _obj.custom_rgba, _obj.line_thickness) for _obj in objects]
+
+
+@pytest.mark.parametrize("name", ["drawing.json", "drawing.drwb"])
+def test_round_trip(tmp_path, name):
+    path = str(tmp_path / name)
+    assert AnnotationFile.save(path, iter(sample_objects()), (640, 480)) == 3
+
+    objects, image_size = AnnotationFile.load(path)
+    assert summary(objects) == summary(sample_objects())
+    assert image_size == (640, 480)
+    assert os.listdir(tmp_path) == [name]
+
+
+@pytest.mark.parametrize("name", ["drawing.json", "drawing.drwb"])
+def test_failed_save_keeps_the_previous_file(tmp_path, name):
+    path = str(tmp_path / name)
+    AnnotationFile.save(path, sample_objects()[:1])
+
+    def broken():
+        yield from sample_objects()
+        raise RuntimeError("save interrupted")
+
+    with pytest.raises(RuntimeError):
+        AnnotationFile.save(path, broken())
+
+    objects, _ = AnnotationFile.load(path)
+    assert summary(objects) == summary(sample_objects()[:1])
+    assert os.listdir(tmp_path) == [name]
+
+
+def test_legacy_import():
+    objects, image_size = AnnotationFile.load(os.path.join(REPOSITORY, "test.txt"), (1600, 1000))
+    assert image_size is None
+    assert [_obj.key for _obj in objects] == [("Rectangle", 0), ("Rectangle", 1), ("Rectangle", 2),
+                                              ("PolyLine", 0), ("PolyLine", 1)]
+    assert objects[0].points.tolist() == [[539 / 1600, 324 / 1000], [590 / 1600, 380 / 1000]]
+    assert objects[4].coordinate_count == 9
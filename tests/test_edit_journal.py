@@ -0,0 +1,110 @@
+import json
+import os
+import shutil
+
+from EditJournal import EditJournal
+from core.Annotation import Annotation
+
+
+def make_journal(**kwargs) -> EditJournal:
+    # テストでは書き込みを待たないよう, fsyncの間隔を短くする.
+    return EditJournal(flush_interval=0.01, **kwargs)
+
+
+def summary(objects) -> list:
+    return [(_obj.key, _obj.points.tolist()) for _obj in objects]
+
+
+def test_records_are_recovered(tmp_path):
+    image = str(tmp_path / "image.png")
+    journal = make_journal()
+    assert journal.open(image) is None
+    assert os.listdir(tmp_path) == []  # 編集するまではファイルを作らない.
+
+    line = Annotation(0, "Line", [(0.1, 0.2), (0.3, 0.4)])
+    polyline = Annotation(0, "PolyLine", [(0.5, 0.5), (0.6, 0.7), (0.8, 0.9)])
+    journal.record(line)
+    journal.record(polyline)
+    polyline.replace_point(1, 0.65, 0.75)
+    journal.record(polyline)
+    journal.remove(line.key)
+    journal.close()
+
+    recovered = make_journal().open(image)
+    assert summary(recovered) == summary([polyline])
+
+
+def test_torn_last_line_is_ignored(tmp_path):
+    image = str(tmp_path / "image.png")
+    journal = make_journal()
+    journal.open(image)
+    journal.record(Annotation(0, "Line", [(0.1, 0.2), (0.3, 0.4)]))
+    journal.close()
+
+    # 書き込み途中で落ちた最後の行.
+    with open(image + ".journal", "a", encoding="utf-8") as file:
+        file.write('{"op": "put", "type": "Line", "id": 1, "coordin')
+
+    recovered = make_journal().open(image)
+    assert [_obj.key for _obj in recovered] == [("Line", 0)]
+
+
+def test_stale_generation_journal_is_not_replayed(tmp_path):
+    image = str(tmp_path / "image.png")
+    journal = make_journal()
+    journal.open(image)
+    journal.record(Annotation(0, "Line", [(0.1, 0.2), (0.3, 0.4)]))
+    journal.compact([Annotation(0, "Rectangle", [(0.1, 0.1), (0.2, 0.2)])])
+    journal.close()
+
+    # スナップショットの置き換え後, ジャーナルを切り詰める前に落ちた状態: ジャーナルは古い世代のまま.
+    with open(image + ".journal", "w", encoding="utf-8") as file:
+        file.write(json.dumps({"op": "begin", "generation": 0}) + "\n")
+        file.write(json.dumps({"op": "put", "type": "Line", "id": 5, "coordinates": [[0, 0], [1, 1]]}) + "\n")
+
+    recovered = make_journal().open(image)
+    assert [_obj.key for _obj in recovered] == [("Rectangle", 0)]
+
+
+def test_rotation_keeps_only_the_latest_snapshot(tmp_path):
+    image = str(tmp_path / "image.png")
+    journal = make_journal(min_compact_bytes=0)
+    journal.open(image)
+    objects = []
+    for i in range(5):
+        objects.append(Annotation(i, "PolyLine", [(0.1 * i, 0.1), (0.2, 0.3), (0.4, 0.5)]))
+        journal.record(objects[-1])
+        journal.maybe_compact(lambda: objects)
+    journal.record(Annotation(9, "Line", [(0.0, 0.0), (0.5, 0.5)]))
+    journal.flush()
+
+    assert journal.compactions > 1
+    snapshots = [name for name in os.listdir(tmp_path) if ".snapshot." in name]
+    assert snapshots == [f"image.png.snapshot.{journal.generation}.drwb"]
+    journal.close()
+
+    recovered = make_journal().open(image)
+    assert [_obj.key for _obj in recovered] == [("Line", 9)] + [("PolyLine", i) for i in range(5)]
+
+
+def test_write_failure_stops_the_journal(tmp_path):
+    folder = tmp_path / "images"
+    folder.mkdir()
+    image = str(folder / "image.png")
+    errors = []
+    journal = make_journal(on_error=errors.append)
+    journal.open(image)
+    shutil.rmtree(folder)
+
+    journal.record(Annotation(0, "Line", [(0.1, 0.2), (0.3, 0.4)]))
+    journal.flush()  # 書き込みスレッドが止まっていても待ち続けない.
+    assert isinstance(journal.error, OSError)
+    assert len(errors) == 1
+    assert not journal.is_active
+
+    # 止まった後の編集は記録せず, compactもファイルに触れない.
+    journal.record(Annotation(1, "Line", [(0.1, 0.2), (0.3, 0.4)]))
+    journal.compact([])
+    journal.flush()
+    journal.close()
+    assert journal.error is None
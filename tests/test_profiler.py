@@ -0,0 +1,26 @@
+from Profiler import Profiler
+
+
+def test_skipped_frame_is_not_recorded(tmp_path):
+    profiler = Profiler(enabled=True)
+
+    @profiler.measure("paintEvent", frame=True)
+    def paint(hud_only: bool) -> None:
+        if hud_only:
+            profiler.skip_frame()
+        with profiler.timer("draw"):
+            pass
+
+    profiler.record("mouseMoveEvent", 0.001)
+    paint(False)
+    profiler.record("mouseMoveEvent", 0.002)
+    paint(True)
+    paint(False)
+
+    # HUDだけの再描画は行にもパーセンタイルにも含まれず, その前の処理時間は次のフレームに入る.
+    assert profiler.export_csv(str(tmp_path / "frames.csv")) == 2
+    assert len(profiler._samples["paintEvent"]) == 2
+    assert len(profiler._samples["draw"]) == 2
+    frames = [timings for _, _, timings in profiler._frames]
+    assert frames[0]["mouseMoveEvent"] == 0.001
+    assert frames[1]["mouseMoveEvent"] == 0.002
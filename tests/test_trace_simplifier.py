@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from core.TraceSimplifier import TraceSimplifier
+
+
+def simplify_trace(samples: np.ndarray, tolerance: float, max_window: int = TraceSimplifier.MAX_WINDOW) -> np.ndarray:
+    # main.pyと同じく, pushの戻り値に従って頂点の配列を更新する.
+    tracer = TraceSimplifier(tolerance, max_window)
+    tracer.start(*samples[0])
+    vertices = [tuple(samples[0])]
+    for x, y in samples[1:]:
+        result = tracer.push(x, y)
+        if result == TraceSimplifier.APPENDED:
+            vertices.append((x, y))
+        elif result == TraceSimplifier.MOVED:
+            vertices[-1] = (x, y)
+    return np.array(vertices)
+
+
+def max_deviation(samples: np.ndarray, vertices: np.ndarray) -> float:
+    """
+    各点から頂点を結ぶ折れ線までの距離の最大値.
+    """
+    if len(vertices) == 1:
+        return float(np.hypot(*(samples - vertices[0]).T).max())
+    a, b = vertices[:-1], vertices[1:]
+    d = b - a
+    length2 = np.maximum((d ** 2).sum(axis=1), 1e-12)
+    p = samples[:, None, :] - a[None, :, :]
+    t = np.clip((p * d[None]).sum(axis=2) / length2, 0.0, 1.0)
+    distances = np.hypot(*(p - t[:, :, None] * d[None]).transpose(2, 0, 1))
+    return float(distances.min(axis=1).max())
+
+
+@pytest.mark.parametrize("max_window", [TraceSimplifier.MAX_WINDOW, 8])
+def test_random_walk_stays_within_tolerance(max_window):
+    rng = np.random.default_rng(0)
+    samples = np.cumsum(rng.normal(0.0, 1.0, (5000, 2)), axis=0)
+    vertices = simplify_trace(samples, 2.0, max_window)
+    assert len(vertices) < len(samples) // 2
+    assert max_deviation(samples, vertices) <= 2.0 + 1e-9
+
+
+def test_straight_line_keeps_a_vertex_per_window():
+    samples = np.column_stack([np.linspace(0.0, 500.0, 1000), np.full(1000, 10.0)])
+    vertices = simplify_trace(samples, 1.5)
+    # 区間がMAX_WINDOW点で一杯になるたびに頂点を確定する.
+    assert len(vertices) <= len(samples) // TraceSimplifier.MAX_WINDOW + 2
+    assert vertices[0].tolist() == [0.0, 10.0] and vertices[-1].tolist() == [500.0, 10.0]
+    assert (vertices[:, 1] == 10.0).all()